@@ -0,0 +1,210 @@
+"""Evaluate the accuracy and speed of the decoding strategies side by side.
+
+Decodes a labelled corpus with each strategy and reports the fraction of
+pages decoded correctly, the mojibake rate, i.e. the fraction of non-ASCII
+characters decoded wrongly, and the throughput. The strategies are:
+
+full:          no fast paths; prescan and detection over the entire page
+default:       decode_html()'s defaults
+sampled-4k:    detection on a 4 KB sample rather than the default 64 KB
+prescan-only:  no statistical detection; BOM, declarations, ASCII/UTF-8
+               checks and fallbacks only
+hints:         a warm hint cache, as when crawling many pages of each site
+
+The corpus is benchmarks.corpus.LABELLED_CASES, or real pages labelled with
+their encodings; see benchmarks.corpus.load_corpus(). Results may be saved
+as JSON and later runs compared against them, exiting with a non-zero
+status if the accuracy of any strategy dropped:
+
+    PYTHONPATH=src python -m benchmarks.bench_accuracy --output before.json
+    PYTHONPATH=src python -m benchmarks.bench_accuracy --compare before.json
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import timeit
+
+from htmldammit.core import decode_html_result
+from htmldammit.detectors import get_detector
+from htmldammit.hints import EncodingHintCache
+
+from benchmarks.common import print_table
+from benchmarks.corpus import LABELLED_CASES, load_corpus, make_corpus
+
+
+SIZES = [1024, 16 * 1024, 256 * 1024]
+
+# (name, decode_html_result() keyword arguments) pairs
+STRATEGIES = [
+    ('full', dict(prescan_bytes=None, trusted_fast_path=False,
+                  utf8_fast_path=False, detection_sample_bytes=None)),
+    ('default', {}),
+    ('sampled-4k', dict(detection_sample_bytes=4 * 1024)),
+    ('prescan-only', dict(detector='none')),
+    ('hints', {}),
+]
+STRATEGY_NAMES = [name for (name, _kwargs) in STRATEGIES]
+
+RESULTS_VERSION = 1
+
+
+def count_mojibake(expected, text):
+    """count the non-ASCII characters of the expected text decoded wrongly
+
+    This compares the non-ASCII characters of both texts position by
+    position, which is exact for single-byte encodings and an approximation
+    otherwise.
+
+    @return: a (wrong, total) tuple
+    """
+    expected_chars = [c for c in expected if ord(c) >= 0x80]
+    chars = [c for c in text if ord(c) >= 0x80]
+    wrong = sum(1 for (a, b) in zip(expected_chars, chars) if a != b)
+    wrong += abs(len(expected_chars) - len(chars))
+    return min(wrong, len(expected_chars)), len(expected_chars)
+
+
+def _time_per_call(func, min_total_time):
+    """time a no-argument callable; return seconds per call (best of 3)
+
+    Unlike common.time_per_call(), this takes about min_total_time even when
+    it is short, since there are many pages to time.
+    """
+    timer = timeit.Timer(func)
+    first = timer.timeit(1)
+    number = max(1, int(min_total_time / 3 / max(first, 1e-9)))
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def _page_name(case, size):
+    return '{}/{}'.format(case.name, size)
+
+
+def evaluate(corpus, strategy_kwargs, min_total_time, use_hints=False):
+    """decode a corpus with a strategy; return a dict of results"""
+    kwargs = dict(strategy_kwargs)
+    if use_hints:
+        # warm the cache by decoding every page once, as a crawler would
+        kwargs['hint_cache'] = hint_cache = EncodingHintCache()
+        for (case, _size, raw_html, _html) in corpus:
+            decode_html_result(raw_html, case.http_headers,
+                               hint_cache=hint_cache, url=case.url)
+
+    n_bytes = n_seconds = n_correct = n_wrong_chars = n_chars = 0
+    wrong_pages = []
+    for (case, size, raw_html, html) in corpus:
+        url = case.url if use_hints else None
+        text = decode_html_result(raw_html, case.http_headers, url=url,
+                                  **kwargs).text
+        wrong, total = count_mojibake(html, text)
+        n_wrong_chars += wrong
+        n_chars += total
+        if text == html:
+            n_correct += 1
+        else:
+            wrong_pages.append(_page_name(case, size))
+
+        n_seconds += _time_per_call(
+            lambda: decode_html_result(raw_html, case.http_headers, url=url,
+                                       **kwargs),
+            min_total_time)
+        n_bytes += len(raw_html)
+
+    return {
+        'pages': len(corpus),
+        'accuracy': n_correct / float(len(corpus)),
+        'mojibake_rate': n_wrong_chars / float(n_chars) if n_chars else 0.0,
+        'mb_per_s': n_bytes / n_seconds / 1e6,
+        'wrong_pages': wrong_pages,
+    }
+
+
+def print_results(results, previous=None):
+    def with_change(name, metric, fmt):
+        value = fmt.format(results[name][metric])
+        if previous is not None and name in previous:
+            change = results[name][metric] - previous[name][metric]
+            value += ' ({})'.format(
+                fmt.replace(':', ':+').format(change))
+        return value
+
+    print_table(['strategy', 'pages', 'accuracy', 'mojibake', 'MB/s'], [
+        [name, results[name]['pages'],
+         with_change(name, 'accuracy', '{:.1%}'),
+         with_change(name, 'mojibake_rate', '{:.2%}'),
+         with_change(name, 'mb_per_s', '{:.1f}')]
+        for name in STRATEGY_NAMES if name in results
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus-dir',
+                        help='a directory with a labelled corpus')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='page sizes of the generated corpus, in bytes')
+    parser.add_argument('--strategies', nargs='+', choices=STRATEGY_NAMES,
+                        default=STRATEGY_NAMES)
+    parser.add_argument('--detector',
+                        help='the statistical detection backend to use')
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='minimal total time per page, in seconds')
+    parser.add_argument('--verbose', action='store_true',
+                        help='list the wrongly decoded pages')
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--compare', help='previous results to compare with')
+    args = parser.parse_args(argv)
+
+    if args.corpus_dir:
+        corpus = load_corpus(args.corpus_dir)
+    else:
+        corpus = make_corpus(args.sizes, cases=LABELLED_CASES)
+    detector = get_detector(args.detector)
+    print('{} pages, detector: {}'.format(len(corpus), detector.name))
+
+    results = {}
+    for (name, kwargs) in STRATEGIES:
+        if name not in args.strategies:
+            continue
+        kwargs = dict(kwargs)
+        kwargs.setdefault('detector', detector)
+        results[name] = evaluate(corpus, kwargs, args.min_time,
+                                 use_hints=(name == 'hints'))
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous.get('version') != RESULTS_VERSION:
+            raise ValueError('unsupported results version: {!r}'.format(
+                previous.get('version')))
+        previous = previous['strategies']
+    print_results(results, previous)
+
+    if args.verbose:
+        for name in STRATEGY_NAMES:
+            if results.get(name, {}).get('wrong_pages'):
+                print()
+                print('{} decoded wrongly:'.format(name))
+                for page_name in results[name]['wrong_pages']:
+                    print('  ' + page_name)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'version': RESULTS_VERSION,
+                'detector': detector.name,
+                'strategies': results,
+            }, f, indent=1, sort_keys=True)
+
+    if previous is not None and any(
+            results[name]['accuracy'] < previous[name]['accuracy']
+            for name in results if name in previous):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""Measure the scaling of decode_html_batch() with the number of workers.
+
+Decodes a corpus of undeclared, legacy-encoded pages, which require
+statistical detection, serially and with process pools of increasing size.
+"""
+from __future__ import print_function
+
+import multiprocessing
+import time
+
+from htmldammit.batch import decode_html_batch
+from htmldammit.core import decode_html_result
+
+from benchmarks.common import SAMPLE_TEXTS, make_page, print_table
+
+
+PAGE_SIZE = 64 * 1024
+PAGES_PER_ENCODING = 20
+
+
+def make_corpus():
+    corpus = []
+    for (text, encodings) in SAMPLE_TEXTS.values():
+        for encoding in encodings:
+            raw_html = make_page(PAGE_SIZE, encoding, declare_charset=False,
+                                 text=text)
+            corpus.extend([(raw_html, None)] * PAGES_PER_ENCODING)
+    return corpus
+
+
+def main():
+    corpus = make_corpus()
+    n_cpus = multiprocessing.cpu_count()
+    print('{} pages, {} CPUs'.format(len(corpus), n_cpus))
+
+    start = time.time()
+    for (raw_html, http_headers) in corpus:
+        decode_html_result(raw_html, http_headers)
+    serial_time = time.time() - start
+    rows = [['serial', '{:.2f}'.format(serial_time), '1.00']]
+
+    n_workers = 1
+    while n_workers <= max(2, n_cpus):
+        start = time.time()
+        for _ in decode_html_batch(corpus, max_workers=n_workers):
+            pass
+        elapsed = time.time() - start
+        rows.append([
+            '{} processes'.format(n_workers), '{:.2f}'.format(elapsed),
+            '{:.2f}'.format(serial_time / elapsed),
+        ])
+        n_workers *= 2
+    print_table(['mode', 'seconds', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
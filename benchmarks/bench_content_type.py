@@ -0,0 +1,144 @@
+"""Measure the cost of Content-Type header handling on small responses.
+
+Compares reading is_html and charset via the former implementation, which
+searched the header value with a regular expression on every access, with
+ContentTypeHeader, which parses the value once, and parse_content_type(),
+which also reuses the parsed values. Also times decode_html_result() on a
+small page with and without the parse_content_type() cache.
+
+Finally, times get_content_type() on large sets of headers, as passed on by
+proxies, compared with the former implementation where it applies.
+"""
+from __future__ import print_function
+
+import re
+
+from htmldammit import contenttypes
+from htmldammit.contenttypes import ContentTypeHeader, get_content_type, \
+    parse_content_type
+from htmldammit.core import decode_html_result
+
+from benchmarks.common import make_page, print_table, time_per_call
+
+
+HEADER_VALUES = [
+    'text/html',
+    'text/html; charset=utf-8',
+    'text/html; charset="ISO-8859-1"; level=1',
+]
+
+
+class FormerContentTypeHeader(object):
+    "the former implementation of ContentTypeHeader, for comparison"
+
+    def __init__(self, header_value):
+        self.header_value = header_value
+        self._first_part_lower = self.header_value.split(';', 1)[0].lower()
+
+    @property
+    def is_html(self):
+        return self._first_part_lower.startswith('text/html')
+
+    @property
+    def charset(self):
+        m = re.search(r'charset=([^;]+)', self.header_value, re.IGNORECASE)
+        if m:
+            return m.group(1).strip()
+        else:
+            return None
+
+
+def former_get_content_type(http_headers):
+    "the former implementation of get_content_type(), for comparison"
+    header_value = None
+
+    if http_headers is not None:
+        header_value = http_headers.get('content-type', None)
+        if header_value is None:
+            if not isinstance(http_headers,
+                              contenttypes.CLASSES_WITH_CASE_INSENSITIVE_HEADERS):
+                for header_name in http_headers:
+                    if header_name.lower() == 'content-type':
+                        header_value = http_headers[header_name]
+                        break
+
+    return header_value
+
+
+def make_header_pairs(n_headers):
+    "(name, value) pairs with the Content-Type header last, oddly spelled"
+    pairs = [('X-Header-{}'.format(i), 'value {}'.format(i))
+             for i in range(n_headers - 1)]
+    pairs.append(('CONTENT-TYPE', 'text/html; charset=utf-8'))
+    return pairs
+
+
+def read_header(factory, header_value):
+    content_type_header = factory(header_value)
+    return content_type_header.is_html, content_type_header.charset
+
+
+def main():
+    rows = []
+    for header_value in HEADER_VALUES:
+        times = [
+            time_per_call(lambda: read_header(factory, header_value))
+            for factory in [FormerContentTypeHeader, ContentTypeHeader,
+                            parse_content_type]
+        ]
+        rows.append([header_value] + [
+            '{:.2f}'.format(t * 1e6) for t in times
+        ] + ['{:.1f}x'.format(times[0] / times[2])])
+    print('microseconds per header')
+    print_table(['header', 'former', 'parsed', 'cached', 'speedup'], rows)
+    print()
+
+    raw_html = make_page(512)
+    http_headers = {'Content-Type': 'text/html; charset=utf-8'}
+    cache_size = contenttypes.CONTENT_TYPE_CACHE_SIZE
+    try:
+        contenttypes.CONTENT_TYPE_CACHE_SIZE = 0
+        uncached = time_per_call(
+            lambda: decode_html_result(raw_html, http_headers))
+    finally:
+        contenttypes.CONTENT_TYPE_CACHE_SIZE = cache_size
+    cached = time_per_call(lambda: decode_html_result(raw_html, http_headers))
+    print('decode_html_result() on a 512 B page, microseconds per call')
+    print_table(['uncached', 'cached', 'speedup'], [[
+        '{:.2f}'.format(uncached * 1e6), '{:.2f}'.format(cached * 1e6),
+        '{:.2f}x'.format(uncached / cached),
+    ]])
+
+    print()
+
+    pairs = make_header_pairs(40)
+    header_sets = [
+        ('dict', dict(pairs), True),
+        ('list', pairs, False),
+        ('bytes list', [(name.encode('ascii'), value.encode('ascii'))
+                        for (name, value) in pairs], False),
+        ('WSGI environ', dict(
+            [('HTTP_' + name.upper().replace('-', '_'), value)
+             for (name, value) in pairs[:-1]] +
+            [('wsgi.version', (1, 0)), ('CONTENT_TYPE', pairs[-1][1])]
+        ), False),
+    ]
+    rows = []
+    for name, http_headers, former_supported in header_sets:
+        assert get_content_type(http_headers)
+        current = time_per_call(lambda: get_content_type(http_headers))
+        if former_supported:
+            former = time_per_call(
+                lambda: former_get_content_type(http_headers))
+            rows.append([name, '{:.2f}'.format(former * 1e6),
+                         '{:.2f}'.format(current * 1e6),
+                         '{:.1f}x'.format(former / current)])
+        else:
+            rows.append([name, '-', '{:.2f}'.format(current * 1e6), '-'])
+    print('get_content_type() on {} headers, microseconds per call'.format(
+        len(pairs)))
+    print_table(['headers', 'former', 'current', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Measure the throughput of each installed encoding detection backend.
+
+Each backend is run on the entire content of every page in a corpus of
+undeclared, legacy-encoded pages. Reports throughput in MB/s and how many
+pages' encodings were detected correctly (i.e. decoding with the detected
+encoding gives the original text).
+"""
+from __future__ import print_function
+
+import codecs
+
+from htmldammit.detectors import available_detectors, get_detector
+
+from benchmarks.common import SAMPLE_TEXTS, make_page, print_table, \
+    time_per_call
+
+
+PAGE_SIZE = 128 * 1024
+
+
+def make_corpus():
+    corpus = []
+    for (text, encodings) in SAMPLE_TEXTS.values():
+        for encoding in encodings:
+            raw_html = make_page(PAGE_SIZE, encoding, declare_charset=False,
+                                 text=text)
+            corpus.append((raw_html, raw_html.decode(encoding)))
+    return corpus
+
+
+def decodes_correctly(raw_html, html, encoding):
+    try:
+        codecs.lookup(encoding)
+        return raw_html.decode(encoding) == html
+    except (LookupError, TypeError, UnicodeDecodeError):
+        return False
+
+
+def main():
+    corpus = make_corpus()
+    total_mb = sum(len(raw_html) for (raw_html, _html) in corpus) / 1e6
+    print('auto: {}'.format(get_detector('auto').name))
+
+    rows = []
+    for name in available_detectors():
+        detector = get_detector(name)
+        seconds = time_per_call(
+            lambda: [detector.detect(raw_html) for (raw_html, _) in corpus])
+        n_correct = sum(
+            decodes_correctly(raw_html, html, detector.detect(raw_html))
+            for (raw_html, html) in corpus
+        )
+        rows.append([
+            name, '{:.1f}'.format(total_mb / seconds),
+            '{}/{}'.format(n_correct, len(corpus)),
+        ])
+    print_table(['detector', 'MB/s', 'correct'], rows)
+
+
+if __name__ == '__main__':
+    main()
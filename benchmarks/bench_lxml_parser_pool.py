@@ -0,0 +1,45 @@
+"""Measure the effect of reusing lxml parsers in make_lxml_html().
+
+Parses small declared pages with make_lxml_html(), with the thread-local
+parser pool enabled and disabled. Reports microseconds per page.
+"""
+from __future__ import print_function
+
+from htmldammit import core
+
+from benchmarks.common import format_size, make_page, print_table, \
+    time_per_call
+
+
+SIZES = [512, 2 * 1024, 16 * 1024, 128 * 1024]
+ENCODINGS = ['utf-8', 'windows-1252']
+HTTP_HEADERS = {'Content-Type': 'text/html'}
+
+
+def main():
+    orig_pool_size = core.LXML_PARSER_POOL_SIZE
+    rows = []
+    try:
+        for size in SIZES:
+            pages = [make_page(size, encoding) for encoding in ENCODINGS]
+            # alternate between the modes, since timings drift over time
+            times = [float('inf'), float('inf')]
+            for _round in range(3):
+                for i, pool_size in enumerate([0, orig_pool_size]):
+                    core.LXML_PARSER_POOL_SIZE = pool_size
+                    times[i] = min(times[i], time_per_call(
+                        lambda: [core.make_lxml_html(raw_html, HTTP_HEADERS)
+                                 for raw_html in pages]) / len(pages))
+            rows.append([
+                format_size(size),
+                '{:.1f}'.format(times[0] * 1e6),
+                '{:.1f}'.format(times[1] * 1e6),
+                '{:.2f}x'.format(times[0] / times[1]),
+            ])
+    finally:
+        core.LXML_PARSER_POOL_SIZE = orig_pool_size
+    print_table(['size', 'new parser (us)', 'pooled (us)', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
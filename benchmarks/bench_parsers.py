@@ -0,0 +1,64 @@
+"""Compare the time taken to parse HTML with each available parser.
+
+Parses declared pages of various encodings, both with make_soup() using each
+installed BeautifulSoup parser, and with make_lxml_html(). For comparison,
+also times the previous make_soup() approach, which decoded the page to
+unicode and had BeautifulSoup parse that. Reports milliseconds per MB.
+"""
+from __future__ import print_function
+
+import bs4
+
+from htmldammit import decode_html, make_lxml_html, make_soup
+
+from benchmarks.common import SAMPLE_TEXTS, make_page, print_table, \
+    time_per_call
+
+
+PAGE_SIZE = 256 * 1024
+HTTP_HEADERS = {'Content-Type': 'text/html'}
+SOUP_FEATURES = ['lxml', 'html5lib', 'html.parser']
+
+
+def make_corpus():
+    corpus = [make_page(PAGE_SIZE, 'utf-8')]
+    for (text, encodings) in SAMPLE_TEXTS.values():
+        corpus.extend(make_page(PAGE_SIZE, encoding, text=text)
+                      for encoding in encodings)
+    return corpus
+
+
+def available_soup_features():
+    features = []
+    for feature in SOUP_FEATURES:
+        try:
+            bs4.BeautifulSoup(b'<p></p>', features=feature)
+        except bs4.FeatureNotFound:
+            continue
+        features.append(feature)
+    return features
+
+
+def main():
+    corpus = make_corpus()
+    total_mb = sum(len(raw_html) for raw_html in corpus) / 1e6
+
+    def ms_per_mb(parse):
+        seconds = time_per_call(
+            lambda: [parse(raw_html) for raw_html in corpus])
+        return '{:.1f}'.format(seconds * 1e3 / total_mb)
+
+    rows = [['make_lxml_html', '', ms_per_mb(
+        lambda raw_html: make_lxml_html(raw_html, HTTP_HEADERS))]]
+    for feature in available_soup_features():
+        rows.append(['make_soup', feature, ms_per_mb(
+            lambda raw_html: make_soup(raw_html, HTTP_HEADERS,
+                                       features=feature))])
+        rows.append(['decode + BeautifulSoup', feature, ms_per_mb(
+            lambda raw_html: bs4.BeautifulSoup(
+                decode_html(raw_html, HTTP_HEADERS), features=feature))])
+    print_table(['method', 'parser', 'ms/MB'], rows)
+
+
+if __name__ == '__main__':
+    main()
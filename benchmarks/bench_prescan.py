@@ -0,0 +1,42 @@
+"""Compare bounded prescan vs. whole-document search for declared encodings.
+
+Reports the number of bytes searched and the time per page, both for the
+declared-encoding search alone and for a complete decode_html() call.
+"""
+from __future__ import print_function
+
+from htmldammit.core import PRESCAN_BYTES, decode_html, find_declared_encoding
+
+from benchmarks.common import format_size, make_page, print_table, time_per_call
+
+
+SIZES = [10 * 1024, 1024 * 1024, 5 * 1024 * 1024]
+MODES = [('prescan', PRESCAN_BYTES), ('entire', None)]
+
+
+def main():
+    rows = []
+    for size in SIZES:
+        # no declaration at all is the worst case: the entire search range
+        # is scanned without finding a match
+        raw_html = make_page(size, declare_charset=False)
+        for mode_name, prescan_bytes in MODES:
+            scanned = len(raw_html) if prescan_bytes is None \
+                else min(len(raw_html), prescan_bytes)
+            search_time = time_per_call(
+                lambda: find_declared_encoding(raw_html, True, prescan_bytes))
+            decode_time = time_per_call(
+                lambda: decode_html(raw_html, prescan_bytes=prescan_bytes))
+            rows.append([
+                format_size(len(raw_html)), mode_name, scanned,
+                '{:.3f}'.format(search_time * 1e3),
+                '{:.3f}'.format(decode_time * 1e3),
+            ])
+    print_table(
+        ['page size', 'mode', 'bytes scanned', 'search ms', 'decode ms'],
+        rows,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Compare sampled vs. whole-document statistical encoding detection.
+
+For each page in a corpus of undeclared, legacy-encoded pages, the encoding
+is detected both from a bounded sample and from the entire page. Reports
+the time taken by each and how often they agree. Exits with a non-zero
+status if the agreement rate is below ACCURACY_THRESHOLD.
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from htmldammit.core import DETECTION_SAMPLE_BYTES, detect_encoding
+from htmldammit.detectors import get_default_detector
+
+from benchmarks.common import SAMPLE_TEXTS, format_size, make_page, \
+    print_table
+
+
+SIZES = [256 * 1024, 1024 * 1024, 5 * 1024 * 1024]
+
+# the minimal acceptable rate of agreement with whole-document detection
+ACCURACY_THRESHOLD = 0.9
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def main():
+    detector = get_default_detector()
+    if detector.name == 'none':
+        print('No encoding detection library is installed.')
+        return 1
+    print('Detector: {}'.format(detector.name))
+
+    rows = []
+    n_pages = n_agreed = 0
+    for size in SIZES:
+        for (name, (text, encodings)) in sorted(SAMPLE_TEXTS.items()):
+            for encoding in encodings:
+                raw_html = make_page(size, encoding, declare_charset=False,
+                                     text=text)
+                whole, whole_time = timed(detect_encoding, raw_html, None)
+                sampled, sampled_time = timed(
+                    detect_encoding, raw_html, DETECTION_SAMPLE_BYTES)
+                n_pages += 1
+                n_agreed += (whole == sampled)
+                rows.append([
+                    format_size(len(raw_html)), encoding,
+                    whole, sampled,
+                    '{:.1f}'.format(whole_time * 1e3),
+                    '{:.1f}'.format(sampled_time * 1e3),
+                ])
+    print_table(
+        ['page size', 'encoding', 'whole', 'sampled', 'whole ms',
+         'sampled ms'],
+        rows,
+    )
+
+    accuracy = float(n_agreed) / n_pages
+    print('Agreement with whole-document detection: {:.1%} '
+          '(threshold: {:.0%})'.format(accuracy, ACCURACY_THRESHOLD))
+    return 0 if accuracy >= ACCURACY_THRESHOLD else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""Benchmark the main entry points over a multi-encoding corpus.
+
+Measures decode_html(), make_lxml_html(), make_soup() and the requests and
+urllib integrations over the pages of benchmarks.corpus, reporting
+throughput, latency percentiles and peak memory per function, case and page
+size. Results may be saved as a baseline and later runs compared against it,
+exiting with a non-zero status if any measurement regressed by more than a
+tolerance:
+
+    PYTHONPATH=src python -m benchmarks.bench_suite --save-baseline base.json
+    PYTHONPATH=src python -m benchmarks.bench_suite --baseline base.json
+
+Baselines are machine specific, so none is kept in the repository. Use
+--quick for a fast run over small pages only.
+"""
+from __future__ import print_function
+
+import argparse
+import email
+import gc
+import io
+import json
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from six.moves.urllib.response import addinfourl
+
+from htmldammit import decode_html, make_lxml_html, make_soup
+
+from benchmarks.common import format_size, print_table
+from benchmarks.corpus import CASES, SIZES, make_corpus
+
+
+QUICK_SIZES = [1024, 64 * 1024]
+
+
+def _requests_html(raw_html, http_headers):
+    import requests
+    from htmldammit.integrations.requests import get_response_html
+    response = requests.models.Response()
+    response._content = raw_html
+    response.status_code = 200
+    response.url = 'http://example.com/'
+    response.headers.update(http_headers or {})
+    return lambda: get_response_html(response)
+
+
+def _urllib_html(raw_html, http_headers):
+    from htmldammit.integrations.urllib import HtmlResponse
+    headers = email.message_from_string(''.join(
+        '{}: {}\n'.format(name, value)
+        for name, value in (http_headers or {}).items()
+    ))
+
+    def read_html():
+        response = addinfourl(io.BytesIO(raw_html), headers,
+                              'http://example.com/', 200)
+        return HtmlResponse(response).read_html()
+    return read_html
+
+
+# name -> function(raw_html, http_headers) returning a no-argument callable
+FUNCTIONS = {
+    'decode_html': lambda raw_html, http_headers: (
+        lambda: decode_html(raw_html, http_headers)),
+    'make_lxml_html': lambda raw_html, http_headers: (
+        lambda: make_lxml_html(raw_html, http_headers)),
+    'make_soup': lambda raw_html, http_headers: (
+        lambda: make_soup(raw_html, http_headers)),
+    'requests': _requests_html,
+    'urllib': _urllib_html,
+}
+FUNCTION_NAMES = [
+    'decode_html', 'make_lxml_html', 'make_soup', 'requests', 'urllib',
+]
+
+
+def measure_latencies(func, min_total_time, min_calls=3, max_calls=1000):
+    """call func repeatedly; return the sorted durations of the calls"""
+    timer = timeit.default_timer
+    latencies = []
+    total = 0.0
+    while len(latencies) < min_calls or (
+            total < min_total_time and len(latencies) < max_calls):
+        start = timer()
+        func()
+        latency = timer() - start
+        latencies.append(latency)
+        total += latency
+    return sorted(latencies)
+
+
+def measure_peak_memory(func):
+    """return the peak memory allocated during a call, in bytes
+
+    Returns None if tracemalloc is not available.
+    """
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def run(corpus, function_names, min_total_time, memory=True):
+    """run the benchmarks; return a dict of results by key"""
+    results = {}
+    for (case, size, raw_html, html) in corpus:
+        for function_name in function_names:
+            func = FUNCTIONS[function_name](raw_html, case.http_headers)
+            latencies = measure_latencies(func, min_total_time)
+            key = '{}/{}/{}'.format(function_name, case.name, size)
+            results[key] = {
+                'n_bytes': len(raw_html),
+                'calls': len(latencies),
+                # throughput of the fastest call, as in common.time_per_call()
+                'mb_per_s': len(raw_html) / latencies[0] / 1e6,
+                'p50': percentile(latencies, 0.5),
+                'p90': percentile(latencies, 0.9),
+                'p99': percentile(latencies, 0.99),
+                'peak_memory': measure_peak_memory(func) if memory else None,
+                'correct': (decode_html(raw_html, case.http_headers) == html
+                            if function_name == 'decode_html' else None),
+            }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """compare results to a baseline; return a list of regressions
+
+    A regression is a median latency or peak memory greater than the
+    baseline's by more than the given fraction.
+    """
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        for metric in ['p50', 'peak_memory']:
+            new, old = results[key][metric], baseline[key][metric]
+            if new is None or not old:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append((key, metric, old, new))
+    return regressions
+
+
+def _format_latency(seconds):
+    for unit, factor in [('us', 1e6), ('ms', 1e3)]:
+        if seconds * factor < 1000:
+            return '{:.1f} {}'.format(seconds * factor, unit)
+    return '{:.2f} s'.format(seconds)
+
+
+def print_results(results):
+    rows = []
+    for key in sorted(results, key=lambda k: (
+            k.split('/')[:2], int(k.split('/')[2]))):
+        result = results[key]
+        function_name, case_name, _ = key.split('/')
+        rows.append([
+            function_name, case_name, format_size(result['n_bytes']),
+            '{:.1f}'.format(result['mb_per_s']),
+            _format_latency(result['p50']),
+            _format_latency(result['p90']),
+            _format_latency(result['p99']),
+            ('-' if result['peak_memory'] is None
+             else format_size(result['peak_memory'])),
+            {True: 'yes', False: 'NO', None: ''}[result['correct']],
+        ])
+    print_table(['function', 'case', 'size', 'MB/s', 'p50', 'p90', 'p99',
+                 'peak mem', 'correct'], rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='only use small pages')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='page sizes in bytes')
+    parser.add_argument('--cases', nargs='+',
+                        choices=[case.name for case in CASES])
+    parser.add_argument('--functions', nargs='+', choices=FUNCTION_NAMES,
+                        default=FUNCTION_NAMES)
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimal total time per measurement, in seconds')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip measuring peak memory')
+    parser.add_argument('--baseline', help='a baseline to compare against')
+    parser.add_argument('--save-baseline', help='save the results to a file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed regression, as a fraction')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    corpus = make_corpus(sizes, args.cases)
+    results = run(corpus, args.functions, args.min_time,
+                  memory=not args.no_memory)
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        print()
+        if not regressions:
+            print('no regressions compared to {}'.format(args.baseline))
+            return 0
+        formatters = {'p50': _format_latency, 'peak_memory': format_size}
+        print_table(['benchmark', 'metric', 'baseline', 'now', 'change'], [
+            [key, metric, formatters[metric](old), formatters[metric](new),
+             '{:+.0%}'.format(new / float(old) - 1)]
+            for (key, metric, old, new) in regressions
+        ])
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
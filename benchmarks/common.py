@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Shared utilities for the htmldammit benchmarks.
+
+The benchmarks are plain scripts, run from the repository root with the
+package importable, e.g.:
+
+    PYTHONPATH=src python -m benchmarks.bench_prescan
+"""
+from __future__ import print_function
+
+import timeit
+
+__all__ = [
+    'SAMPLE_TEXTS', 'make_page', 'time_per_call', 'format_size', 'print_table',
+]
+
+
+PAGE_HEAD_TEMPLATE = u'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="{charset}">
+<title>Benchmark page</title>
+</head>
+<body>
+'''
+PAGE_TAIL = u'''</body>
+</html>
+'''
+PARAGRAPH = u'<p>Lorem ipsum dolor sit amet, áéíóú.</p>\n'
+
+# (text, encodings) pairs of natural language text, each with legacy
+# encodings commonly used for it
+SAMPLE_TEXTS = {
+    'french': (
+        u'Le cœur a ses raisons que la raison ne connaît point. Déjà, '
+        u'l\'été s\'achève et les élèves retournent à l\'école.',
+        ['windows-1252', 'iso-8859-15'],
+    ),
+    'russian': (
+        u'Все счастливые семьи похожи друг на друга, каждая несчастливая '
+        u'семья несчастлива по-своему. Всё смешалось в доме Облонских.',
+        ['windows-1251', 'koi8-r'],
+    ),
+    'greek': (
+        u'Άνδρα μοι ἔννεπε, Μούσα, πολύτροπον. Η Ελλάδα είναι μια χώρα '
+        u'της νοτιοανατολικής Ευρώπης με πλούσια ιστορία.',
+        ['windows-1253', 'iso-8859-7'],
+    ),
+    'japanese': (
+        u'吾輩は猫である。名前はまだ無い。どこで生れたかとんと見当がつかぬ。'
+        u'何でも薄暗いじめじめした所でニャーニャー泣いていた事だけは記憶している。',
+        ['shift_jis', 'euc-jp'],
+    ),
+    'chinese': (
+        u'道可道，非常道。名可名，非常名。无名天地之始，有名万物之母。'
+        u'学而时习之，不亦说乎？有朋自远方来，不亦乐乎？',
+        ['gb18030', 'big5'],
+    ),
+}
+
+
+def make_page(size, charset='utf-8', declare_charset=True, text=None):
+    """make an encoded HTML page of roughly the given size in bytes"""
+    head = PAGE_HEAD_TEMPLATE.format(charset=charset)
+    if not declare_charset:
+        head = head.replace(u'<meta charset="{}">\n'.format(charset), u'')
+    paragraph = PARAGRAPH if text is None else u'<p>{}</p>\n'.format(text)
+    paragraph_size = len(paragraph.encode(charset, 'replace'))
+    n_paragraphs = max(1, size // paragraph_size)
+    page = head + paragraph * n_paragraphs + PAGE_TAIL
+    return page.encode(charset, 'replace')
+
+
+def time_per_call(func, min_total_time=0.2):
+    """time a no-argument callable; return seconds per call (best of 3)"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange() if hasattr(timer, 'autorange') else (10, 0)
+    number = max(1, int(number * min_total_time / 0.2))
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def format_size(n_bytes):
+    for unit in ['B', 'KB', 'MB']:
+        if n_bytes < 1024 or unit == 'MB':
+            break
+        n_bytes /= 1024.0
+    return '{:.0f} {}'.format(n_bytes, unit)
+
+
+def print_table(header, rows):
+    widths = [
+        max(len(str(row[i])) for row in [header] + rows)
+        for i in range(len(header))
+    ]
+    for row in [header] + rows:
+        print('  '.join(str(v).rjust(w) for v, w in zip(row, widths)))
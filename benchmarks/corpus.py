@@ -0,0 +1,192 @@
+"""A generated corpus of HTML pages in many encodings, for benchmarking.
+
+Each case is a page of a given size, encoded in some encoding, with its
+encoding given (or not) by a BOM, an inline declaration and/or the HTTP
+Content-Type header, including headers which lie about the encoding.
+"""
+from __future__ import print_function
+
+import codecs
+import json
+import os.path
+
+from benchmarks.common import PAGE_HEAD_TEMPLATE, PAGE_TAIL, SAMPLE_TEXTS
+
+__all__ = [
+    'CASES', 'LABELLED_CASES', 'SIZES', 'BenchmarkCase', 'load_corpus',
+    'make_corpus',
+]
+
+# 1 KB to 20 MB
+SIZES = [1024, 64 * 1024, 1024 * 1024, 20 * 1024 * 1024]
+
+_TEXTS = dict((name, text) for name, (text, _) in SAMPLE_TEXTS.items())
+_TEXTS['mixed'] = u' '.join(_TEXTS[name] for name in sorted(_TEXTS))
+_TEXTS['latin'] = _TEXTS['french']
+_TEXTS['hebrew'] = (
+    u'בראשית ברא אלהים את השמים ואת הארץ. והארץ היתה תהו ובהו, וחשך על '
+    u'פני תהום.'
+)
+
+_BOMS = {
+    'utf-8': codecs.BOM_UTF8,
+    'utf-16le': codecs.BOM_UTF16_LE,
+    'utf-16be': codecs.BOM_UTF16_BE,
+}
+
+
+class BenchmarkCase(object):
+    """A kind of page to benchmark with, e.g. undeclared Shift_JIS."""
+
+    def __init__(self, name, encoding, text, declared=None, header=None,
+                 bom=False):
+        """
+        @param name: a short, unique name for the case (str)
+        @param encoding: the encoding the page is actually in (str)
+        @param text: the name of the text the page is made of, one of the
+            SAMPLE_TEXTS or 'mixed', 'latin' or 'hebrew' (str)
+        @param declared: the charset of the <meta> declaration, if any
+        @param header: the charset in the Content-Type header; '' for a
+            header without a charset, None for no header
+        @param bom: whether the page starts with a BOM (bool)
+        """
+        self.name = name
+        self.url = 'http://{}.example.com/'.format(name)
+        self.encoding = encoding
+        self.text = text
+        self.declared = declared
+        self.header = header
+        self.bom = bom
+
+    @property
+    def http_headers(self):
+        if self.header is None:
+            return None
+        content_type = 'text/html'
+        if self.header:
+            content_type += '; charset=' + self.header
+        return {'Content-Type': content_type}
+
+    def make_page(self, size):
+        """make the page, of about the given size in bytes
+
+        @return: a (raw_html, html) tuple, where html is the expected result
+            of decoding raw_html
+        """
+        head = PAGE_HEAD_TEMPLATE.format(charset=self.declared or u'')
+        if self.declared is None:
+            head = head.replace(u'<meta charset="">\n', u'')
+        paragraph = u'<p>{}</p>\n'.format(_TEXTS[self.text])
+        n_paragraphs = max(
+            1, size // len(paragraph.encode(self.encoding, 'replace')))
+        html = head + paragraph * n_paragraphs + PAGE_TAIL
+        # as in common.make_page(), characters which the encoding can't
+        # represent are replaced, e.g. simplified Chinese in big5
+        raw_html = html.encode(self.encoding, 'replace')
+        html = raw_html.decode(self.encoding)
+        if self.bom:
+            raw_html = _BOMS[self.encoding] + raw_html
+        return raw_html, html
+
+
+CASES = [
+    BenchmarkCase('utf8-declared', 'utf-8', 'mixed', 'utf-8', 'utf-8'),
+    BenchmarkCase('utf8-undeclared', 'utf-8', 'mixed', header=''),
+    BenchmarkCase('utf8-bom', 'utf-8', 'mixed', bom=True),
+    BenchmarkCase('utf16-bom', 'utf-16le', 'mixed', bom=True, header=''),
+    BenchmarkCase('utf16-header', 'utf-16le', 'mixed', header='utf-16le'),
+    BenchmarkCase('windows-1251', 'windows-1251', 'russian', 'windows-1251',
+                  'windows-1251'),
+    BenchmarkCase('windows-1252-undeclared', 'windows-1252', 'latin',
+                  header=''),
+    BenchmarkCase('windows-1255-meta', 'windows-1255', 'hebrew',
+                  'windows-1255', ''),
+    BenchmarkCase('shift-jis-undeclared', 'shift_jis', 'japanese', header=''),
+    BenchmarkCase('gb18030-declared', 'gb18030', 'chinese', 'gb18030',
+                  'gb18030'),
+    BenchmarkCase('koi8-r-undeclared', 'koi8-r', 'russian', header=''),
+    # the header lies; the inline declaration is right
+    BenchmarkCase('lying-header-utf8', 'utf-8', 'mixed', 'utf-8',
+                  'iso-8859-1'),
+    # the header lies and there is no inline declaration
+    BenchmarkCase('lying-header-1251', 'windows-1251', 'russian',
+                  header='utf-8'),
+]
+
+
+def make_corpus(sizes=SIZES, case_names=None, cases=CASES):
+    """generate the corpus
+
+    @return: a list of (case, size, raw_html, html) tuples
+    """
+    corpus = []
+    for case in cases:
+        if case_names is not None and case.name not in case_names:
+            continue
+        for size in sizes:
+            raw_html, html = case.make_page(size)
+            corpus.append((case, size, raw_html, html))
+    return corpus
+
+
+def _make_labelled_cases():
+    cases = []
+    for (text_name, (_text, encodings)) in sorted(SAMPLE_TEXTS.items()):
+        for encoding in encodings:
+            prefix = '{}-{}'.format(text_name, encoding)
+            cases.extend([
+                BenchmarkCase(prefix + '-declared', encoding, text_name,
+                              encoding, ''),
+                BenchmarkCase(prefix + '-header', encoding, text_name,
+                              header=encoding),
+                BenchmarkCase(prefix + '-undeclared', encoding, text_name,
+                              header=''),
+                BenchmarkCase(prefix + '-lying', encoding, text_name,
+                              header='utf-8'),
+            ])
+    return cases
+
+
+# CASES, and for each of the SAMPLE_TEXTS in each of its legacy encodings,
+# pages with the encoding declared inline, in the HTTP header, not at all
+# and with a lying header
+LABELLED_CASES = CASES + _make_labelled_cases()
+
+
+class _LoadedCase(object):
+    "a labelled page loaded from a file; see load_corpus()"
+
+    def __init__(self, name, encoding, http_headers, url):
+        self.name = name
+        self.encoding = encoding
+        self.http_headers = http_headers
+        self.url = url
+
+
+def load_corpus(directory):
+    """load a labelled corpus of real pages from a directory
+
+    The directory must contain a labels.json file, mapping file names to
+    objects with an "encoding" key, and optionally "headers" (an object)
+    and "url" keys, e.g.:
+
+        {"page1.html": {"encoding": "shift_jis",
+                        "headers": {"Content-Type": "text/html"},
+                        "url": "http://example.jp/"}}
+
+    @return: a list of (case, size, raw_html, html) tuples, as make_corpus()
+    """
+    with open(os.path.join(directory, 'labels.json')) as f:
+        labels = json.load(f)
+    corpus = []
+    for file_name in sorted(labels):
+        label = labels[file_name]
+        with open(os.path.join(directory, file_name), 'rb') as f:
+            raw_html = f.read()
+        case = _LoadedCase(file_name, label['encoding'],
+                           label.get('headers'), label.get('url'))
+        html = codecs.decode(raw_html, case.encoding)
+        if html.startswith(u'\ufeff'):
+            html = html[1:]
+        corpus.append((case, len(raw_html), raw_html, html))
+    return corpus
@@ -28,6 +28,7 @@ setup(
     install_requires=[
         'six',
         'beautifulsoup4',
+        'futures; python_version < "3.2"',
     ],
     license='MIT',
     keywords='htmldammit HTML unicode',
@@ -1,7 +1,8 @@
 """A library for decoding HTML fetched from the web into Unicode.
 
-Uses BeautifulSoup4.UnicodeDammit internally. It, in turn, uses the 'chardet'
-module internally if it is available, which is recommended.
+Encodings are taken from BOM-s, inline declarations and the HTTP headers, and
+otherwise detected statistically, using e.g. the 'cchardet' or 'chardet'
+module if it is available, which is recommended; see htmldammit.detectors.
 
 It is highly recommended to use the HTTP response headers if they are available,
 since often the correct encoding is described in the 'Content-Type' header.
@@ -15,6 +16,11 @@ A utility function, decode_html(), is supplied:
 html = decode_html(raw_html, http_headers)
 """
 __version__ = '0.2.0a0'
-__all__ = ['decode_html', 'make_lxml_html', 'make_soup']
+__all__ = [
+    'decode_html', 'decode_html_batch', 'decode_html_result', 'make_lxml_html',
+    'make_soup', 'resolve_html_encoding',
+]
 
-from htmldammit.core import decode_html, make_lxml_html, make_soup
+from htmldammit.batch import decode_html_batch
+from htmldammit.core import decode_html, decode_html_result, make_lxml_html, \
+    make_soup, resolve_html_encoding
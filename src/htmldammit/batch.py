@@ -0,0 +1,167 @@
+"""Decoding many HTML documents in parallel.
+
+Encoding detection and decoding are CPU-bound and hold the GIL, so by default
+a process pool is used:
+
+    for item in decode_html_batch(pages_with_headers):
+        if item.error is None:
+            handle(item.result.text)
+"""
+import collections
+import itertools
+import mmap
+import multiprocessing
+
+from htmldammit.contenttypes import get_content_type
+from htmldammit.core import as_markup, decode_html_result
+
+__all__ = ['BatchItemResult', 'decode_html_batch']
+
+
+class BatchItemResult(object):
+    """The outcome of decoding a single item in a batch."""
+
+    def __init__(self, index, result=None, error=None):
+        # the index of the item in the input
+        self.index = index
+        # a DecodeResult; its markup attribute is None, to avoid sending the
+        # data back from worker processes
+        self.result = result
+        # the exception raised while decoding, if any
+        self.error = error
+
+    def __repr__(self):
+        return '<{} index={} result={!r} error={!r}>'.format(
+            type(self).__name__, self.index, self.result, self.error)
+
+
+def _decode_chunk(chunk, capture_errors, kwargs):
+    results = []
+    for (index, raw_html, http_headers) in chunk:
+        try:
+            result = decode_html_result(raw_html, http_headers, **kwargs)
+        except Exception as exc:
+            if not capture_errors:
+                raise
+            results.append(BatchItemResult(index, error=exc))
+        else:
+            result.markup = None
+            results.append(BatchItemResult(index, result=result))
+    return results
+
+
+def _make_chunks(items, chunksize, pickled):
+    items = iter(items)
+    index = 0
+    while True:
+        chunk = []
+        for (raw_html, http_headers) in itertools.islice(items, chunksize):
+            # memoryview and mmap objects can't be pickled, so they are
+            # copied when sent to worker processes
+            if pickled and isinstance(raw_html, (memoryview, mmap.mmap)):
+                raw_html = bytes(as_markup(raw_html))
+            # only the Content-Type header is used, and sending just it to
+            # worker processes avoids pickling arbitrary header objects
+            content_type = get_content_type(http_headers)
+            chunk.append((
+                index, raw_html,
+                {'Content-Type': content_type} if content_type else None,
+            ))
+            index += 1
+        if not chunk:
+            return
+        yield chunk
+
+
+def _make_executor(executor, max_workers):
+    import concurrent.futures
+    if executor == 'process':
+        return concurrent.futures.ProcessPoolExecutor(max_workers)
+    elif executor == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(max_workers)
+    raise ValueError("executor must be 'process', 'thread' or an Executor")
+
+
+def decode_html_batch(items, executor='process', max_workers=None,
+                      chunksize=16, ordered=True, capture_errors=True,
+                      **kwargs):
+    """Decode many HTML documents in parallel.
+
+    Items are read lazily and only a bounded number of chunks are in flight
+    at any time, so very large or endless iterables may be given.
+
+    @param items: an iterable of (raw_html, http_headers) pairs; http_headers
+        may be None
+    @param executor: 'process' or 'thread' to use a new pool of that kind, or
+        a concurrent.futures.Executor, which is not shut down when done
+    @param max_workers: the number of workers for a new pool; also bounds
+        the number of chunks in flight, at twice this number, including for
+        a given executor; defaults to the number of CPUs (int; optional)
+    @param chunksize: the number of items sent to a worker at once (int)
+    @param ordered: whether to yield results in the order of the items; if
+        False, they are yielded as soon as they are ready (bool)
+    @param capture_errors: whether to return exceptions raised for an item as
+        its result's error rather than raising them; errors failing an
+        entire chunk, e.g. items which can't be pickled, are returned for
+        each of its items (bool)
+    @param kwargs: further options, passed on to decode_html_result();
+        hint_cache and url aren't supported, since they apply to single
+        documents and caches aren't shared with worker processes
+    @return: an iterator of BatchItemResult instances
+    """
+    import concurrent.futures
+
+    if chunksize < 1:
+        raise ValueError('chunksize must be positive')
+    unsupported = sorted({'hint_cache', 'url'}.intersection(kwargs))
+    if unsupported:
+        raise TypeError('decode_html_batch() does not support {}'.format(
+            ', '.join(unsupported)))
+
+    own_executor = not isinstance(executor, concurrent.futures.Executor)
+    if own_executor:
+        executor = _make_executor(executor, max_workers)
+    max_in_flight = 2 * (max_workers or multiprocessing.cpu_count())
+
+    pending = collections.deque()
+    # future -> the indexes of the items in its chunk
+    chunk_indexes = {}
+    try:
+        chunks = _make_chunks(
+            items, chunksize,
+            isinstance(executor, concurrent.futures.ProcessPoolExecutor))
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                future = executor.submit(_decode_chunk, chunk,
+                                         capture_errors, kwargs)
+                pending.append(future)
+                chunk_indexes[future] = [index for (index, _, _) in chunk]
+                if len(pending) < max_in_flight:
+                    continue
+
+            # wait for chunks to finish, until there is room for more
+            while pending and (chunk is None or len(pending) >= max_in_flight):
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done, _not_done = concurrent.futures.wait(
+                        pending,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
+                indexes = chunk_indexes.pop(future)
+                try:
+                    item_results = future.result()
+                except Exception as exc:
+                    # e.g. an item which couldn't be sent to a worker process
+                    if not capture_errors:
+                        raise
+                    item_results = [BatchItemResult(index, error=exc)
+                                    for index in indexes]
+                for item_result in item_results:
+                    yield item_result
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True)
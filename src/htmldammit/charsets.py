@@ -0,0 +1,287 @@
+"""Normalization of encoding labels, as found in headers and documents.
+
+Encoding names given by Content-Type headers and inline declarations come in
+many spellings, e.g. "UTF8", "x-sjis" or "iso_8859-1:1987", some of which
+Python doesn't know. These are mapped to Python codecs according to the
+WHATWG Encoding Standard's index of labels, as browsers do. Notably, this
+maps the labels of ISO-8859-1 and ASCII to windows-1252, and uses supersets
+of some legacy encodings, e.g. GB18030 for GBK and GB2312.
+
+Some labels are given more than one encoding to try; see label_encodings().
+
+See: https://encoding.spec.whatwg.org/#names-and-labels
+"""
+import codecs
+
+__all__ = [
+    'ENCODING_LABELS', 'deduplicate_encodings', 'label_encodings',
+    'normalize_encoding', 'normalize_encodings',
+]
+
+
+# (encoding, labels) pairs. Each encoding is the name of the Python codec
+# implementing the WHATWG encoding having the labels. The "replacement" and
+# "x-user-defined" encodings have no such codec, so their labels are mapped
+# to None, i.e. unusable.
+_WHATWG_ENCODINGS = [
+    ('utf-8', [
+        'unicode-1-1-utf-8', 'unicode11utf8', 'unicode20utf8', 'utf-8',
+        'utf8', 'x-unicode20utf8',
+    ]),
+    ('ibm866', ['866', 'cp866', 'csibm866', 'ibm866']),
+    ('iso-8859-2', [
+        'csisolatin2', 'iso-8859-2', 'iso-ir-101', 'iso8859-2', 'iso88592',
+        'iso_8859-2', 'iso_8859-2:1987', 'l2', 'latin2',
+    ]),
+    ('iso-8859-3', [
+        'csisolatin3', 'iso-8859-3', 'iso-ir-109', 'iso8859-3', 'iso88593',
+        'iso_8859-3', 'iso_8859-3:1988', 'l3', 'latin3',
+    ]),
+    ('iso-8859-4', [
+        'csisolatin4', 'iso-8859-4', 'iso-ir-110', 'iso8859-4', 'iso88594',
+        'iso_8859-4', 'iso_8859-4:1988', 'l4', 'latin4',
+    ]),
+    ('iso-8859-5', [
+        'csisolatincyrillic', 'cyrillic', 'iso-8859-5', 'iso-ir-144',
+        'iso8859-5', 'iso88595', 'iso_8859-5', 'iso_8859-5:1988',
+    ]),
+    ('iso-8859-6', [
+        'arabic', 'asmo-708', 'csiso88596e', 'csiso88596i',
+        'csisolatinarabic', 'ecma-114', 'iso-8859-6', 'iso-8859-6-e',
+        'iso-8859-6-i', 'iso-ir-127', 'iso8859-6', 'iso88596', 'iso_8859-6',
+        'iso_8859-6:1987',
+    ]),
+    ('iso-8859-7', [
+        'csisolatingreek', 'ecma-118', 'elot_928', 'greek', 'greek8',
+        'iso-8859-7', 'iso-ir-126', 'iso8859-7', 'iso88597', 'iso_8859-7',
+        'iso_8859-7:1987', 'sun_eu_greek',
+    ]),
+    # ISO-8859-8-I differs from ISO-8859-8 only in the text's direction
+    ('iso-8859-8', [
+        'csiso88598e', 'csisolatinhebrew', 'hebrew', 'iso-8859-8',
+        'iso-8859-8-e', 'iso-ir-138', 'iso8859-8', 'iso88598', 'iso_8859-8',
+        'iso_8859-8:1988', 'visual', 'csiso88598i', 'iso-8859-8-i',
+        'logical',
+    ]),
+    ('iso-8859-10', [
+        'csisolatin6', 'iso-8859-10', 'iso-ir-157', 'iso8859-10',
+        'iso885910', 'l6', 'latin6',
+    ]),
+    ('iso-8859-13', ['iso-8859-13', 'iso8859-13', 'iso885913']),
+    ('iso-8859-14', ['iso-8859-14', 'iso8859-14', 'iso885914']),
+    ('iso-8859-15', [
+        'csisolatin9', 'iso-8859-15', 'iso8859-15', 'iso885915',
+        'iso_8859-15', 'l9',
+    ]),
+    ('iso-8859-16', ['iso-8859-16']),
+    ('koi8-r', ['cskoi8r', 'koi', 'koi8', 'koi8-r', 'koi8_r']),
+    ('koi8-u', ['koi8-ru', 'koi8-u']),
+    ('mac-roman', ['csmacintosh', 'mac', 'macintosh', 'x-mac-roman']),
+    ('cp874', [
+        'dos-874', 'iso-8859-11', 'iso8859-11', 'iso885911', 'tis-620',
+        'windows-874',
+    ]),
+    ('windows-1250', ['cp1250', 'windows-1250', 'x-cp1250']),
+    ('windows-1251', ['cp1251', 'windows-1251', 'x-cp1251']),
+    ('windows-1252', [
+        'ansi_x3.4-1968', 'ascii', 'cp1252', 'cp819', 'csisolatin1', 'ibm819',
+        'iso-8859-1', 'iso-ir-100', 'iso8859-1', 'iso88591', 'iso_8859-1',
+        'iso_8859-1:1987', 'l1', 'latin1', 'us-ascii', 'windows-1252',
+        'x-cp1252',
+    ]),
+    ('windows-1253', ['cp1253', 'windows-1253', 'x-cp1253']),
+    ('windows-1254', [
+        'cp1254', 'csisolatin5', 'iso-8859-9', 'iso-ir-148', 'iso8859-9',
+        'iso88599', 'iso_8859-9', 'iso_8859-9:1989', 'l5', 'latin5',
+        'windows-1254', 'x-cp1254',
+    ]),
+    ('windows-1255', ['cp1255', 'windows-1255', 'x-cp1255']),
+    ('windows-1256', ['cp1256', 'windows-1256', 'x-cp1256']),
+    ('windows-1257', ['cp1257', 'windows-1257', 'x-cp1257']),
+    ('windows-1258', ['cp1258', 'windows-1258', 'x-cp1258']),
+    ('mac-cyrillic', ['x-mac-cyrillic', 'x-mac-ukrainian']),
+    # GBK, decoded as GB18030, its superset
+    ('gb18030', [
+        'chinese', 'csgb2312', 'csiso58gb231280', 'gb2312', 'gb_2312',
+        'gb_2312-80', 'gbk', 'iso-ir-58', 'x-gbk', 'gb18030',
+    ]),
+    # Big5, including the HKSCS extensions
+    ('big5hkscs', ['big5', 'big5-hkscs', 'cn-big5', 'csbig5', 'x-x-big5']),
+    ('euc-jp', ['cseucpkdfmtjapanese', 'euc-jp', 'x-euc-jp']),
+    ('iso-2022-jp', ['csiso2022jp', 'iso-2022-jp']),
+    # Shift_JIS, as extended by Microsoft
+    ('cp932', [
+        'csshiftjis', 'ms932', 'ms_kanji', 'shift-jis', 'shift_jis', 'sjis',
+        'windows-31j', 'x-sjis',
+    ]),
+    # EUC-KR, as extended by Microsoft
+    ('cp949', [
+        'cseuckr', 'csksc56011987', 'euc-kr', 'iso-ir-149', 'korean',
+        'ks_c_5601-1987', 'ks_c_5601-1989', 'ksc5601', 'ksc_5601',
+        'windows-949',
+    ]),
+    (None, [
+        'csiso2022kr', 'hz-gb-2312', 'iso-2022-cn', 'iso-2022-cn-ext',
+        'iso-2022-kr', 'replacement',
+    ]),
+    ('utf-16be', ['unicodefffe', 'utf-16be']),
+    ('utf-16le', [
+        'csunicode', 'iso-10646-ucs-2', 'ucs-2', 'unicode', 'unicodefeff',
+        'utf-16', 'utf-16le',
+    ]),
+    (None, ['x-user-defined']),
+]
+
+# label -> Python encoding name, or None for unusable encodings
+ENCODING_LABELS = dict(
+    (label, encoding)
+    for (encoding, labels) in _WHATWG_ENCODINGS
+    for label in labels
+)
+
+_ASCII_WHITESPACE = '\t\n\f\r '
+
+# The maximal number of labels which aren't WHATWG labels whose lookup
+# results are kept.
+_OTHER_LABELS_CACHE_SIZE = 1000
+
+# label -> encoding name or None, for labels which aren't WHATWG labels
+_other_labels = {}
+
+# The names of Python codecs which don't decode binary data into text, or
+# can't decode at all. Python 3 marks most of these as not being text
+# encodings, but Python 2 doesn't.
+_NON_TEXT_CODECS = frozenset([
+    'base64', 'bz2', 'hex', 'quopri', 'rot-13', 'string-escape', 'undefined',
+    'uu', 'zlib',
+])
+
+
+def _lookup_text_codec(encoding):
+    """look up the Python codec of an encoding which decodes data into text
+
+    @return: a codecs.CodecInfo instance, or None if the encoding is unknown
+        or isn't a text encoding, e.g. "base64"
+    """
+    try:
+        codec_info = codecs.lookup(encoding)
+    except LookupError:
+        return None
+    if (
+        codec_info.name in _NON_TEXT_CODECS or
+        not getattr(codec_info, '_is_text_encoding', True)
+    ):
+        return None
+    return codec_info
+
+
+def _lookup_other_label(label):
+    try:
+        return _other_labels[label]
+    except KeyError:
+        pass
+    encoding = label if _lookup_text_codec(label) is not None else None
+    if len(_other_labels) >= _OTHER_LABELS_CACHE_SIZE:
+        _other_labels.clear()
+    _other_labels[label] = encoding
+    return encoding
+
+
+def normalize_encoding(label):
+    """get the encoding to decode with for an encoding label
+
+    WHATWG labels are looked up in ENCODING_LABELS, ignoring case and
+    surrounding white space. Other labels of text encodings known to Python,
+    e.g. "utf-32le", are returned lower-cased and stripped.
+
+    @param label: an encoding label, e.g. "UTF8" or "latin1" (str)
+    @return: the name of the encoding (str), or None if the label is unknown
+        or its encoding can't be used to decode
+    """
+    if not label:
+        return None
+    label = label.strip(_ASCII_WHITESPACE).lower()
+    try:
+        return ENCODING_LABELS[label]
+    except KeyError:
+        return _lookup_other_label(label)
+
+
+def normalize_encodings(labels):
+    """normalize encoding labels, dropping unusable ones and duplicates
+
+    @param labels: an iterable of encoding labels, possibly including None
+    @return: a list of encoding names, in the order of their first labels
+    """
+    return deduplicate_encodings(
+        normalize_encoding(label) for label in labels)
+
+
+def deduplicate_encodings(encodings):
+    """drop encodings with the same codec as preceding ones, and None-s
+
+    @param encodings: an iterable of encoding names, possibly including None
+    @return: a list of encoding names
+    """
+    result = []
+    codec_names = set()
+    for encoding in encodings:
+        if encoding is None:
+            continue
+        codec_name = codecs.lookup(encoding).name
+        if codec_name not in codec_names:
+            codec_names.add(codec_name)
+            result.append(encoding)
+    return result
+
+
+# Python's windows-1252 codec, unlike WHATWG's, rejects the bytes 0x81, 0x8D,
+# 0x8F, 0x90 and 0x9D, which WHATWG's decodes as U+0081 etc., as iso-8859-1
+# does. So iso-8859-1 is tried next for data declared as windows-1252.
+_WINDOWS_1252_ENCODINGS = ['windows-1252', 'iso-8859-1']
+
+# Documents declared as ASCII but having other characters are most often
+# UTF-8, which is the same as ASCII for ASCII data.
+_ASCII_LABELS = frozenset(['ansi_x3.4-1968', 'ascii', 'us-ascii'])
+_ASCII_ENCODINGS = ['utf-8'] + _WINDOWS_1252_ENCODINGS
+
+
+# A declaration found by prescanning a document as ASCII can't be in UTF-16
+# (nor UTF-32), so as in the HTML standard's prescan, documents declaring
+# these are decoded as UTF-8, and those declaring x-user-defined as
+# windows-1252.
+_ASCII_INCOMPATIBLE_CODEC_PREFIXES = ('utf-16', 'utf-32')
+_USER_DEFINED_LABEL = 'x-user-defined'
+
+
+def label_encodings(label, declared=False):
+    """get the encodings to try, in order, for data declared with a label
+
+    This is the label's encoding, as given by normalize_encoding(), except
+    that windows-1252 is followed by iso-8859-1, and ASCII labels give UTF-8
+    before these.
+
+    For labels declared in the document itself, UTF-16 and UTF-32 labels
+    give UTF-8 and "x-user-defined" gives windows-1252, as in the HTML
+    standard's prescan.
+
+    @param label: an encoding label, e.g. "UTF8" or "latin1" (str)
+    @param declared: whether the label was found in the document, rather
+        than e.g. in an HTTP header (bool; optional)
+    @return: a list of encoding names, empty if the label is unknown or its
+        encoding can't be used to decode
+    """
+    encoding = normalize_encoding(label)
+    if declared and label:
+        if label.strip(_ASCII_WHITESPACE).lower() == _USER_DEFINED_LABEL:
+            encoding = 'windows-1252'
+        elif encoding is not None and codecs.lookup(encoding).name.startswith(
+                _ASCII_INCOMPATIBLE_CODEC_PREFIXES):
+            encoding = 'utf-8'
+    if encoding is None:
+        return []
+    if encoding == 'windows-1252':
+        if label.strip(_ASCII_WHITESPACE).lower() in _ASCII_LABELS:
+            return list(_ASCII_ENCODINGS)
+        return list(_WINDOWS_1252_ENCODINGS)
+    return [encoding]
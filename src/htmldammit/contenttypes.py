@@ -1,13 +1,39 @@
+import collections
+import inspect
 import re
 import email.message
 
+import six
+
+try:
+    from types import MappingProxyType
+except ImportError:  # Python 2
+    class MappingProxyType(collections.Mapping):
+        "a read-only view of a mapping"
+        __slots__ = ('_mapping',)
+
+        def __init__(self, mapping):
+            self._mapping = mapping
+
+        def __getitem__(self, key):
+            return self._mapping[key]
+
+        def __iter__(self):
+            return iter(self._mapping)
+
+        def __len__(self):
+            return len(self._mapping)
+
+        def __repr__(self):
+            return repr(self._mapping)
+
 CLASSES_WITH_CASE_INSENSITIVE_HEADERS = (email.message.Message,)
 HTTP_RESPONSE_CLASSES = tuple()
 
 try:
     import rfc822
 except ImportError:
-    pass
+    rfc822 = None
 else:
     CLASSES_WITH_CASE_INSENSITIVE_HEADERS += (rfc822.Message,)
 
@@ -30,66 +56,318 @@ else:
 try:
     import requests
 except ImportError:
-    pass
+    requests = None
 else:
     CLASSES_WITH_CASE_INSENSITIVE_HEADERS += (requests.structures.CaseInsensitiveDict,)
     HTTP_RESPONSE_CLASSES += (requests.Response,)
 
+try:
+    import multidict
+except ImportError:
+    multidict = None
+
+try:
+    from urllib3 import HTTPHeaderDict
+except ImportError:
+    try:
+        from urllib3._collections import HTTPHeaderDict
+    except ImportError:
+        HTTPHeaderDict = None
+
+
+# RFC 7231, section 3.1.1.1:
+#   media-type = type "/" subtype *( OWS ";" OWS parameter )
+#   parameter  = token "=" ( token / quoted-string )
+_TOKEN = r"[!#$%&'*+.^_`|~0-9A-Za-z-]+"
+_MEDIA_TYPE_RE = re.compile(r'[ \t]*({0}/{0})[ \t]*(?:;|$)'.format(_TOKEN))
+# parameters without a value, e.g. "; foo;", and values with unquoted white
+# space are invalid, but are tolerated as browsers do
+_PARAMETER_RE = re.compile(r"""
+    ;[ \t]*
+    ([^\s;=]+)                    # name
+    (?:
+        [ \t]*=[ \t]*
+        (?:
+            "((?:[^"\\]|\\.)*)"?   # quoted-string
+            |
+            ([^;]*)                # token
+        )
+    )?
+""", re.VERBOSE)
+_QUOTED_PAIR_RE = re.compile(r'\\(.)')
+
+
+def _parse_parameters(header_value, start):
+    """parse the parameters of a header value, starting at the first ';'
+
+    For repeated parameters, the first value is kept.
+    """
+    params = {}
+    if '"' not in header_value:
+        # fast path for the common case, without quoted-strings
+        for param in header_value[start + 1:].split(';'):
+            name, equals, value = param.partition('=')
+            name = name.strip()
+            if name:
+                params.setdefault(name.lower(),
+                                  value.strip() if equals else None)
+        return params
+
+    for m in _PARAMETER_RE.finditer(header_value, start):
+        name, quoted_value, value = m.groups()
+        if quoted_value is not None:
+            value = _QUOTED_PAIR_RE.sub(r'\1', quoted_value)
+        elif value is not None:
+            value = value.strip()
+        params.setdefault(name.lower(), value)
+    return params
+
+
+_set_attr = object.__setattr__
+
 
 class ContentTypeHeader(object):
-    "Keeps the value of an HTTP Content-Type header, and gives info about it."
+    """Keeps the value of an HTTP Content-Type header, and gives info about it.
+
+    The value is parsed once, on creation; instances are immutable. Use
+    parse_content_type() to reuse instances for recurring header values.
+    """
 
     HTML_CONTENT_TYPE = 'text/html'
     XHTML_CONTENT_TYPE = 'application/xhtml+xml'
     XML_CONTENT_TYPES = (XHTML_CONTENT_TYPE,) + ('text/xml', 'application/xml')
 
+    __slots__ = ('header_value', 'mime_type', 'params', 'charset', 'is_html',
+                 'is_xml')
+
     def __init__(self, header_value):
         """
         @param header_value: value of the Content-Type header, e.g. "text/html"
         """
-        self.header_value = header_value
-        self._first_part_lower = self.header_value.split(';', 1)[0].lower()
-
-    @property
-    def is_html(self):
-        "Tell whether the header says that the content is HTML."
-        return self._first_part_lower.startswith(self.HTML_CONTENT_TYPE)
-
-    @property
-    def is_xml(self):
-        "Tell whether the header says that the content is XML."
-        return (
-            self._first_part_lower.startswith(self.XML_CONTENT_TYPES) or
-            (
-                self._first_part_lower.startswith('application/') and
-                self._first_part_lower.endswith('+xml')
-            )
-        )
+        # the lower-cased "type/subtype", or None if malformed
+        m = _MEDIA_TYPE_RE.match(header_value)
+        mime_type = m.group(1).lower() if m else None
+
+        # a read-only mapping of the parameters, with lower-cased names;
+        # it isn't a dict, since instances are shared via the cache
+        params_start = header_value.find(';')
+        params = MappingProxyType(
+            _parse_parameters(header_value, params_start)
+            if params_start >= 0 else {})
+
+        _set_attr(self, 'header_value', header_value)
+        _set_attr(self, 'mime_type', mime_type)
+        _set_attr(self, 'params', params)
+        # the "charset" parameter, or None if not found
+        _set_attr(self, 'charset', params.get('charset') or None)
+        # whether the header says that the content is HTML
+        _set_attr(self, 'is_html', mime_type == self.HTML_CONTENT_TYPE)
+        # whether the header says that the content is XML
+        _set_attr(self, 'is_xml', mime_type is not None and (
+            mime_type in self.XML_CONTENT_TYPES or
+            (mime_type.startswith('application/') and
+             mime_type.endswith('+xml'))
+        ))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            '{} objects are immutable'.format(type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError(
+            '{} objects are immutable'.format(type(self).__name__))
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.header_value)
+
 
-    @property
-    def charset(self):
-        'Fetch the "charset" from the header value, or None if not found.'
-        m = re.search(r'charset=([^;]+)', self.header_value, re.IGNORECASE)
-        if m:
-            return m.group(1).strip()
-        else:
-            return None
+# The maximal number of parsed header values kept by parse_content_type().
+# Set to 0 to disable caching.
+CONTENT_TYPE_CACHE_SIZE = 256
+
+# header value -> ContentTypeHeader, from least to most recently used
+_parsed_content_types = collections.OrderedDict()
+
+
+def parse_content_type(header_value):
+    """get a ContentTypeHeader for a header value, reusing recent ones
+
+    Servers send few distinct Content-Type values, so parsed values are
+    cached, evicting the least recently used.
+
+    @param header_value: value of the Content-Type header, or None
+    @return: a ContentTypeHeader instance, or None if header_value is None
+    """
+    if header_value is None:
+        return None
+    if CONTENT_TYPE_CACHE_SIZE <= 0:
+        return ContentTypeHeader(header_value)
+    content_type_header = _parsed_content_types.pop(header_value, None)
+    if content_type_header is None:
+        content_type_header = ContentTypeHeader(header_value)
+        while len(_parsed_content_types) >= CONTENT_TYPE_CACHE_SIZE:
+            _parsed_content_types.popitem(last=False)
+    _parsed_content_types[header_value] = content_type_header
+    return content_type_header
+
+
+_CONTENT_TYPE_NAMES = frozenset(['content-type', b'content-type'])
+
+
+def _get_values_from_pairs(http_headers):
+    """get Content-Type values from an iterable of (name, value) pairs
+
+    This is a single pass over the headers, comparing lower-cased names.
+    Names may be bytes, e.g. b"Content-Type".
+    """
+    return [
+        value for (name, value) in http_headers
+        if len(name) == 12 and name.lower() in _CONTENT_TYPE_NAMES
+    ]
+
+
+def _get_values_from_mapping(http_headers):
+    "get Content-Type values from a mapping with case-sensitive names"
+    # check the usual spellings before searching through all of the names
+    for name in ('Content-Type', 'content-type'):
+        value = http_headers.get(name)
+        if value is not None:
+            return [value]
+    if 'wsgi.version' in http_headers:
+        # a WSGI environ, see PEP 3333
+        value = http_headers.get('CONTENT_TYPE')
+        return [value] if value else []
+    return _get_values_from_pairs(six.iteritems(http_headers))
+
+
+def _get_value(http_headers):
+    "get the Content-Type value from a case-insensitive mapping"
+    value = http_headers.get('content-type')
+    return [] if value is None else [value]
+
+
+def _get_values_from_message(http_headers):
+    "get Content-Type values from an email.message.Message"
+    return http_headers.get_all('content-type') or []
+
+
+# type -> function getting a list of the Content-Type values from headers of
+# that type (or of a sub-class)
+_header_getters = {
+    dict: _get_values_from_mapping,
+    list: _get_values_from_pairs,
+    tuple: _get_values_from_pairs,
+    email.message.Message: _get_values_from_message,
+}
+if rfc822 is not None:
+    _header_getters[rfc822.Message] = \
+        lambda http_headers: http_headers.getheaders('content-type')
+if requests is not None:
+    _header_getters[requests.structures.CaseInsensitiveDict] = _get_value
+if multidict is not None:
+    _header_getters.update({
+        multidict.CIMultiDict:
+            lambda http_headers: http_headers.getall('content-type', []),
+        multidict.CIMultiDictProxy:
+            lambda http_headers: http_headers.getall('content-type', []),
+        multidict.MultiDict:
+            lambda http_headers: _get_values_from_pairs(http_headers.items()),
+        multidict.MultiDictProxy:
+            lambda http_headers: _get_values_from_pairs(http_headers.items()),
+    })
+if HTTPHeaderDict is not None:
+    _header_getters[HTTPHeaderDict] = \
+        lambda http_headers: http_headers.getlist('content-type')
+
+# type -> getter, for the types of the headers seen so far
+_header_getters_by_type = {}
+
+
+def register_headers_class(headers_class, get_values):
+    """add support for getting the Content-Type from a class of headers
+
+    @param headers_class: the class of the headers; also used for its
+        sub-classes, unless they are registered themselves
+    @param get_values: a function getting headers and returning a list of
+        the values of their Content-Type headers, in order
+    """
+    _header_getters[headers_class] = get_values
+    _header_getters_by_type.clear()
+
+
+def _find_header_getter(headers_class):
+    for cls in inspect.getmro(headers_class):
+        getter = _header_getters.get(cls)
+        if getter is not None:
+            return getter
+    # an unknown class; dict-like classes are assumed to map names to values
+    if hasattr(headers_class, 'get'):
+        return _get_values_from_mapping
+    return _get_values_from_pairs
+
+
+# splits combined header values, e.g. "text/plain, text/html", by commas
+# outside of quoted-strings
+_HEADER_VALUE_RE = re.compile(r'(?:[^,"]|"(?:[^"\\]|\\.)*"?)+')
+
+
+def _select_content_type(values):
+    """choose among the values of repeated Content-Type headers
+
+    As in the Fetch standard, the last valid media type is used, keeping
+    the charset of an equal preceding one if it has no charset itself.
+    Malformed values are only returned if there are no valid ones.
+    """
+    split_values = []
+    for value in values:
+        if not isinstance(value, six.string_types):
+            value = value.decode('latin-1')
+        split_values.extend(
+            part.strip() for part in _HEADER_VALUE_RE.findall(value))
+
+    selected = None
+    for value in split_values:
+        content_type = parse_content_type(value)
+        if content_type.mime_type in (None, '*/*'):
+            continue
+        if (selected is None or content_type.charset is not None or
+                content_type.mime_type != selected.mime_type):
+            selected = content_type
+    if selected is not None:
+        return selected.header_value
+    return split_values[-1] if split_values else None
 
 
 def get_content_type(http_headers):
-    "fetch the Content-Type header's value, or None if no such header is found"
-    header_value = None
-
-    if http_headers is not None:
-        # most message classes, e.g. rfc822.Message and email.message.Message,
-        # are dict-like but use case-insensitive matching
-        header_value = http_headers.get('content-type', None)
-        if header_value is None:
-            if not isinstance(http_headers,
-                              CLASSES_WITH_CASE_INSENSITIVE_HEADERS):
-                for header_name in http_headers:
-                    if header_name.lower() == 'content-type':
-                        header_value = http_headers[header_name]
-                        break
-
-    return header_value
+    """fetch the Content-Type header's value, or None if no such header is found
+
+    Supported headers include dicts, case-insensitive mappings such as
+    email.message.Message, multidicts such as aiohttp's CIMultiDictProxy and
+    urllib3's HTTPHeaderDict, WSGI environs and lists of (name, value)
+    pairs. Names and values may be bytes. Other classes may be supported via
+    register_headers_class().
+
+    If there are several Content-Type headers, or several values combined
+    into one, the one a browser would use is chosen.
+    """
+    if http_headers is None:
+        return None
+
+    headers_class = http_headers.__class__
+    try:
+        getter = _header_getters_by_type[headers_class]
+    except KeyError:
+        getter = _header_getters_by_type[headers_class] = \
+            _find_header_getter(headers_class)
+
+    values = getter(http_headers)
+    if len(values) == 1:
+        value = values[0]
+        if not isinstance(value, six.string_types):
+            value = value.decode('latin-1')
+        if ',' not in value:
+            return value
+        values = [value]
+    elif not values:
+        return None
+    return _select_content_type(values)
@@ -1,54 +1,1002 @@
+import codecs
+import collections
+import contextlib
+import itertools
+import re
+import threading
+import time
+
 import bs4
-from bs4.dammit import UnicodeDammit, EncodingDetector
+import six
+from bs4.dammit import UnicodeDammit
 try:
     import lxml.etree
     import lxml.html
 except:
     lxml = None
 
-from htmldammit.contenttypes import get_content_type, ContentTypeHeader
+from htmldammit.charsets import deduplicate_encodings, label_encodings, \
+    normalize_encoding, _lookup_text_codec
+from htmldammit.contenttypes import get_content_type, parse_content_type
 
+from htmldammit.detectors import get_detector
 
-def make_UnicodeDammit(raw_html, http_headers=None, **kwargs):
-    """create a UnicodeDammit instance for the given HTML
 
-    If given the HTTP response headers and they contain a Content-Type header
-    with an encoding, it will be given to UnicodeDammit properly.
+# The number of bytes searched for an inline encoding declaration, as
+# specified by the WHATWG HTML standard's encoding sniffing "prescan".
+PRESCAN_BYTES = 1024
+
+_XML_ENCODING_RE = re.compile(
+    br'''^\s*<\?.*encoding=['"](.*?)['"].*\?>''', re.I)
+_HTML_META_RE = re.compile(
+    br'''<\s*meta[^>]+charset\s*=\s*["']?([^>]*?)[ /;'">]''', re.I)
+
+
+_BOMS = [
+    # (BOM, encoding); UTF-32 BOMs start with UTF-16 BOMs, so they come first
+    (codecs.BOM_UTF32_BE, 'utf-32be'),
+    (codecs.BOM_UTF32_LE, 'utf-32le'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_BE, 'utf-16be'),
+    (codecs.BOM_UTF16_LE, 'utf-16le'),
+]
+
+
+def as_markup(raw_html):
+    """get binary data in a form usable for decoding, without copying it
+
+    bytes are returned as-is. Other objects supporting the buffer protocol,
+    e.g. bytearray, memoryview and mmap.mmap, are returned as a memoryview.
+
+    On Python 2, whose memoryview doesn't support mmap objects and can't be
+    searched with the re module, these are instead copied into bytes.
+    """
+    if isinstance(raw_html, (bytes, six.text_type)):
+        return raw_html
+    if six.PY2:
+        if isinstance(raw_html, memoryview):
+            return raw_html.tobytes()
+        return bytes(buffer(raw_html))
+    view = memoryview(raw_html)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
+def strip_byte_order_mark(markup):
+    """strip a BOM (Byte Order Mark), if present, from binary data
+
+    Unlike bs4.dammit.EncodingDetector.strip_byte_order_mark(), this also
+    supports memoryview objects, which are sliced without copying the data.
+
+    @param markup: the binary data (str or memoryview)
+    @return: a (markup, bom_encoding) tuple; bom_encoding is None if there
+        was no BOM
+    """
+    if isinstance(markup, six.text_type):
+        return markup, None
+    head = bytes(markup[:4])
+    for (bom, encoding) in _BOMS:
+        if head.startswith(bom):
+            return markup[len(bom):], encoding
+    return markup, None
+
+
+def find_declared_encoding(raw_html, is_html=False,
+                           prescan_bytes=PRESCAN_BYTES):
+    """find an encoding declared inside the document itself
+
+    Only the first prescan_bytes bytes are searched, as browsers do. The
+    search is done in-place, without copying the searched part of the data.
+
+    @param raw_html: the binary (i.e. encoded) HTML data (str)
+    @param is_html: whether to also look for <meta> tags (bool)
+    @param prescan_bytes: the number of bytes to search, or None to search the
+        entire document (int; optional)
+    @return: the declared encoding, lower-cased (str), or None if not found
+    """
+    if isinstance(raw_html, six.text_type):
+        # already decoded; an inline declaration is meaningless
+        return None
+
+    endpos = len(raw_html)
+    if prescan_bytes is not None:
+        endpos = min(endpos, prescan_bytes)
+
+    match = _XML_ENCODING_RE.search(raw_html, 0, endpos)
+    if match is None and is_html:
+        match = _HTML_META_RE.search(raw_html, 0, endpos)
+    if match is None or not match.group(1):
+        return None
+    return match.group(1).decode('ascii', 'replace').lower()
+
+
+# The default number of bytes given to statistical encoding detection.
+DETECTION_SAMPLE_BYTES = 64 * 1024
+
+# The sizes of the slices of data making up a detection sample.
+_SAMPLE_SLICE_BYTES = 4 * 1024
+_SAMPLE_REGIONS_PER_SLICE = 64
+_NON_ASCII_RE = re.compile(b'[\x80-\xff]')
+_TAG_END_RE = re.compile(b'>')
+_ASCII_BYTES = bytes(bytearray(range(0x80)))
+
+
+def _count_non_ascii(data):
+    return len(bytes(data).translate(None, _ASCII_BYTES))
+
+
+def _align_slice(data, start, end):
+    """move a slice's boundaries forward to just after a '>'
+
+    This avoids cutting multi-byte characters in the middle.
+    """
+    if start > 0:
+        match = _TAG_END_RE.search(data, start, end)
+        if match is not None:
+            start = match.end()
+    match = _TAG_END_RE.search(data, end, end + _SAMPLE_SLICE_BYTES)
+    if match is not None:
+        end = match.end()
+    return start, end
+
+
+def make_detection_sample(data, sample_bytes=DETECTION_SAMPLE_BYTES):
+    """select a bounded sample of data for statistical encoding detection
+
+    The sample is made up of slices of data from the head, middle and tail
+    of the data. Of the slices in the middle, those with the most non-ASCII
+    bytes are preferred, since those carry the information used to detect
+    the encoding.
+
+    @param data: the binary (i.e. encoded) data (str)
+    @param sample_bytes: the approximate maximal size of the sample (int)
+    @return: the sample (str); this is data itself if it is small enough
+    """
+    if len(data) <= sample_bytes:
+        return data
+
+    slice_bytes = max(1, min(_SAMPLE_SLICE_BYTES, sample_bytes // 4))
+    n_slices = sample_bytes // slice_bytes
+
+    # always include the head and the tail
+    head_end = slice_bytes
+    tail_start = len(data) - slice_bytes
+    slices = [(0, head_end)]
+
+    # pick slices in the middle from the regions with the most non-ASCII
+    # bytes; counting these is cheap compared to detection
+    n_middle = n_slices - 2
+    if n_middle > 0:
+        n_regions = max(1, min((tail_start - head_end) // slice_bytes,
+                               _SAMPLE_REGIONS_PER_SLICE * n_middle))
+        region_bytes = (tail_start - head_end) // n_regions
+        regions = []
+        for i in range(n_regions):
+            start = head_end + i * region_bytes
+            end = start + region_bytes
+            regions.append((_count_non_ascii(data[start:end]), start, end))
+        regions.sort(key=lambda region: -region[0])
+        for (count, start, end) in regions[:n_middle]:
+            # start the slice shortly before the region's first non-ASCII byte
+            match = _NON_ASCII_RE.search(data, start, end) if count else None
+            if match is not None:
+                start = max(head_end, match.start() - slice_bytes // 4)
+            slices.append((start, min(start + slice_bytes, tail_start)))
+        slices.sort()
+
+    slices.append((tail_start, len(data)))
+    return b'\n'.join(
+        data[start:end]
+        for (start, end) in (_align_slice(data, start, end)
+                             for (start, end) in slices)
+    )
+
+
+def detect_encoding(data, sample_bytes=DETECTION_SAMPLE_BYTES, detector=None):
+    """guess the encoding of data using statistical detection
+
+    @param data: the binary (i.e. encoded) data (str)
+    @param sample_bytes: the approximate maximal size of the sample given to
+        the detector, or None to give it all of the data (int; optional)
+    @param detector: the detection backend to use; see htmldammit.detectors
+        (str or Detector; optional)
+    @return: the name of the detected encoding (str), or None if it could
+        not be detected or no detection library is installed
+    """
+    if sample_bytes is not None:
+        data = make_detection_sample(data, sample_bytes)
+    # detection libraries require bytes
+    return get_detector(detector).detect(bytes(data))
+
+
+# Encodings tried after statistical detection, as a last resort. ISO-8859-1
+# never fails; it decodes the bytes which Python's windows-1252 codec
+# rejects as C1 control characters, as browsers do.
+FALLBACK_ENCODINGS = ('utf-8', 'windows-1252', 'iso-8859-1')
+
+
+class _DetectedEncodings(object):
+    """Lazily detected encodings, followed by the fallback encodings
+
+    These are only tried after any declared encodings fail, so detection is
+    only run when actually needed. They always end with an encoding which
+    can't fail.
+    """
+
+    def __init__(self, markup, sample_bytes, detector, timer=None,
+                 timer_stage=None):
+        """
+        @param timer: a _StageTimer to record the time taken by detection
+            in, separately from the time taken by the enclosing stage,
+            timer_stage (optional)
+        """
+        self._markup = markup
+        self._sample_bytes = sample_bytes
+        self._detector = detector
+        self._timer = timer
+        self._timer_stage = timer_stage
+        # whether detection has been run, and its result
+        self.detection_run = False
+        self.detected_encoding = None
+        self._encodings = None
+
+    def __iter__(self):
+        if self._encodings is None:
+            if self._timer is not None:
+                self._timer.mark(self._timer_stage)
+            # detectors' names for encodings are labels, e.g. "GB2312"
+            self.detected_encoding = normalize_encoding(detect_encoding(
+                self._markup, self._sample_bytes, self._detector))
+            self.detection_run = True
+            if self._timer is not None:
+                self._timer.mark('detection')
+            self._encodings = \
+                ([self.detected_encoding] if self.detected_encoding else []) + \
+                list(FALLBACK_ENCODINGS)
+        return iter(self._encodings)
+
+    def source_of(self, encoding):
+        "get the DecodeResult source of an encoding given by this, or None"
+        if not self.detection_run:
+            return None
+        codec_name = _codec_name(encoding)
+        if (
+            self.detected_encoding and
+            codec_name == _codec_name(self.detected_encoding)
+        ):
+            return DecodeResult.SOURCE_DETECTION
+        if codec_name in (_codec_name(e) for e in FALLBACK_ENCODINGS):
+            return DecodeResult.SOURCE_FALLBACK
+        return None
+
+
+class EncodingInfo(object):
+    """Information about a document's encoding, gathered before decoding."""
+
+    def __init__(self, markup, is_html, bom_encoding, declared_encoding,
+                 charset):
+        # the document with any BOM stripped
+        self.markup = markup
+        self.is_html = is_html
+        self.bom_encoding = bom_encoding
+        self.declared_encoding = declared_encoding
+        # the charset given in the Content-Type HTTP header
+        self.charset = charset
+
+        # the encodings to try for each of the declared labels; see
+        # htmldammit.charsets.label_encodings()
+        self._declared_encodings = label_encodings(declared_encoding,
+                                                   declared=True)
+        self._charset_encodings = label_encodings(charset)
+        # BOM, inline declaration and HTTP header encodings, in that order,
+        # without unknown encodings or duplicates
+        self.encodings_to_try_first = deduplicate_encodings(itertools.chain(
+            [bom_encoding], self._declared_encodings,
+            self._charset_encodings))
+
+    @property
+    def trusted_encoding(self):
+        """The encoding to use without any heuristics, or None if not certain.
+
+        The encoding is considered certain if there is a BOM, or if the
+        Content-Type HTTP header and the inline declaration agree.
+        """
+        if self.bom_encoding is not None:
+            return self.bom_encoding
+        if self._charset_encodings and self._declared_encodings:
+            if (
+                _codec_name(self._charset_encodings[0]) ==
+                _codec_name(self._declared_encodings[0])
+            ):
+                return self._declared_encodings[0]
+        return None
+
+    @property
+    def trusted_encoding_source(self):
+        "the DecodeResult source of the trusted encoding"
+        return DecodeResult.SOURCE_BOM if self.bom_encoding is not None \
+            else DecodeResult.SOURCE_DECLARATION
+
+    def _encodings_by_source(self):
+        return [
+            (DecodeResult.SOURCE_BOM,
+             [self.bom_encoding] if self.bom_encoding else []),
+            (DecodeResult.SOURCE_DECLARATION, self._declared_encodings),
+            (DecodeResult.SOURCE_HTTP_HEADER, self._charset_encodings),
+        ]
+
+    def source_of(self, encoding):
+        """get the DecodeResult source of one of the encodings_to_try_first
+
+        Returns None if the encoding isn't one of them.
+        """
+        codec_name = _codec_name(encoding)
+        for source, source_encodings in self._encodings_by_source():
+            if any(_codec_name(source_encoding) == codec_name
+                   for source_encoding in source_encodings):
+                return source
+        return None
+
+    def agrees_with(self, encoding):
+        "check whether an encoding is among those of every declared encoding"
+        codec_name = _codec_name(encoding)
+        return codec_name is not None and all(
+            any(_codec_name(source_encoding) == codec_name
+                for source_encoding in source_encodings)
+            for _source, source_encodings in self._encodings_by_source()
+            if source_encodings
+        )
+
+
+def _codec_name(encoding):
+    """get the canonical Python codec name of an encoding
+
+    @return: the codec name, or None if the encoding is unknown or isn't a
+        text encoding
+    """
+    codec_info = _lookup_text_codec(encoding)
+    return codec_info.name if codec_info is not None else None
+
+
+def get_encoding_info(raw_html, http_headers=None,
+                      prescan_bytes=PRESCAN_BYTES):
+    """gather encoding information from the BOM, headers and inline declaration
 
     @param raw_html: the binary (i.e. encoded) HTML data (str)
     @param http_headers: the HTTP response headers (dict; optional)
-    @return: a UnicodeDammit instance
+    @param prescan_bytes: the number of bytes to search for an inline encoding
+        declaration; pass None to search the entire document (int; optional)
+    @return: an EncodingInfo instance
     """
+    return _get_encoding_info(raw_html, http_headers, prescan_bytes)
+
+
+def _get_encoding_info(raw_html, http_headers, prescan_bytes, timer=None):
     content_type = get_content_type(http_headers)
     if content_type:
-        content_type_header = ContentTypeHeader(content_type)
+        content_type_header = parse_content_type(content_type)
         is_html = content_type_header.is_html
         charset = content_type_header.charset
     else:
         is_html = False
         charset = None
+    if timer is not None:
+        timer.mark('http_headers')
+
+    markup, bom_encoding = strip_byte_order_mark(as_markup(raw_html))
+    if timer is not None:
+        timer.mark('bom')
+
+    declared_encoding = find_declared_encoding(
+        markup, is_html=is_html, prescan_bytes=prescan_bytes)
+    if timer is not None:
+        timer.mark('prescan')
 
-    encodings_to_try_first = []
-    raw_html, bom_encoding = EncodingDetector.strip_byte_order_mark(raw_html)
-    if bom_encoding is not None:
-        encodings_to_try_first.append(bom_encoding)
+    return EncodingInfo(markup, is_html, bom_encoding, declared_encoding,
+                        charset)
 
-    declared_encoding = EncodingDetector.find_declared_encoding(
-        raw_html, is_html=is_html, search_entire_document=True)
-    if declared_encoding is not None:
-        encodings_to_try_first.append(declared_encoding)
 
-    if charset:
-        encodings_to_try_first.append(charset)
+def make_UnicodeDammit(raw_html, http_headers=None,
+                       prescan_bytes=PRESCAN_BYTES, **kwargs):
+    """create a UnicodeDammit instance for the given HTML
+
+    If given the HTTP response headers and they contain a Content-Type header
+    with an encoding, it will be given to UnicodeDammit properly.
+
+    @param raw_html: the binary (i.e. encoded) HTML data (str)
+    @param http_headers: the HTTP response headers (dict; optional)
+    @param prescan_bytes: the number of bytes to search for an inline encoding
+        declaration; pass None to search the entire document (int; optional)
+    @return: a UnicodeDammit instance
+    """
+    encoding_info = get_encoding_info(raw_html, http_headers, prescan_bytes)
+    return _make_UnicodeDammit(encoding_info, **kwargs)
+
 
+def _make_UnicodeDammit(encoding_info, **kwargs):
     return UnicodeDammit(
-        raw_html, is_html=is_html,
-        override_encodings=encodings_to_try_first,
+        encoding_info.markup, is_html=encoding_info.is_html,
+        override_encodings=encoding_info.encodings_to_try_first,
         **kwargs
     )
 
 
-def decode_html(raw_html, http_headers=None):
+class DecodeResult(object):
+    """The result of decoding HTML, including how it was decoded.
+
+    Besides the text and encoding, this records:
+
+    * path: which decoding path was taken; one of the path constants below
+    * source: where the encoding came from; one of the SOURCE_* constants
+      below, or None if unknown
+    * candidates: the encodings considered, in order, up to and including
+      the one used (tuple)
+    * contains_replacement_characters: whether undecodable data was replaced
+      with U+FFFD characters; decode_html_result() decodes strictly, so this
+      is only set for data decoded with errors replaced (bool)
+    * timings: the time taken by each stage, in nanoseconds (dict); the
+      stages are 'http_headers', 'bom', 'prescan', 'trusted',
+      'ascii_or_utf8', 'hint', 'detection' and 'validation'. Only the
+      stages run are included, plus 'total'. Time spent on detection isn't
+      included in the other stages.
+    * full_decodes: the number of times all of the data was decoded, or
+      validated by resolve_html_encoding(); candidate encodings are first
+      checked against a prefix of the data, so this is usually 1 (int)
+    """
+    __slots__ = (
+        'text', 'encoding', 'markup', 'is_html', 'path', 'source',
+        'candidates', 'contains_replacement_characters', 'timings',
+        'full_decodes',
+    )
+
+    # the decoding paths which may be taken
+    TRUSTED_ENCODING = 'trusted_encoding'
+    ASCII_OR_UTF8 = 'ascii_or_utf8'
+    ENCODING_HINT = 'encoding_hint'
+    # the first candidate encoding which the data is valid in
+    VALID_CANDIDATE = 'valid_candidate'
+    # the data was given as text, and is used as-is; the encoding is None
+    ALREADY_DECODED = 'already_decoded'
+    # the encoding was settled on the first part of the data, as by
+    # IncrementalHtmlDecoder, and all of the data was then decoded with it
+    # without errors
+    INCREMENTAL = 'incremental'
+
+    # the sources of encodings
+    SOURCE_BOM = 'bom'
+    SOURCE_DECLARATION = 'declaration'
+    SOURCE_HTTP_HEADER = 'http_header'
+    SOURCE_ASCII_OR_UTF8 = 'ascii_or_utf8'
+    SOURCE_HINT = 'hint'
+    SOURCE_DETECTION = 'detection'
+    SOURCE_FALLBACK = 'fallback'
+
+    def __init__(self, text, encoding, markup, is_html, path,
+                 contains_replacement_characters=False, source=None,
+                 candidates=(), timings=None, full_decodes=0):
+        self.text = text
+        self.encoding = encoding
+        # the binary HTML data which was decoded, with any BOM stripped
+        self.markup = markup
+        self.is_html = is_html
+        self.path = path
+        self.contains_replacement_characters = contains_replacement_characters
+        self.source = source
+        self.candidates = tuple(candidates)
+        self.timings = timings if timings is not None else {}
+        self.full_decodes = full_decodes
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return '<{} encoding={!r} source={!r} path={!r}>'.format(
+            type(self).__name__, self.encoding, self.source, self.path)
+
+
+try:
+    _now_ns = time.perf_counter_ns
+except AttributeError:  # Python < 3.7
+    _clock = getattr(time, 'perf_counter', time.time)
+
+    def _now_ns():
+        return int(_clock() * 1e9)
+
+
+class _StageTimer(object):
+    """Measures the time taken by the stages of decoding, in nanoseconds.
+
+    Call mark() at the end of each stage; the time since the previous call
+    (or since creation) is added to that stage's time.
+    """
+    __slots__ = ('timings', '_start', '_last')
+
+    def __init__(self):
+        self.timings = {}
+        self._start = self._last = _now_ns()
+
+    def mark(self, stage):
+        now = _now_ns()
+        timings = self.timings
+        timings[stage] = timings.get(stage, 0) + now - self._last
+        self._last = now
+
+    def finish(self):
+        "get the timings, including the total time since creation"
+        self.timings['total'] = self._last - self._start
+        return self.timings
+
+
+class InstrumentationEvent(object):
+    """A measurement of a stage of decoding or parsing HTML.
+
+    See set_instrumentation().
+    """
+    __slots__ = ('operation', 'stage', 'duration_ns', 'n_bytes', 'result')
+
+    # the operations measured
+    DECODE = 'decode'
+    RESOLVE = 'resolve'
+    PARSE = 'parse'
+
+    def __init__(self, operation, stage, duration_ns, n_bytes, result=None):
+        # decode_html_result(), resolve_html_encoding() or an lxml parse
+        self.operation = operation
+        # a stage named in DecodeResult.timings, 'total' for the entire
+        # operation, or 'lxml_parse'
+        self.stage = stage
+        self.duration_ns = duration_ns
+        # the number of bytes of the document processed by the stage, or
+        # None if not applicable
+        self.n_bytes = n_bytes
+        # the DecodeResult, given with the 'total' stage only
+        self.result = result
+
+    def __repr__(self):
+        return '<{} {}/{} {} ns {} bytes>'.format(
+            type(self).__name__, self.operation, self.stage,
+            self.duration_ns, self.n_bytes)
+
+
+_instrumentation = None
+
+
+def set_instrumentation(callback):
+    """set a function to be called with measurements of each decoding stage
+
+    The callback is called with an InstrumentationEvent for each stage run,
+    when each call to decode_html_result(), resolve_html_encoding() or
+    make_lxml_html() (and so also decode_html(), make_soup() etc.) is done.
+    It is called in the thread doing the decoding, and shouldn't raise.
+    See htmldammit.metrics for a callback aggregating metrics.
+
+    Instrumentation is global. When disabled, which is the default, it adds
+    no measurable overhead.
+
+    @param callback: a function getting an InstrumentationEvent, or None to
+        disable instrumentation
+    @return: the previous callback, or None
+    """
+    global _instrumentation
+    previous, _instrumentation = _instrumentation, callback
+    return previous
+
+
+def get_instrumentation():
+    "get the instrumentation callback, or None if disabled"
+    return _instrumentation
+
+
+@contextlib.contextmanager
+def instrumentation(callback):
+    "a context manager setting the instrumentation callback temporarily"
+    previous = set_instrumentation(callback)
+    try:
+        yield callback
+    finally:
+        set_instrumentation(previous)
+
+
+def _emit_events(callback, operation, result, prescan_bytes,
+                 detection_sample_bytes):
+    n_bytes = len(result.markup)
+    stage_bytes = {
+        'http_headers': None,
+        # the longest BOM is 4 bytes long
+        'bom': min(n_bytes, 4),
+        'prescan': n_bytes if prescan_bytes is None
+        else min(n_bytes, prescan_bytes),
+        'detection': n_bytes if detection_sample_bytes is None
+        else min(n_bytes, detection_sample_bytes),
+    }
+    for stage, duration_ns in result.timings.items():
+        if stage != 'total':
+            callback(InstrumentationEvent(
+                operation, stage, duration_ns, stage_bytes.get(stage, n_bytes)))
+    callback(InstrumentationEvent(operation, 'total',
+                                  result.timings['total'], n_bytes, result))
+
+
+def _decode_ascii_or_utf8(markup):
+    """decode data which is valid UTF-8, or return None if it isn't
+
+    Returns a (text, encoding) tuple, where the encoding is 'ascii' if the
+    data is pure ASCII, or False if the data is valid UTF-8 but includes NUL
+    characters. This takes a single pass over the data.
+    """
+    try:
+        text = codecs.decode(markup, 'utf-8')
+    except UnicodeDecodeError:
+        return None
+    # UTF-16 and UTF-32 encoded ASCII text is also valid UTF-8, but includes
+    # NUL characters, which are rarely found in real HTML.
+    if u'\x00' in text:
+        return False
+    # each non-ASCII character takes more than one byte in UTF-8
+    encoding = 'ascii' if len(text) == len(markup) else 'utf-8'
+    return text, encoding
+
+
+def decode_html_result(raw_html, http_headers=None,
+                       prescan_bytes=PRESCAN_BYTES, trusted_fast_path=True,
+                       utf8_fast_path=True,
+                       detection_sample_bytes=DETECTION_SAMPLE_BYTES,
+                       detector=None, hint_cache=None, url=None):
+    """Decode binary HTML data into unicode, returning a DecodeResult.
+
+    See decode_html() for details.
+
+    If the encoding is certain, i.e. given by a BOM or by matching HTTP header
+    and inline declarations, the data is decoded directly.
+
+    If no encoding is given at all, data which is pure ASCII or valid UTF-8
+    is decoded as such, skipping the expensive statistical detection.
+
+    Otherwise, if a hint cache and URL are given and an encoding is cached
+    for the URL's site, that encoding is used if the data decodes with it
+    without errors and no different encoding is declared. Successfully
+    decoded pages update the cache; see htmldammit.hints.
+
+    Otherwise, the declared encodings, the detected encoding and finally
+    the fallback encodings are tried in turn, until one decodes the data
+    without errors. Statistical detection is run on a bounded sample of the
+    data rather than on all of it; see make_detection_sample().
+
+    Each codec is tried at most once, and only after the data's first part
+    decodes with it, so the data is usually decoded just once; see
+    DecodeResult.full_decodes.
+
+    @param raw_html: the binary (i.e. encoded) HTML data (str)
+    @param http_headers: the HTTP response headers (dict; optional)
+    @param prescan_bytes: the number of bytes to search for an inline encoding
+        declaration; pass None to search the entire document (int; optional)
+    @param trusted_fast_path: whether to decode directly when the encoding is
+        certain (bool; optional)
+    @param utf8_fast_path: whether to check for ASCII and UTF-8 before
+        guessing the encoding of undeclared data (bool; optional)
+    @param detection_sample_bytes: the approximate maximal number of bytes to
+        use for statistical encoding detection, or None to use all of the
+        data (int; optional)
+    @param detector: the statistical detection backend to use; see
+        htmldammit.detectors (str or Detector; optional)
+    @param hint_cache: a cache of encodings per site (EncodingHintCache;
+        optional)
+    @param url: the URL of the document, used with hint_cache (str; optional)
+    @return: a DecodeResult instance
+    """
+    return _find_encoding(
+        InstrumentationEvent.DECODE, raw_html, http_headers, prescan_bytes,
+        trusted_fast_path, utf8_fast_path, detection_sample_bytes, detector,
+        hint_cache, url)
+
+
+def _remember_encoding(hint_cache, url, result):
+    # pure ASCII says nothing about a site's encoding, and neither do the
+    # fallback encodings, which would then be used rather than detection
+    if (
+        result.path != DecodeResult.ENCODING_HINT and
+        result.source != DecodeResult.SOURCE_FALLBACK and
+        result.encoding not in (None, 'ascii') and
+        not result.contains_replacement_characters
+    ):
+        hint_cache.set(url, result.encoding)
+
+
+def _hint_is_consistent(encoding_info, hint):
+    "check whether a cached hint agrees with all of the declared encodings"
+    return encoding_info.agrees_with(hint)
+
+
+def _find_encoding(operation, raw_html, http_headers, prescan_bytes,
+                   trusted_fast_path, utf8_fast_path, detection_sample_bytes,
+                   detector, hint_cache, url):
+    """find the encoding of HTML data, also decoding it when decoding
+
+    This is the implementation of both decode_html_result() and
+    resolve_html_encoding(); see these for the parameters.
+
+    @param operation: InstrumentationEvent.DECODE to decode the data, or
+        InstrumentationEvent.RESOLVE to only check its validity
+    @return: a DecodeResult instance; its text is None unless decoding
+    """
+    if url is None:
+        hint_cache = None
+    decode = operation == InstrumentationEvent.DECODE
+    if decode:
+        full_pass, ascii_or_utf8_pass = _decode_all, _decode_ascii_or_utf8
+    else:
+        full_pass, ascii_or_utf8_pass = _validate_all, _validate_ascii_or_utf8
+
+    timer = _StageTimer()
+    encoding_info = _get_encoding_info(raw_html, http_headers, prescan_bytes,
+                                       timer)
+    markup = encoding_info.markup
+    candidates = _CandidateEncodings(markup, full_pass)
+
+    def make_result(text, encoding, path, source):
+        result = DecodeResult(text if decode else None, encoding, markup,
+                              encoding_info.is_html, path, source=source,
+                              candidates=candidates.considered,
+                              timings=timer.finish(),
+                              full_decodes=candidates.full_decodes)
+        if hint_cache is not None:
+            _remember_encoding(hint_cache, url, result)
+        if _instrumentation is not None:
+            _emit_events(_instrumentation, operation, result, prescan_bytes,
+                         detection_sample_bytes)
+        return result
+
+    if isinstance(markup, six.text_type):
+        return make_result(markup, None, DecodeResult.ALREADY_DECODED, None)
+
+    trusted_encoding = encoding_info.trusted_encoding \
+        if trusted_fast_path else None
+    if trusted_encoding is not None:
+        text = candidates.try_encoding(trusted_encoding)
+        timer.mark('trusted')
+        if text is not None:
+            return make_result(text, trusted_encoding,
+                               DecodeResult.TRUSTED_ENCODING,
+                               encoding_info.trusted_encoding_source)
+
+    if utf8_fast_path and not encoding_info.encodings_to_try_first:
+        decoded = candidates.try_ascii_or_utf8(ascii_or_utf8_pass)
+        timer.mark('ascii_or_utf8')
+        if decoded is not None:
+            text, encoding = decoded
+            return make_result(text, encoding, DecodeResult.ASCII_OR_UTF8,
+                               DecodeResult.SOURCE_ASCII_OR_UTF8)
+
+    if hint_cache is not None:
+        hint = hint_cache.lookup(url)
+        text = None
+        if hint is not None:
+            if _hint_is_consistent(encoding_info, hint):
+                text = candidates.try_encoding(hint)
+            else:
+                candidates.considered.append(hint)
+            if text is not None:
+                hint_cache.confirm(url, hint)
+            else:
+                hint_cache.reject(url)
+        timer.mark('hint')
+        if text is not None:
+            return make_result(text, hint, DecodeResult.ENCODING_HINT,
+                               DecodeResult.SOURCE_HINT)
+
+    detected_encodings = _DetectedEncodings(
+        markup, detection_sample_bytes, get_detector(detector), timer,
+        'validation')
+    for encoding in itertools.chain(encoding_info.encodings_to_try_first,
+                                    detected_encodings):
+        text = candidates.try_encoding(encoding)
+        if text is not None:
+            timer.mark('validation')
+            source = encoding_info.source_of(encoding) or \
+                detected_encodings.source_of(encoding)
+            return make_result(text, encoding, DecodeResult.VALID_CANDIDATE,
+                               source)
+    # not reached: the last fallback encoding accepts any data
+    raise AssertionError('no encoding could decode the data')
+
+
+# The size of the chunks in which data is decoded to check its validity.
+_VALIDATION_CHUNK_BYTES = 64 * 1024
+
+# The amount of data checked with a candidate encoding before decoding all
+# of the data with it; see _CandidateEncodings.
+_CANDIDATE_PREFIX_BYTES = 64 * 1024
+
+
+def _iter_decoded_chunks(markup, encoding, errors='strict'):
+    """decode data in chunks, so that all of its text isn't kept in memory
+
+    Raises UnicodeDecodeError if the data is invalid in the encoding (unless
+    errors is other than 'strict'), or LookupError if the encoding is
+    unknown.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    for start in range(0, len(markup), _VALIDATION_CHUNK_BYTES):
+        yield decoder.decode(markup[start:start + _VALIDATION_CHUNK_BYTES])
+    yield decoder.decode(b'', True)
+
+
+# The errors raised when decoding with a candidate encoding fails, which
+# include UnicodeDecodeError, a ValueError, and LookupError for unknown
+# encodings.
+_DECODE_ERRORS = (ValueError, TypeError, LookupError)
+
+
+def _is_valid_encoding(markup, encoding):
+    "check whether data is valid in an encoding, without decoding it at once"
+    try:
+        for _text in _iter_decoded_chunks(markup, encoding):
+            pass
+    except _DECODE_ERRORS:
+        return False
+    return True
+
+
+def _is_valid_prefix(data, encoding):
+    "check whether data is valid, possibly cut short, data in an encoding"
+    try:
+        codecs.getincrementaldecoder(encoding)('strict').decode(data)
+    except _DECODE_ERRORS:
+        return False
+    return True
+
+
+def _decode_all(markup, encoding):
+    "decode all of the data, or return None if it is invalid in the encoding"
+    try:
+        return codecs.decode(markup, encoding)
+    except _DECODE_ERRORS:
+        return None
+
+
+def _validate_all(markup, encoding):
+    """like _decode_all(), without decoding the data at once
+
+    Returns True if the data is valid in the encoding, or None otherwise.
+    """
+    return True if _is_valid_encoding(markup, encoding) else None
+
+
+class _CandidateEncodings(object):
+    """Tries candidate encodings for a document in turn.
+
+    Each codec is tried at most once, however many names it is given by.
+    Each candidate is first checked against a prefix of the data, and all of
+    the data is decoded (or validated) with it only if the prefix is valid,
+    so that typically this is done just once per document, for the encoding
+    used, rather than once per candidate.
+    """
+
+    def __init__(self, markup, full_pass):
+        """
+        @param markup: the binary HTML data, with any BOM stripped
+        @param full_pass: a function getting the data and an encoding, and
+            processing all of the data with it, e.g. _decode_all(), returning
+            None if the data is invalid in the encoding
+        """
+        self.markup = markup
+        self._full_pass = full_pass
+        self._check_prefix = len(markup) > _CANDIDATE_PREFIX_BYTES
+        self._codec_names = set()
+        # the encodings considered, in order, for DecodeResult.candidates
+        self.considered = []
+        # the number of times all of the data was decoded or validated
+        self.full_decodes = 0
+
+    def _should_try(self, encoding):
+        codec_name = _codec_name(encoding)
+        if codec_name is None or codec_name in self._codec_names:
+            return False
+        self._codec_names.add(codec_name)
+        self.considered.append(encoding)
+        return not self._check_prefix or _is_valid_prefix(
+            self.markup[:_CANDIDATE_PREFIX_BYTES], encoding)
+
+    def try_encoding(self, encoding):
+        """try an encoding, unless a candidate with its codec was tried
+
+        @return: the result of the full pass, or None if the encoding wasn't
+            tried or the data is invalid in it
+        """
+        if not self._should_try(encoding):
+            return None
+        self.full_decodes += 1
+        return self._full_pass(self.markup, encoding)
+
+    def try_ascii_or_utf8(self, full_pass):
+        """try UTF-8, also checking for ASCII
+
+        Data which is valid UTF-8 but is rejected for including NUL
+        characters remains a candidate for UTF-8, e.g. if detected.
+
+        @param full_pass: _decode_ascii_or_utf8() or _validate_ascii_or_utf8()
+        @return: the result of the full pass, or None
+        """
+        if not self._should_try('utf-8'):
+            return None
+        self.full_decodes += 1
+        result = full_pass(self.markup)
+        if result is False:
+            self._codec_names.discard(_codec_name('utf-8'))
+            self.considered.pop()
+            return None
+        return result
+
+
+def _validate_ascii_or_utf8(markup):
+    """like _decode_ascii_or_utf8(), without decoding the data at once
+
+    Returns a (True, encoding) tuple, where the encoding is 'ascii' or
+    'utf-8', None if the data isn't valid UTF-8, or False if it is but
+    includes NUL characters.
+    """
+    text_length = 0
+    has_nul = False
+    try:
+        for text in _iter_decoded_chunks(markup, 'utf-8'):
+            has_nul = has_nul or u'\x00' in text
+            text_length += len(text)
+    except UnicodeDecodeError:
+        return None
+    if has_nul:
+        return False
+    return True, 'ascii' if text_length == len(markup) else 'utf-8'
+
+
+def resolve_html_encoding(raw_html, http_headers=None,
+                          prescan_bytes=PRESCAN_BYTES, trusted_fast_path=True,
+                          utf8_fast_path=True,
+                          detection_sample_bytes=DETECTION_SAMPLE_BYTES,
+                          detector=None, hint_cache=None, url=None):
+    """Find the encoding of binary HTML data, without decoding it.
+
+    This is for passing the data on to parsers which do their own decoding,
+    such as lxml, avoiding having both the data and its decoded text in
+    memory at once. The returned DecodeResult has its text set to None.
+
+    The encoding is found exactly as with decode_html_result(), except that
+    rather than decoding the data with each encoding tried, its validity is
+    checked by decoding it in chunks, which are discarded.
+
+    See decode_html_result() for the parameters.
+
+    @return: a DecodeResult instance, with the text set to None
+    """
+    return _find_encoding(
+        InstrumentationEvent.RESOLVE, raw_html, http_headers, prescan_bytes,
+        trusted_fast_path, utf8_fast_path, detection_sample_bytes, detector,
+        hint_cache, url)
+
+
+def _decode_resolved(resolved, errors='strict'):
+    """decode the data of a DecodeResult whose text is None
+
+    @param resolved: e.g. a result of resolve_html_encoding()
+    @param errors: the error handling scheme (str; optional)
+    @return: a DecodeResult like the given one, with the text set
+    """
+    text = codecs.decode(resolved.markup, resolved.encoding, errors)
+    return DecodeResult(
+        text, resolved.encoding, resolved.markup, resolved.is_html,
+        resolved.path,
+        contains_replacement_characters=(
+            errors == 'replace' and u'\ufffd' in text),
+        source=resolved.source, candidates=resolved.candidates,
+        timings=resolved.timings, full_decodes=resolved.full_decodes + 1,
+    )
+
+
+def decode_html(raw_html, http_headers=None, **kwargs):
     """Decode binary HTML data into unicode.
 
     An encoding definition is looked for in the document itself and in the
@@ -56,39 +1004,210 @@ def decode_html(raw_html, http_headers=None):
     Content-Type header. If no encoding declaration is found, the best encoding
     is guessed according to the data.
 
-    Important note: *If installed*, the 'cchartdet' or 'chardet' libraries
-    will be used to detect the encoding if no declaration is found. Therefore,
-    for best results, it is highly recommended to have at least on of these
-    installed.
+    Important note: *If installed*, the 'cchardet', 'charset_normalizer' or
+    'chardet' libraries will be used to detect the encoding if no declaration
+    is found. Therefore, for best results, it is highly recommended to have at
+    least one of these installed. See htmldammit.detectors for choosing which
+    one is used.
 
     Notes:
     * XHTML is supported
+    * Besides bytes, raw_html may be any object supporting the buffer
+      protocol, e.g. a bytearray, memoryview or mmap.mmap; it is decoded
+      without being copied.
+    * Already decoded HTML (unicode) is returned as-is.
 
     @param raw_html: the binary (i.e. encoded) HTML data (str)
     @param http_headers: the HTTP response headers (dict; optional)
+    @param kwargs: further options, passed on to decode_html_result()
     @return: the given HTML data, decoded (unicode)
     """
-    unicode_dammit = make_UnicodeDammit(raw_html, http_headers=http_headers)
-    return unicode_dammit.unicode_markup
+    return decode_html_result(raw_html, http_headers, **kwargs).text
+
 
+def _default_soup_features():
+    return 'lxml' if lxml is not None else 'html.parser'
 
-def make_soup(raw_html, http_headers=None):
-    html = decode_html(raw_html, http_headers=http_headers)
 
-    return bs4.BeautifulSoup(html)
+def make_soup(raw_html, http_headers=None, features=None, **kwargs):
+    """get a parsed BeautifulSoup object
+
+    The encoding is found with resolve_html_encoding() and given to
+    BeautifulSoup along with the binary data, so that BeautifulSoup neither
+    detects the encoding again nor needs a decoded copy of the document.
+
+    @param raw_html: the binary (i.e. encoded) HTML data (str)
+    @param http_headers: the HTTP response headers (dict; optional)
+    @param features: the BeautifulSoup parser to use, e.g. 'lxml',
+        'html5lib' or 'html.parser'; defaults to 'lxml' if it is installed,
+        otherwise 'html.parser' (str; optional)
+    @param kwargs: further options, passed on to resolve_html_encoding()
+    @return: a bs4.BeautifulSoup instance
+    """
+    resolved = resolve_html_encoding(raw_html, http_headers, **kwargs)
+    markup = resolved.markup
+    if isinstance(markup, memoryview):
+        markup = markup.tobytes()
+
+    return bs4.BeautifulSoup(
+        markup,
+        features=features if features is not None else _default_soup_features(),
+        from_encoding=resolved.encoding,
+    )
+
 
+# The maximal number of lxml parsers kept for reuse by each thread; set to
+# zero to disable reuse.
+LXML_PARSER_POOL_SIZE = 16
 
-def make_lxml_html(raw_html, http_headers=None, base_url=None):
-    """get a parsed HTML object, created using lxml.html.fromstring()"""
+_lxml_parser_pools = threading.local()
+
+
+def _get_lxml_parser(encoding, parser_options):
+    """get an lxml HTML parser, reusing one made earlier by this thread
+
+    Parsers are expensive to create, and may be reused once done parsing,
+    but not concurrently. Therefore each thread has its own pool of parsers,
+    keyed by encoding and options, evicting the least recently used.
+    """
+    key = (encoding, tuple(sorted(parser_options.items())))
+    try:
+        hash(key)
+    except TypeError:
+        # options such as a parser target can't be keyed by; don't pool
+        key = None
+    if key is None or LXML_PARSER_POOL_SIZE <= 0:
+        return lxml.etree.HTMLParser(encoding=encoding, **parser_options)
+
+    pool = getattr(_lxml_parser_pools, 'pool', None)
+    if pool is None:
+        pool = _lxml_parser_pools.pool = collections.OrderedDict()
+    parser = pool.pop(key, None)
+    if parser is None:
+        parser = lxml.etree.HTMLParser(encoding=encoding, **parser_options)
+        while len(pool) >= LXML_PARSER_POOL_SIZE:
+            pool.popitem(last=False)
+    pool[key] = parser
+    return parser
+
+
+def _discard_lxml_parser(parser):
+    "remove a parser from this thread's pool, e.g. after a failed parse"
+    pool = getattr(_lxml_parser_pools, 'pool', None) or {}
+    for key, pooled_parser in list(pool.items()):
+        if pooled_parser is parser:
+            del pool[key]
+
+
+def make_lxml_html(raw_html, http_headers=None, base_url=None,
+                   parser_options=None, **kwargs):
+    """get a parsed HTML object, created using lxml.html.fromstring()
+
+    The encoding is found with resolve_html_encoding(), and the data is then
+    decoded by lxml while parsing, so that it is decoded only once.
+
+    raw_html may also be a bytearray, memoryview or mmap.mmap, which is given
+    to lxml in chunks rather than copied. The same element is returned as for
+    bytes, e.g. the <p> element for b'<p>hello</p>'.
+
+    lxml parsers are reused across calls in the same thread; see
+    LXML_PARSER_POOL_SIZE.
+
+    @param parser_options: further options for lxml.etree.HTMLParser, e.g.
+        remove_blank_text, huge_tree or recover (dict; optional)
+    @param kwargs: further options, passed on to resolve_html_encoding()
+    """
+    decode_result = resolve_html_encoding(raw_html, http_headers, **kwargs)
+    # don't just use the original raw_html because a BOM may have been stripped
+    return _parse_lxml_html(decode_result.markup, decode_result.encoding,
+                            base_url, parser_options)
+
+
+def _parse_lxml_html(raw_html, encoding, base_url, parser_options):
+    "parse binary HTML data with lxml, given its encoding"
     if lxml is None:
         raise Exception(
             "lxml is not available; install lxml to use this feature")
 
-    unicode_dammit = make_UnicodeDammit(raw_html, http_headers=http_headers)
-    encoding = unicode_dammit.original_encoding
+    callback = _instrumentation
+    if callback is not None:
+        start = _now_ns()
 
-    # don't just use the original raw_html because UnicodeDammit may strip a BOM
-    raw_html = unicode_dammit.detector.markup
+    try:
+        parser = _get_lxml_parser(encoding, parser_options or {})
+    except LookupError:
+        # libxml2 doesn't support all of Python's codecs, e.g. mac_latin2
+        raw_html = b''.join(text.encode('utf-8') for text in
+                            _iter_decoded_chunks(raw_html, encoding))
+        parser = _get_lxml_parser('utf-8', parser_options or {})
+    try:
+        if isinstance(raw_html, (bytes, six.text_type)):
+            root = lxml.html.fromstring(raw_html, base_url=base_url,
+                                        parser=parser)
+        else:
+            root = _feed_lxml_parser(parser, raw_html, base_url)
+    except Exception:
+        _discard_lxml_parser(parser)
+        raise
 
-    parser = lxml.etree.HTMLParser(encoding=encoding)
-    return lxml.html.fromstring(raw_html, base_url=base_url, parser=parser)
+    if callback is not None:
+        callback(InstrumentationEvent(InstrumentationEvent.PARSE,
+                                      'lxml_parse', _now_ns() - start,
+                                      len(raw_html)))
+    return root
+
+
+# The size of the chunks in which memoryview data is fed to lxml.
+_LXML_FEED_BYTES = 64 * 1024
+
+
+# lxml.html.fromstring() returns the root element for data starting with
+# these, and otherwise the element(s) of the fragment given
+_FULL_HTML_RE = re.compile(br'\s*<(?:html|!doctype)', re.IGNORECASE)
+
+
+def _feed_lxml_parser(parser, markup, base_url=None):
+    """parse a memoryview with an lxml parser, copying only small chunks
+
+    lxml only accepts bytes, so this avoids copying all of the data at once.
+    The element returned is the one lxml.html.fromstring() would return.
+    """
+    is_full_html = _FULL_HTML_RE.match(
+        markup[:_LXML_FEED_BYTES].tobytes()) is not None
+    for start in range(0, len(markup), _LXML_FEED_BYTES):
+        parser.feed(markup[start:start + _LXML_FEED_BYTES].tobytes())
+    root = parser.close()
+    if base_url is not None:
+        root.getroottree().docinfo.URL = base_url
+    return root if is_full_html else _get_fragment_element(root)
+
+
+def _find_html_child(element, tag):
+    child = element.find(tag)
+    if child is None:
+        child = element.find('{http://www.w3.org/1999/xhtml}' + tag)
+    return child
+
+
+def _get_fragment_element(root):
+    """get the element which lxml.html.fromstring() returns for a fragment
+
+    libxml2 creates at most one <head> and <body>, so unlike
+    lxml.html.fromstring(), this doesn't merge several of them.
+    """
+    body = _find_html_child(root, 'body')
+    if body is None or _find_html_child(root, 'head') is not None:
+        return root
+    if (
+        len(body) == 1 and not (body.text or '').strip() and
+        not (body[0].tail or '').strip()
+    ):
+        return body[0]
+    # several elements, or text, are wrapped in a <div> or <span>
+    if any(lxml.etree.QName(element).localname in lxml.html.defs.block_tags
+           for element in body.iter(lxml.etree.Element)
+           if element is not body):
+        body.tag = 'div'
+    else:
+        body.tag = 'span'
+    return body
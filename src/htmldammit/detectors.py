@@ -0,0 +1,148 @@
+"""Statistical encoding detection backends.
+
+The backend used for guessing the encoding of undeclared data may be chosen
+per call, e.g. decode_html(raw_html, detector='chardet'), or globally with
+set_default_detector(). The available backends are:
+
+* 'cchardet', 'charset_normalizer' and 'chardet', using the libraries with
+  those names, if installed
+* 'auto': the fastest of the above which is installed
+* 'none': no statistical detection at all, for latency-critical uses
+
+Additional backends may be added with register_detector().
+"""
+import importlib
+import threading
+
+__all__ = [
+    'Detector', 'available_detectors', 'get_default_detector', 'get_detector',
+    'register_detector', 'set_default_detector',
+]
+
+
+class Detector(object):
+    """A statistical encoding detection backend."""
+
+    def __init__(self, name, detect_func):
+        """
+        @param name: the name of the backend (str)
+        @param detect_func: a function getting binary data and returning the
+            name of the detected encoding, or None if it couldn't be detected
+        """
+        self.name = name
+        self._detect_func = detect_func
+
+    def detect(self, data):
+        "guess the encoding of the given data; return None if unknown"
+        if not data:
+            return None
+        return self._detect_func(data)
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(type(self).__name__, self.name)
+
+
+NO_DETECTOR = Detector('none', lambda data: None)
+
+# libraries supporting the chardet API, from fastest to slowest
+_LIBRARY_BACKENDS = ['cchardet', 'charset_normalizer', 'chardet']
+
+_detectors = {'none': NO_DETECTOR}
+_missing_libraries = set()
+_default_detector = 'auto'
+_lock = threading.Lock()
+
+
+def _make_library_detector(module_name):
+    module = importlib.import_module(module_name)
+    return Detector(module_name, lambda data: module.detect(data)['encoding'])
+
+
+def _load_detector(name):
+    with _lock:
+        detector = _detectors.get(name)
+        if detector is None and name in _LIBRARY_BACKENDS:
+            if name in _missing_libraries:
+                return None
+            try:
+                detector = _make_library_detector(name)
+            except ImportError:
+                _missing_libraries.add(name)
+                return None
+            _detectors[name] = detector
+        return detector
+
+
+def register_detector(name, detect_func):
+    """add a detection backend, or replace an existing one
+
+    @param name: the name by which the backend will be selected (str)
+    @param detect_func: a function getting binary data and returning the
+        name of the detected encoding, or None if it couldn't be detected
+    @return: the new Detector instance
+    """
+    if name == 'auto':
+        raise ValueError('"auto" is reserved and cannot be registered')
+    detector = Detector(name, detect_func)
+    with _lock:
+        _detectors[name] = detector
+    return detector
+
+
+def available_detectors():
+    "list the names of the usable backends, in order of preference for 'auto'"
+    names = [name for name in _LIBRARY_BACKENDS
+             if _load_detector(name) is not None]
+    names += sorted(
+        name for name in _detectors
+        if name not in _LIBRARY_BACKENDS and name != 'none'
+    )
+    return names + ['none']
+
+
+def get_detector(detector=None):
+    """get a detection backend
+
+    @param detector: a backend name, a Detector instance, or None for the
+        default backend (see set_default_detector())
+    @return: a Detector instance
+    """
+    if isinstance(detector, Detector):
+        return detector
+    if detector is None:
+        detector = _default_detector
+
+    if detector == 'auto':
+        for name in _LIBRARY_BACKENDS:
+            found = _load_detector(name)
+            if found is not None:
+                return found
+        return NO_DETECTOR
+
+    found = _load_detector(detector)
+    if found is None:
+        if detector in _LIBRARY_BACKENDS:
+            raise ImportError(
+                "{} is not available; install it to use this detector".format(
+                    detector))
+        raise ValueError("unknown encoding detector: {!r}".format(detector))
+    return found
+
+
+def set_default_detector(detector):
+    """set the backend used when none is chosen explicitly
+
+    @param detector: a backend name or a Detector instance; 'auto' or None
+        restore the initial default
+    """
+    global _default_detector
+    if detector is None:
+        detector = 'auto'
+    # fail early for unknown or unavailable backends
+    get_detector(detector)
+    _default_detector = detector
+
+
+def get_default_detector():
+    "get the backend used when none is chosen explicitly, as a Detector"
+    return get_detector(None)
@@ -0,0 +1,345 @@
+"""Decoding HTML from files and from web archive (WARC and ARC) files.
+
+Uncompressed files are memory-mapped, so that their data is decoded without
+being copied (see decode_html()). Compressed files, including gzip files
+with a member per record as is common for web archives, and file objects
+which can't be memory-mapped, are read as streams.
+
+    html = decode_html_file('page.html')
+
+    for record in iter_archive_html('crawl.warc.gz'):
+        print(record.url, record.result.encoding)
+"""
+import contextlib
+import email.message
+import gzip
+import mmap
+import os
+import zlib
+
+import six
+
+from htmldammit.contenttypes import get_content_type, parse_content_type
+from htmldammit.core import decode_html_result
+
+__all__ = ['ArchiveRecord', 'decode_html_file', 'iter_archive_html']
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+def _is_path(path_or_fileobj):
+    return isinstance(path_or_fileobj, (six.text_type, bytes)) or \
+        hasattr(path_or_fileobj, '__fspath__')
+
+
+def _mmap_file(fileobj):
+    "memory-map a file object's file; return None if that isn't possible"
+    try:
+        fileno = fileobj.fileno()
+        if os.fstat(fileno).st_size == 0:
+            return None
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError,
+            NotImplementedError):
+        return None
+
+
+def _close_mmap(mapped):
+    try:
+        mapped.close()
+    except BufferError:
+        # views of the data are still in use; it will be unmapped once they
+        # are garbage-collected
+        pass
+
+
+def _decode_fileobj(fileobj, http_headers, kwargs):
+    mapped = _mmap_file(fileobj)
+    if mapped is None:
+        return decode_html_result(fileobj.read(), http_headers, **kwargs).text
+    try:
+        return decode_html_result(mapped, http_headers, **kwargs).text
+    finally:
+        _close_mmap(mapped)
+
+
+def decode_html_file(path_or_fileobj, http_headers=None, **kwargs):
+    """Decode a file containing binary HTML data into unicode.
+
+    @param path_or_fileobj: a file path, or a binary file object
+    @param http_headers: the HTTP response headers (dict; optional)
+    @param kwargs: further options, passed on to decode_html_result()
+    @return: the decoded HTML (unicode)
+    """
+    if _is_path(path_or_fileobj):
+        with open(path_or_fileobj, 'rb') as fileobj:
+            return _decode_fileobj(fileobj, http_headers, kwargs)
+    return _decode_fileobj(path_or_fileobj, http_headers, kwargs)
+
+
+class ArchiveRecord(object):
+    """A decoded HTTP response record from a web archive file."""
+
+    def __init__(self, url, http_status, http_headers, result):
+        self.url = url
+        self.http_status = http_status
+        # an email.message.Message
+        self.http_headers = http_headers
+        # a DecodeResult
+        self.result = result
+
+    def __repr__(self):
+        return '<{} url={!r} result={!r}>'.format(
+            type(self).__name__, self.url, self.result)
+
+
+class _MmapReader(object):
+    "reads lines and blocks from memory-mapped data, without copying blocks"
+
+    def __init__(self, mapped):
+        self._mapped = mapped
+        # Python 2's memoryview doesn't support mmap objects, so there
+        # blocks are sliced from the mmap object, copying them
+        self._view = mapped if six.PY2 else memoryview(mapped)
+        self._pos = 0
+
+    def readline(self):
+        end = self._mapped.find(b'\n', self._pos)
+        end = len(self._mapped) if end == -1 else end + 1
+        line = self._mapped[self._pos:end]
+        self._pos = end
+        return line
+
+    def read_block(self, size):
+        block = self._view[self._pos:self._pos + size]
+        self._pos += len(block)
+        return block
+
+    def close(self):
+        if self._view is not self._mapped:
+            try:
+                self._view.release()
+            except BufferError:
+                pass
+        _close_mmap(self._mapped)
+
+
+class _StreamReader(object):
+    "reads lines and blocks from a (possibly decompressing) file object"
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def readline(self):
+        return self._fileobj.readline()
+
+    def read_block(self, size):
+        return self._fileobj.read(size)
+
+    def close(self):
+        pass
+
+
+class _PushbackReader(object):
+    "a reader with a line pushed back in front of it"
+
+    def __init__(self, reader, line):
+        self._reader = reader
+        self._line = line
+
+    def readline(self):
+        if self._line is not None:
+            line, self._line = self._line, None
+            return line
+        return self._reader.readline()
+
+    def read_block(self, size):
+        return self._reader.read_block(size)
+
+
+def _parse_headers(lines):
+    "parse header lines into a (case-insensitive) email.message.Message"
+    headers = email.message.Message()
+    for line in lines:
+        name, sep, value = line.partition(b':')
+        if sep:
+            headers[name.strip().decode('latin-1')] = \
+                value.strip().decode('latin-1')
+    return headers
+
+
+def _read_header_lines(reader):
+    "read lines up to the next empty line; return None at the end of data"
+    lines = []
+    while True:
+        line = reader.readline()
+        if not line:
+            return lines or None
+        line = line.rstrip(b'\r\n')
+        if not line:
+            if lines:
+                return lines
+            # skip empty lines between records
+            continue
+        lines.append(line)
+
+
+def _split_http_response(block):
+    "split an HTTP response into its status, headers and body"
+    end = -1
+    for separator in (b'\r\n\r\n', b'\n\n'):
+        end = bytes(block[:64 * 1024]).find(separator)
+        if end != -1:
+            break
+    if end == -1:
+        return None
+    head = bytes(block[:end]).split(b'\n')
+    body = block[end + len(separator):]
+    status_line = head[0].rstrip(b'\r').split(None, 2)
+    try:
+        status = int(status_line[1])
+    except (IndexError, ValueError):
+        status = None
+    return status, _parse_headers(line.rstrip(b'\r') for line in head[1:]), body
+
+
+def _dechunk(body):
+    body = bytes(body)
+    chunks = []
+    pos = 0
+    while pos < len(body):
+        line_end = body.find(b'\n', pos)
+        if line_end == -1:
+            break
+        try:
+            size = int(body[pos:line_end].split(b';')[0].strip(), 16)
+        except ValueError:
+            break
+        if size == 0:
+            break
+        chunks.append(body[line_end + 1:line_end + 1 + size])
+        pos = line_end + 1 + size + 2
+    return b''.join(chunks)
+
+
+def _decode_body(http_headers, body):
+    "undo the transfer and content encodings of an archived HTTP body"
+    if 'chunked' in http_headers.get('Transfer-Encoding', '').lower():
+        body = _dechunk(body)
+    content_encoding = http_headers.get('Content-Encoding', '').lower()
+    try:
+        if content_encoding in ('gzip', 'x-gzip'):
+            body = zlib.decompress(bytes(body), 16 + zlib.MAX_WBITS)
+        elif content_encoding == 'deflate':
+            body = zlib.decompress(bytes(body))
+    except zlib.error:
+        pass
+    return body
+
+
+def _iter_warc_responses(reader):
+    while True:
+        header_lines = _read_header_lines(reader)
+        if header_lines is None:
+            return
+        warc_headers = _parse_headers(header_lines[1:])
+        try:
+            length = int(warc_headers.get('Content-Length', '0'))
+        except ValueError:
+            return
+        block = reader.read_block(length)
+        if (
+            warc_headers.get('WARC-Type') == 'response' and
+            warc_headers.get('Content-Type', '').startswith('application/http')
+        ):
+            yield warc_headers.get('WARC-Target-URI'), block
+
+
+def _iter_arc_responses(reader):
+    while True:
+        line = reader.readline()
+        if not line:
+            return
+        line = line.strip()
+        if not line:
+            # skip empty lines between records
+            continue
+        # URL IP-address Archive-date Content-type Archive-length
+        fields = line.split()
+        try:
+            length = int(fields[-1])
+        except ValueError:
+            return
+        block = reader.read_block(length)
+        url = fields[0].decode('latin-1')
+        if not url.startswith('filedesc:'):
+            yield url, block
+
+
+@contextlib.contextmanager
+def _open_archive(path_or_fileobj):
+    if _is_path(path_or_fileobj):
+        fileobj = open(path_or_fileobj, 'rb')
+        close_file = True
+    else:
+        fileobj = path_or_fileobj
+        close_file = False
+    try:
+        magic = fileobj.read(2)
+        fileobj.seek(-len(magic), os.SEEK_CUR)
+        if magic == _GZIP_MAGIC:
+            # GzipFile reads all gzip members, e.g. one per record
+            reader = _StreamReader(gzip.GzipFile(fileobj=fileobj, mode='rb'))
+        else:
+            mapped = _mmap_file(fileobj)
+            reader = _StreamReader(fileobj) if mapped is None \
+                else _MmapReader(mapped)
+        try:
+            yield reader
+        finally:
+            reader.close()
+    finally:
+        if close_file:
+            fileobj.close()
+
+
+def iter_archive_html(path_or_fileobj, html_only=True, **kwargs):
+    """Decode the HTML responses in a WARC or ARC file, lazily.
+
+    Both formats are supported, optionally gzip-compressed, and are told
+    apart automatically. Each HTTP response's headers are parsed and used for
+    decoding its body, after undoing any chunked transfer encoding and gzip
+    or deflate content encoding.
+
+    @param path_or_fileobj: a file path, or a seekable binary file object
+    @param html_only: whether to skip responses whose Content-Type isn't
+        HTML or XHTML (bool; optional)
+    @param kwargs: further options, passed on to decode_html_result()
+    @return: an iterator of ArchiveRecord instances
+    """
+    with _open_archive(path_or_fileobj) as reader:
+        first_line = reader.readline()
+        reader = _PushbackReader(reader, first_line)
+        if first_line.startswith(b'WARC/'):
+            records = _iter_warc_responses(reader)
+        elif first_line.startswith(b'filedesc://'):
+            records = _iter_arc_responses(reader)
+        else:
+            raise ValueError('not a WARC or ARC file')
+
+        for (url, block) in records:
+            response = _split_http_response(block)
+            if response is None:
+                continue
+            status, http_headers, body = response
+            if html_only:
+                content_type = get_content_type(http_headers)
+                if not content_type:
+                    continue
+                content_type_header = parse_content_type(content_type)
+                if not (content_type_header.is_html or
+                        content_type_header.is_xml):
+                    continue
+            body = _decode_body(http_headers, body)
+            result = decode_html_result(body, http_headers, **kwargs)
+            yield ArchiveRecord(url, status, http_headers, result)
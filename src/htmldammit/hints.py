@@ -0,0 +1,423 @@
+"""Caching of encoding hints per site.
+
+Pages from the same site almost always share an encoding. An
+EncodingHintCache remembers the encoding each site's pages were decoded
+with, so that later pages from the same site can be decoded directly,
+skipping encoding detection:
+
+    hint_cache = EncodingHintCache()
+    html = decode_html(raw_html, http_headers, hint_cache=hint_cache, url=url)
+
+A cached hint is only used for data it decodes without errors, and never
+overrides a BOM or an encoding declared by the page itself or by its HTTP
+headers.
+
+Hints are kept in a HintStore. By default this is a MemoryHintStore, private
+to the process. A SQLiteHintStore is shared by all processes using the same
+database file, e.g. prefork workers, and persists across restarts:
+
+    hint_cache = EncodingHintCache(store=SQLiteHintStore('hints.sqlite'))
+
+Any cache's hints may also be saved to a snapshot file with save_snapshot(),
+and loaded into another cache with load_snapshot() to warm it up.
+"""
+import collections
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import six
+from six.moves.urllib.parse import urlsplit
+
+__all__ = [
+    'EncodingHintCache', 'HintCacheStats', 'HintStore', 'MemoryHintStore',
+    'SQLiteHintStore', 'host_key', 'url_prefix_key',
+]
+
+
+def host_key(url):
+    "get the cache key of a URL: its lower-cased host name"
+    return urlsplit(url).hostname or None
+
+
+def url_prefix_key(path_segments=1):
+    """make a cache key function using the host and leading path segments
+
+    This is useful for hosts serving several sites with different encodings,
+    e.g. url_prefix_key(1) separates http://example.com/site1/page.html from
+    http://example.com/site2/page.html.
+    """
+    def key_func(url):
+        parts = urlsplit(url)
+        if not parts.hostname:
+            return None
+        segments = [segment for segment in parts.path.split('/') if segment]
+        # the last segment is a page rather than a directory
+        if not parts.path.endswith('/'):
+            segments = segments[:-1]
+        return '/'.join([parts.hostname] + segments[:path_segments])
+    return key_func
+
+
+class HintCacheStats(collections.namedtuple(
+        'HintCacheStats', ['hits', 'misses', 'overrides'])):
+    """Counters of the uses of an EncodingHintCache.
+
+    hits: a cached hint was used to decode a page
+    misses: there was no cached hint for a page
+    overrides: a cached hint was rejected, since the page failed to decode
+        with it or declared a different encoding
+    """
+    __slots__ = ()
+
+    @property
+    def lookups(self):
+        return self.hits + self.misses + self.overrides
+
+    @property
+    def hit_rate(self):
+        lookups = self.lookups
+        return float(self.hits) / lookups if lookups else 0.0
+
+
+class HintStore(object):
+    """The interface of storage backends for EncodingHintCache.
+
+    A store maps keys to (encoding, stored_at) tuples, where stored_at is the
+    time the hint was last stored or confirmed, in seconds since the epoch.
+    Stores needn't be thread-safe: EncodingHintCache serializes access to
+    its store.
+    """
+
+    def get(self, key):
+        "get the (encoding, stored_at) tuple for a key, or None"
+        raise NotImplementedError
+
+    def set(self, key, encoding, stored_at):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def items(self):
+        "get all of the stored (key, encoding, stored_at) tuples"
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryHintStore(HintStore):
+    """An in-process hint store, evicting the least recently used hints."""
+
+    def __init__(self, max_size=10000):
+        """
+        @param max_size: the maximal number of hints to keep (int; optional)
+        """
+        if max_size < 1:
+            raise ValueError('max_size must be positive')
+        self.max_size = max_size
+        # from least to most recently used
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._entries[key] = entry
+        return entry
+
+    def set(self, key, encoding, stored_at):
+        self._entries.pop(key, None)
+        self._entries[key] = (encoding, stored_at)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def items(self):
+        return [
+            (key, encoding, stored_at)
+            for key, (encoding, stored_at) in self._entries.items()
+        ]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteHintStore(HintStore):
+    """A hint store in an SQLite database file, shareable between processes.
+
+    Each thread and each forked process opens its own connection to the
+    database, so a store may be created before forking worker processes.
+    When over max_size, the least recently stored or confirmed hints are
+    evicted.
+    """
+
+    # evict excess hints once per this many writes, rather than on each one
+    _EVICTION_INTERVAL = 100
+
+    def __init__(self, path, max_size=None, timeout=5.0):
+        """
+        @param path: the path of the database file, created if necessary
+        @param max_size: the maximal number of hints to keep, or None for no
+            limit (int; optional)
+        @param timeout: the number of seconds to wait for another process's
+            write to finish (float; optional)
+        """
+        if max_size is not None and max_size < 1:
+            raise ValueError('max_size must be positive')
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout,
+                                         isolation_level=None)
+            # allow reading concurrently with another process's writes
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS encoding_hints ('
+                ' key TEXT PRIMARY KEY,'
+                ' encoding TEXT NOT NULL,'
+                ' stored_at REAL NOT NULL)'
+            )
+            local.connection = connection
+            local.pid = os.getpid()
+            local.writes = 0
+        return local.connection
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT encoding, stored_at FROM encoding_hints WHERE key = ?',
+            (key,),
+        ).fetchone()
+        return tuple(row) if row is not None else None
+
+    def set(self, key, encoding, stored_at):
+        connection = self._connect()
+        connection.execute(
+            'INSERT OR REPLACE INTO encoding_hints (key, encoding, stored_at)'
+            ' VALUES (?, ?, ?)',
+            (key, encoding, stored_at),
+        )
+        if self.max_size is not None:
+            self._local.writes += 1
+            if self._local.writes % self._EVICTION_INTERVAL == 1:
+                connection.execute(
+                    'DELETE FROM encoding_hints WHERE key IN ('
+                    ' SELECT key FROM encoding_hints'
+                    ' ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+                    (self.max_size,),
+                )
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM encoding_hints WHERE key = ?',
+                                (key,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM encoding_hints')
+
+    def items(self):
+        return [
+            tuple(row) for row in self._connect().execute(
+                'SELECT key, encoding, stored_at FROM encoding_hints'
+                ' ORDER BY stored_at')
+        ]
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM encoding_hints').fetchone()[0]
+
+    def close(self):
+        "close this thread's connection to the database"
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.__dict__.clear()
+
+
+_SNAPSHOT_FORMAT_VERSION = 1
+
+
+class EncodingHintCache(object):
+    """A thread-safe cache of encodings per site, with LRU and TTL eviction."""
+
+    def __init__(self, max_size=10000, ttl=None, key_func=host_key,
+                 clock=time.time, store=None):
+        """
+        @param max_size: the maximal number of sites to remember in the
+            default in-memory store; the least recently used are evicted
+            first (int; optional)
+        @param ttl: the number of seconds after which a hint expires unless
+            confirmed again, or None for no expiration (float; optional)
+        @param key_func: a function getting a URL and returning the key to
+            cache its encoding under, or None to not cache it; see host_key()
+            and url_prefix_key() (optional)
+        @param clock: a function returning the current time in seconds
+            since the epoch (optional)
+        @param store: where to keep the hints; defaults to a new
+            MemoryHintStore (HintStore; optional)
+        """
+        self.ttl = ttl
+        self.key_func = key_func
+        self._clock = clock
+        self._store = store if store is not None else MemoryHintStore(max_size)
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._overrides = 0
+
+    @property
+    def store(self):
+        return self._store
+
+    def __len__(self):
+        with self._lock:
+            return len(self._store)
+
+    def _is_expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def _get(self, key):
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        encoding, stored_at = entry
+        if self._is_expired(stored_at, self._clock()):
+            return None
+        return encoding
+
+    def get(self, url):
+        "get the cached encoding for a URL, or None; not counted in stats"
+        key = self.key_func(url)
+        if key is None:
+            return None
+        with self._lock:
+            return self._get(key)
+
+    def set(self, url, encoding):
+        "cache the encoding for a URL's site"
+        key = self.key_func(url)
+        if key is None:
+            return
+        with self._lock:
+            self._store.set(key, encoding, self._clock())
+
+    def invalidate(self, url):
+        "forget the cached encoding for a URL's site"
+        key = self.key_func(url)
+        if key is None:
+            return
+        with self._lock:
+            self._store.delete(key)
+
+    def clear(self):
+        "forget all cached encodings and reset the stats"
+        with self._lock:
+            self._store.clear()
+            self._hits = self._misses = self._overrides = 0
+
+    def stats(self):
+        """get the counts of hits, misses and overrides (HintCacheStats)
+
+        These count this cache object's uses only, even if its store is
+        shared with other processes.
+        """
+        with self._lock:
+            return HintCacheStats(self._hits, self._misses, self._overrides)
+
+    def lookup(self, url):
+        """get the cached encoding for a URL, counting a miss if there's none
+
+        Call confirm() or reject() with the outcome of using the hint.
+        """
+        key = self.key_func(url)
+        with self._lock:
+            encoding = self._get(key) if key is not None else None
+            if encoding is None:
+                self._misses += 1
+            return encoding
+
+    def confirm(self, url, encoding):
+        "record that a hint was used successfully, refreshing its TTL"
+        key = self.key_func(url)
+        with self._lock:
+            self._hits += 1
+            if key is None:
+                return
+            # avoid writing to the store on every hit, since writes to
+            # shared stores are expensive
+            now = self._clock()
+            entry = self._store.get(key)
+            if (
+                entry is None or entry[0] != encoding or
+                (self.ttl is not None and now - entry[1] > self.ttl / 2.0)
+            ):
+                self._store.set(key, encoding, now)
+
+    def reject(self, url):
+        "record that a hint was overridden, forgetting it"
+        key = self.key_func(url)
+        with self._lock:
+            self._overrides += 1
+            if key is not None:
+                self._store.delete(key)
+
+    def save_snapshot(self, path):
+        """save the unexpired hints to a snapshot file, replacing it atomically
+
+        @param path: the path of the snapshot file
+        """
+        with self._lock:
+            now = self._clock()
+            hints = [
+                [key, encoding, stored_at]
+                for key, encoding, stored_at in self._store.items()
+                if not self._is_expired(stored_at, now)
+            ]
+        snapshot = {'version': _SNAPSHOT_FORMAT_VERSION, 'hints': hints}
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with io.open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(six.text_type(json.dumps(snapshot)))
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+
+    def load_snapshot(self, path):
+        """add the hints from a snapshot file to this cache
+
+        Expired hints are skipped, as are hints older than those already in
+        the cache for the same keys.
+
+        @param path: the path of a snapshot file made by save_snapshot()
+        @return: the number of hints loaded (int)
+        """
+        with io.open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.loads(f.read())
+        if snapshot.get('version') != _SNAPSHOT_FORMAT_VERSION:
+            raise ValueError('unsupported encoding hint snapshot version: '
+                             '{!r}'.format(snapshot.get('version')))
+
+        loaded = 0
+        with self._lock:
+            now = self._clock()
+            for key, encoding, stored_at in snapshot['hints']:
+                if self._is_expired(stored_at, now):
+                    continue
+                entry = self._store.get(key)
+                if entry is not None and entry[1] >= stored_at:
+                    continue
+                self._store.set(key, encoding, stored_at)
+                loaded += 1
+        return loaded
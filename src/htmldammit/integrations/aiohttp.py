@@ -0,0 +1,32 @@
+"""Helpers for aiohttp client responses.
+
+    async with session.get(url) as response:
+        html = await get_response_html(response)
+
+This module requires Python 3.5 or later.
+"""
+from htmldammit.integrations.asyncio import decode_html_result_async
+
+__all__ = ['get_response_html', 'get_response_html_result']
+
+
+async def get_response_html_result(response, decoder=None, **kwargs):
+    """read an aiohttp response's body and decode it, returning a DecodeResult
+
+    @param response: an aiohttp.ClientResponse
+    @param decoder: the AsyncHtmlDecoder to use, e.g. to bound concurrency;
+        by default, the event loop's default executor is used
+    @param kwargs: options passed on to decode_html_result()
+    """
+    raw_html = await response.read()
+    if decoder is None:
+        return await decode_html_result_async(raw_html, response.headers,
+                                              **kwargs)
+    return await decoder.decode_html_result(raw_html, response.headers,
+                                            **kwargs)
+
+
+async def get_response_html(response, decoder=None, **kwargs):
+    "read an aiohttp response's body and decode it into unicode"
+    result = await get_response_html_result(response, decoder, **kwargs)
+    return result.text
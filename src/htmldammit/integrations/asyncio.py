@@ -0,0 +1,110 @@
+"""Decoding HTML from asyncio code without blocking the event loop.
+
+Encoding detection and decoding may take tens of milliseconds for large
+pages, so they are run in an executor. By default, the event loop's default
+executor (a thread pool) is used; pass a ProcessPoolExecutor to decode in
+parallel on several cores. Results from worker processes have their markup
+attribute set to None, to avoid sending the data back.
+
+    html = await decode_html_async(raw_html, http_headers)
+
+To bound the number of documents being decoded at once, use an
+AsyncHtmlDecoder with max_concurrency. Callers beyond the limit wait their
+turn, applying backpressure to whatever is producing the pages.
+
+This module requires Python 3.5 or later.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import weakref
+
+from htmldammit.contenttypes import get_content_type
+from htmldammit.core import decode_html_result
+
+__all__ = ['AsyncHtmlDecoder', 'decode_html_async', 'decode_html_result_async']
+
+
+# get_event_loop() is deprecated for this since Python 3.10
+_get_running_loop = getattr(asyncio, 'get_running_loop',
+                            asyncio.get_event_loop)
+
+
+def _decode_in_process(raw_html, http_headers, options):
+    result = decode_html_result(raw_html, http_headers, **options)
+    result.markup = None
+    return result
+
+
+class AsyncHtmlDecoder(object):
+    """Decodes HTML in an executor, with optionally bounded concurrency."""
+
+    def __init__(self, executor=None, max_concurrency=None, **kwargs):
+        """
+        @param executor: the concurrent.futures.Executor to decode in, or None
+            for the event loop's default executor
+        @param max_concurrency: the maximal number of documents being decoded
+            at once by each event loop, or None for no limit (int; optional)
+        @param kwargs: options passed on to decode_html_result()
+        """
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError('max_concurrency must be positive')
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.options = kwargs
+        # event loop -> semaphore; each is created lazily, so that it is
+        # bound to the loop it's used with, and the decoder may be used with
+        # several loops, with the limit applying to each loop separately
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def decode_html_result(self, raw_html, http_headers=None, **kwargs):
+        """Decode binary HTML data into unicode, returning a DecodeResult.
+
+        See htmldammit.core.decode_html_result(). Keyword arguments override
+        the options given to the constructor.
+        """
+        options = dict(self.options, **kwargs)
+        # only the Content-Type header is used, and passing just it avoids
+        # pickling arbitrary header objects for worker processes
+        content_type = get_content_type(http_headers)
+        http_headers = {'Content-Type': content_type} if content_type else None
+        if isinstance(self.executor, concurrent.futures.ProcessPoolExecutor):
+            func = functools.partial(_decode_in_process, raw_html,
+                                     http_headers, options)
+        else:
+            func = functools.partial(decode_html_result, raw_html,
+                                     http_headers, **options)
+        loop = _get_running_loop()
+        if self.max_concurrency is None:
+            return await loop.run_in_executor(self.executor, func)
+
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = \
+                asyncio.Semaphore(self.max_concurrency)
+        async with semaphore:
+            return await loop.run_in_executor(self.executor, func)
+
+    async def decode_html(self, raw_html, http_headers=None, **kwargs):
+        """Decode binary HTML data into unicode.
+
+        See htmldammit.core.decode_html().
+        """
+        result = await self.decode_html_result(raw_html, http_headers,
+                                               **kwargs)
+        return result.text
+
+
+_default_decoder = AsyncHtmlDecoder()
+
+
+async def decode_html_result_async(raw_html, http_headers=None, **kwargs):
+    "like decode_html_result(), but decoding in the default executor"
+    return await _default_decoder.decode_html_result(raw_html, http_headers,
+                                                     **kwargs)
+
+
+async def decode_html_async(raw_html, http_headers=None, **kwargs):
+    "like decode_html(), but decoding in the default executor"
+    return await _default_decoder.decode_html(raw_html, http_headers,
+                                              **kwargs)
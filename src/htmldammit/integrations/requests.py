@@ -1,18 +1,74 @@
-from htmldammit.core import decode_html, make_UnicodeDammit
+from htmldammit.core import decode_html, decode_html_result
+from htmldammit.streaming import iter_decode_html, iter_lxml_html_events, \
+    parse_lxml_html_chunks
 
 
-def get_response_html(response):
-    return decode_html(response.content, http_headers=response.headers)
+def get_response_html(response, hint_cache=None):
+    """decode a response's body
+
+    @param hint_cache: a cache of encodings per site, used and updated
+        according to response.url (EncodingHintCache; optional)
+    """
+    return decode_html(response.content, http_headers=response.headers,
+                       hint_cache=hint_cache, url=response.url)
+
+
+def iter_response_html(response, chunk_size=64 * 1024, **kwargs):
+    """decode a response's body incrementally, yielding chunks of text
+
+    Use with stream=True to avoid reading the entire body into memory.
+    Further keyword arguments are passed on to IncrementalHtmlDecoder.
+    """
+    return iter_decode_html(response.iter_content(chunk_size),
+                            response.headers, **kwargs)
+
+
+def parse_response_lxml_html(response, chunk_size=64 * 1024, **kwargs):
+    """parse a response's body with lxml while it is being downloaded
+
+    Use with stream=True to avoid reading the entire body into memory.
+    Further keyword arguments are passed on to parse_lxml_html_chunks().
+    """
+    kwargs.setdefault('base_url', response.url)
+    return parse_lxml_html_chunks(response.iter_content(chunk_size),
+                                  response.headers, **kwargs)
+
+
+def iter_response_lxml_events(response, chunk_size=64 * 1024, **kwargs):
+    """parse a response's body with lxml, yielding events as they're parsed
+
+    Use with stream=True to avoid reading the entire body into memory.
+    Further keyword arguments are passed on to iter_lxml_html_events().
+    """
+    kwargs.setdefault('base_url', response.url)
+    return iter_lxml_html_events(response.iter_content(chunk_size),
+                                 response.headers, **kwargs)
 
 
 def request_hook(response, **kwargs):
+    return _decode_response(response, None, **kwargs)
+
+
+def make_request_hook(hint_cache=None):
+    """make a response hook like request_hook(), using the given options
+
+    @param hint_cache: a cache of encodings per site, used and updated
+        according to response.url (EncodingHintCache; optional)
+    """
+    def hook(response, **kwargs):
+        return _decode_response(response, hint_cache, **kwargs)
+    return hook
+
+
+def _decode_response(response, hint_cache, **kwargs):
     stream = kwargs.get('stream', False)
     if stream:
         return
 
-    ud = make_UnicodeDammit(response.content, response.headers)
-    response.encoding = ud.original_encoding
-    response._content = ud.detector.markup
+    decode_result = decode_html_result(response.content, response.headers,
+                                       hint_cache=hint_cache, url=response.url)
+    response.encoding = decode_result.encoding
+    response._content = decode_result.markup
     return response
 
 
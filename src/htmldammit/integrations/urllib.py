@@ -1,16 +1,89 @@
 import six.moves.urllib.request as urllib_request
 
-from htmldammit.contenttypes import get_content_type, ContentTypeHeader
-from htmldammit.core import decode_html
+from htmldammit.contenttypes import get_content_type, parse_content_type
+from htmldammit.core import DecodeResult, decode_html, decode_html_result, \
+    resolve_html_encoding, strip_byte_order_mark, _decode_resolved, \
+    _iter_decoded_chunks, _parse_lxml_html
+from htmldammit.streaming import IncrementalHtmlDecoder, iter_chunks, \
+    iter_decode_html, iter_lxml_html_events, parse_lxml_html_chunks
 
 
-def get_response_html(response):
-    return decode_html(response.read(), response.info())
+def get_response_html(response, hint_cache=None):
+    """decode a response's body
+
+    @param hint_cache: a cache of encodings per site, used and updated
+        according to the response's URL (EncodingHintCache; optional)
+    """
+    return decode_html(response.read(), response.info(),
+                       hint_cache=hint_cache, url=response.geturl())
+
+
+def iter_response_html(response, chunk_size=64 * 1024, **kwargs):
+    """decode a response's body incrementally, yielding chunks of text
+
+    Further keyword arguments are passed on to IncrementalHtmlDecoder.
+    """
+    return iter_decode_html(iter_chunks(response, chunk_size),
+                            response.info(), **kwargs)
+
+
+def parse_response_lxml_html(response, chunk_size=64 * 1024, **kwargs):
+    """parse a response's body with lxml while it is being read
+
+    Further keyword arguments are passed on to parse_lxml_html_chunks().
+    """
+    kwargs.setdefault('base_url', response.geturl())
+    return parse_lxml_html_chunks(iter_chunks(response, chunk_size),
+                                  response.info(), **kwargs)
+
+
+def iter_response_lxml_events(response, chunk_size=64 * 1024, **kwargs):
+    """parse a response's body with lxml, yielding events as they're parsed
+
+    Further keyword arguments are passed on to iter_lxml_html_events().
+    """
+    kwargs.setdefault('base_url', response.geturl())
+    return iter_lxml_html_events(iter_chunks(response, chunk_size),
+                                 response.info(), **kwargs)
 
 
 class HtmlResponse(object):
-    def __init__(self, addinfourl_obj):
+    """Wraps a response with HTML content, adding ways to get it decoded.
+
+    The body is read only once, on first use of read_html(), iter_html(),
+    parse_lxml() or html_encoding, and is kept along with the resolved
+    encoding and decoded text, so that these may be used repeatedly and in
+    any order. Reading the entire body also releases http.client keep-alive
+    connections for reuse. Other attributes are those of the wrapped
+    response.
+
+    If iter_html() is used first and iterated to the end without decoding
+    errors, the encoding it settled on is kept and used by the others, so
+    that they all agree; see DecodeResult.INCREMENTAL. Otherwise, they
+    resolve the encoding of the entire body as usual.
+    """
+
+    def __init__(self, addinfourl_obj, hint_cache=None,
+                 content_type_header=None):
+        """
+        @param addinfourl_obj: the response, e.g. as returned by urlopen(),
+            or an http.client.HTTPResponse
+        @param hint_cache: a cache of encodings per site, used and updated
+            according to the response's URL (EncodingHintCache; optional)
+        @param content_type_header: the response's parsed Content-Type
+            header, if already known (ContentTypeHeader; optional)
+        """
         self.__addinfourl_obj = addinfourl_obj
+        self.__hint_cache = hint_cache
+        self.__content_type_header = content_type_header
+        # the chunks of the body read so far, until all of it is read
+        self.__raw_chunks = []
+        # the entire body, once read
+        self.__raw_html = None
+        # the DecodeResult of resolving the encoding, once resolved
+        self.__encoding_result = None
+        # the DecodeResult of decoding the body, once decoded
+        self.__decode_result = None
 
     def __getattr__(self, name):
         return getattr(self.__addinfourl_obj, name)
@@ -24,25 +97,152 @@ class HtmlResponse(object):
     def __iter__(self):
         return iter(self.__addinfourl_obj)
 
+    @property
+    def content_type_header(self):
+        "the response's parsed Content-Type header (ContentTypeHeader)"
+        if self.__content_type_header is None:
+            self.__content_type_header = parse_content_type(
+                get_content_type(self.info()))
+        return self.__content_type_header
+
+    def __get_url(self):
+        # http.client responses only have a URL if returned by urlopen()
+        return getattr(self.__addinfourl_obj, 'url', None)
+
+    def __read_body(self):
+        if self.__raw_html is None:
+            self.__raw_chunks.append(self.__addinfourl_obj.read())
+            self.__raw_html = b''.join(self.__raw_chunks)
+            self.__raw_chunks = None
+        return self.__raw_html
+
+    def __iter_body_chunks(self, chunk_size):
+        "iterate over the body's chunks, reading those not yet read"
+        if self.__raw_html is not None:
+            yield self.__raw_html
+            return
+        # chunks may have been read by an iteration which was stopped early
+        for chunk in list(self.__raw_chunks):
+            yield chunk
+        for chunk in iter_chunks(self.__addinfourl_obj, chunk_size):
+            self.__raw_chunks.append(chunk)
+            yield chunk
+        self.__read_body()
+
+    def __resolve_encoding(self):
+        if self.__decode_result is not None:
+            return self.__decode_result
+        if self.__encoding_result is None:
+            self.__encoding_result = resolve_html_encoding(
+                self.__read_body(), self.info(),
+                hint_cache=self.__hint_cache, url=self.__get_url())
+        return self.__encoding_result
+
+    @property
+    def html_encoding(self):
+        "the encoding of the body, resolved without decoding it (str)"
+        return self.__resolve_encoding().encoding
+
+    @property
+    def decode_result(self):
+        "the DecodeResult of decoding the body, decoding it if necessary"
+        if self.__decode_result is None:
+            encoding_result = self.__encoding_result
+            if encoding_result is None:
+                self.__decode_result = decode_html_result(
+                    self.__read_body(), self.info(),
+                    hint_cache=self.__hint_cache, url=self.__get_url())
+            else:
+                self.__decode_result = _decode_resolved(encoding_result)
+                self.__encoding_result = None
+        return self.__decode_result
+
     def read_html(self):
-        return decode_html(self.read(), self.info())
+        "get the body's decoded text, decoding it on the first call"
+        return self.decode_result.text
+
+    def iter_html(self, chunk_size=64 * 1024, **kwargs):
+        """decode the body incrementally, yielding chunks of text
+
+        If the body hasn't been read yet, it is decoded while being read,
+        with the encoding settled on its first part, as by
+        IncrementalHtmlDecoder; once all of it is read, that encoding is kept
+        if the body was decoded without errors.
+        If the body has already been decoded, its text is yielded whole.
+
+        Further keyword arguments are passed on to IncrementalHtmlDecoder.
+        """
+        if self.__decode_result is not None:
+            return iter([self.__decode_result.text])
+        if self.__encoding_result is not None:
+            return _iter_decoded_chunks(self.__encoding_result.markup,
+                                        self.__encoding_result.encoding)
+        return self.__iter_decoded_body(chunk_size, kwargs)
+
+    def __iter_decoded_body(self, chunk_size, decoder_options):
+        decoder = IncrementalHtmlDecoder(self.info(), **decoder_options)
+        # whether decoding errors may have occurred; with errors='replace',
+        # these give U+FFFD characters, while with 'strict' they are raised
+        lossy = decoder.errors not in ('strict', 'replace')
+        for chunk in self.__iter_body_chunks(chunk_size):
+            text = decoder.decode(chunk)
+            if text:
+                lossy = lossy or u'\ufffd' in text
+                yield text
+        text = decoder.decode(b'', final=True)
+        lossy = lossy or u'\ufffd' in text
+        # keep the settled encoding, unless the encoding was meanwhile
+        # resolved by other means, e.g. while this iteration was paused
+        if (
+            not lossy and
+            self.__encoding_result is None and
+            self.__decode_result is None
+        ):
+            self.__encoding_result = DecodeResult(
+                None, decoder.encoding,
+                strip_byte_order_mark(self.__read_body())[0],
+                self.content_type_header.is_html, DecodeResult.INCREMENTAL)
+        if text:
+            yield text
+
+    def parse_lxml(self, parser_options=None):
+        """parse the body with lxml, reusing the encoding if already resolved
+
+        @param parser_options: further options for lxml.etree.HTMLParser
+            (dict; optional)
+        @return: the root element of the parsed document
+        """
+        encoding_result = self.__resolve_encoding()
+        return _parse_lxml_html(encoding_result.markup,
+                                encoding_result.encoding,
+                                self.__get_url(), parser_options)
 
 
 class HtmlResponseProcessor(urllib_request.BaseHandler):
     """Process HTML responses and decode the content as Unicode."""
+    def __init__(self, hint_cache=None):
+        """
+        @param hint_cache: a cache of encodings per site, used and updated
+            according to the responses' URLs (EncodingHintCache; optional)
+        """
+        self.hint_cache = hint_cache
+
     def http_response(self, request, response):
-        content_type_header = ContentTypeHeader(get_content_type(response.info()))
+        # the body isn't read here; HtmlResponse reads it when first needed
+        content_type_header = parse_content_type(
+            get_content_type(response.info()))
         if content_type_header is not None and content_type_header.is_html:
-            return HtmlResponse(response)
+            return HtmlResponse(response, self.hint_cache,
+                                content_type_header)
 
         return response
 
     https_response = http_response
 
 
-def install_html_response_processor():
+def install_html_response_processor(hint_cache=None):
     urllib_request.install_opener(
         urllib_request.build_opener(
-            HtmlResponseProcessor()
+            HtmlResponseProcessor(hint_cache)
         )
     )
@@ -0,0 +1,201 @@
+"""Aggregation of decoding metrics, exportable in Prometheus text format.
+
+    from htmldammit.core import set_instrumentation
+    from htmldammit.metrics import MetricsAggregator
+
+    metrics = MetricsAggregator()
+    set_instrumentation(metrics)
+    ...
+    print(metrics.to_prometheus())
+
+The exported metrics, each labeled by operation and stage, are:
+
+* htmldammit_stage_duration_seconds: a histogram of the time taken by each
+  stage; see htmldammit.core.DecodeResult.timings for the stages
+* htmldammit_stage_bytes_total: the number of bytes processed by each stage
+* htmldammit_results_total: the number of documents decoded or resolved,
+  also labeled by the decoding path and the source of the encoding
+* htmldammit_full_decodes_total: the number of documents decoded or
+  resolved, also labeled by the number of times all of the data was decoded
+  or validated; see htmldammit.core.DecodeResult.full_decodes
+"""
+import bisect
+import collections
+import threading
+
+__all__ = ['DEFAULT_BUCKETS', 'MetricsAggregator', 'StageMetrics']
+
+# histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0,
+)
+
+
+class StageMetrics(object):
+    """The metrics aggregated for a stage of an operation."""
+    __slots__ = ('count', 'total_ns', 'n_bytes', 'bucket_counts')
+
+    def __init__(self, n_buckets):
+        self.count = 0
+        self.total_ns = 0
+        self.n_bytes = 0
+        # non-cumulative, with an extra last bucket for longer durations
+        self.bucket_counts = [0] * (n_buckets + 1)
+
+    def copy(self):
+        other = StageMetrics(len(self.bucket_counts) - 1)
+        other.count = self.count
+        other.total_ns = self.total_ns
+        other.n_bytes = self.n_bytes
+        other.bucket_counts = list(self.bucket_counts)
+        return other
+
+    @property
+    def total_seconds(self):
+        return self.total_ns / 1e9
+
+
+def _format_labels(labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+
+
+def _format_float(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class MetricsAggregator(object):
+    """An instrumentation callback aggregating counters and histograms.
+
+    This is thread-safe; use it with htmldammit.core.set_instrumentation().
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='htmldammit'):
+        """
+        @param buckets: the upper bounds of the duration histogram buckets,
+            in seconds, in increasing order (sequence of float; optional)
+        @param prefix: the prefix of the exported metric names (str;
+            optional)
+        """
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._results = collections.Counter()
+        self._full_decodes = collections.Counter()
+
+    def __call__(self, event):
+        bucket = bisect.bisect_left(self.buckets, event.duration_ns / 1e9)
+        key = (event.operation, event.stage)
+        with self._lock:
+            metrics = self._stages.get(key)
+            if metrics is None:
+                metrics = self._stages[key] = StageMetrics(len(self.buckets))
+            metrics.count += 1
+            metrics.total_ns += event.duration_ns
+            if event.n_bytes is not None:
+                metrics.n_bytes += event.n_bytes
+            metrics.bucket_counts[bucket] += 1
+            if event.result is not None:
+                self._results[(event.operation, event.result.path,
+                               event.result.source)] += 1
+                self._full_decodes[(event.operation,
+                                    event.result.full_decodes)] += 1
+
+    def stage_metrics(self):
+        "get a copy of the metrics, keyed by (operation, stage) tuples"
+        with self._lock:
+            return dict((key, metrics.copy())
+                        for key, metrics in self._stages.items())
+
+    def result_counts(self):
+        "get the numbers of results, keyed by (operation, path, source)"
+        with self._lock:
+            return dict(self._results)
+
+    def full_decode_counts(self):
+        """get the numbers of results, keyed by (operation, full_decodes)
+
+        Documents needing more than one full decode are those in which a
+        candidate encoding was found invalid only after its prefix.
+        """
+        with self._lock:
+            return dict(self._full_decodes)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._results.clear()
+            self._full_decodes.clear()
+
+    def to_prometheus(self):
+        "export the metrics in the Prometheus text exposition format (str)"
+        stages = sorted(self.stage_metrics().items())
+        results = sorted(self.result_counts().items(),
+                         key=lambda item: [str(x) for x in item[0]])
+        duration_name = self.prefix + '_stage_duration_seconds'
+        bytes_name = self.prefix + '_stage_bytes_total'
+        results_name = self.prefix + '_results_total'
+        full_decodes_name = self.prefix + '_full_decodes_total'
+
+        lines = [
+            '# HELP {} Time taken by each stage of decoding HTML.'.format(
+                duration_name),
+            '# TYPE {} histogram'.format(duration_name),
+        ]
+        for (operation, stage), metrics in stages:
+            labels = [('operation', operation), ('stage', stage)]
+            cumulative_count = 0
+            for upper_bound, count in zip(self.buckets + (float('inf'),),
+                                          metrics.bucket_counts):
+                cumulative_count += count
+                lines.append('{}_bucket{{{}}} {}'.format(
+                    duration_name,
+                    _format_labels(labels + [('le', _format_float(upper_bound))]),
+                    cumulative_count))
+            lines.append('{}_sum{{{}}} {}'.format(
+                duration_name, _format_labels(labels),
+                _format_float(metrics.total_seconds)))
+            lines.append('{}_count{{{}}} {}'.format(
+                duration_name, _format_labels(labels), metrics.count))
+
+        lines += [
+            '# HELP {} Bytes processed by each stage of decoding HTML.'.format(
+                bytes_name),
+            '# TYPE {} counter'.format(bytes_name),
+        ]
+        for (operation, stage), metrics in stages:
+            lines.append('{}{{{}}} {}'.format(
+                bytes_name,
+                _format_labels([('operation', operation), ('stage', stage)]),
+                metrics.n_bytes))
+
+        lines += [
+            '# HELP {} HTML documents decoded, by path and encoding '
+            'source.'.format(results_name),
+            '# TYPE {} counter'.format(results_name),
+        ]
+        for (operation, path, source), count in results:
+            lines.append('{}{{{}}} {}'.format(
+                results_name,
+                _format_labels([('operation', operation), ('path', path),
+                                ('source', source or '')]),
+                count))
+
+        lines += [
+            '# HELP {} HTML documents decoded, by the number of times all '
+            'of the data was decoded.'.format(full_decodes_name),
+            '# TYPE {} counter'.format(full_decodes_name),
+        ]
+        for (operation, full_decodes), count in sorted(
+                self.full_decode_counts().items()):
+            lines.append('{}{{{}}} {}'.format(
+                full_decodes_name,
+                _format_labels([('operation', operation),
+                                ('full_decodes', full_decodes)]),
+                count))
+        return '\n'.join(lines) + '\n'
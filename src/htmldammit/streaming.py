@@ -0,0 +1,307 @@
+"""Incremental decoding of HTML arriving in chunks.
+
+The encoding is settled once enough data has arrived for the prescan (see
+htmldammit.core.PRESCAN_BYTES), using the BOM, the HTTP headers and any
+inline declaration in that data, in the same order of preference as
+decode_html(). Statistical detection, if needed, is run on that data only.
+From then on, chunks are decoded as they arrive with an incremental decoder
+from the codecs module, so multi-byte characters split between chunks are
+handled and memory use does not depend on the size of the document.
+
+    for text in iter_decode_html(response_chunks, http_headers):
+        handle(text)
+
+Undeclared data which is pure ASCII says little about its encoding, so it is
+buffered until a non-ASCII byte arrives, up to ASCII_PREFIX_BYTES, e.g.
+through a long <head>.
+
+Since the encoding can't be changed once text has been returned, data which
+later turns out to be invalid for it is decoded with replacement characters.
+
+Chunked HTML may similarly be parsed with lxml as it arrives, with
+parse_lxml_html_chunks() and iter_lxml_html_events().
+"""
+import codecs
+import itertools
+import re
+
+from htmldammit.charsets import normalize_encoding
+from htmldammit.core import FALLBACK_ENCODINGS, PRESCAN_BYTES, \
+    _FULL_HTML_RE, _discard_lxml_parser, _get_fragment_element, \
+    _get_lxml_parser, _is_valid_prefix, detect_encoding, get_encoding_info, \
+    lxml
+
+__all__ = [
+    'IncrementalHtmlDecoder', 'iter_chunks', 'iter_decode_html',
+    'iter_lxml_html_events', 'parse_lxml_html_chunks',
+]
+
+# The maximal amount of undeclared, pure ASCII data buffered before settling
+# the encoding, waiting for a non-ASCII byte to settle it by.
+ASCII_PREFIX_BYTES = 1024 * 1024
+
+_NON_ASCII_RE = re.compile(b'[\x80-\xff]')
+
+
+def _iter_utf8_chunks(chunks, encoding):
+    """transcode chunks of data to UTF-8
+
+    libxml2 doesn't support all of Python's codecs, e.g. mac_latin2, so data
+    in those is transcoded before being fed to lxml.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)('replace')
+    for chunk in chunks:
+        yield decoder.decode(chunk).encode('utf-8')
+    yield decoder.decode(b'', True).encode('utf-8')
+
+
+def _settle_encoding(data, http_headers, prescan_bytes, detector,
+                     final=True):
+    """choose the encoding of a document given its first part
+
+    @param final: whether no more data will be given; otherwise, undeclared
+        pure ASCII data shorter than ASCII_PREFIX_BYTES isn't settled
+    @return: an (encoding, data) tuple, where data has any BOM stripped, or
+        None if more data is needed
+    """
+    encoding_info = get_encoding_info(data, http_headers, prescan_bytes)
+    if (
+        not final and
+        not encoding_info.encodings_to_try_first and
+        len(data) < ASCII_PREFIX_BYTES and
+        _NON_ASCII_RE.search(data) is None
+    ):
+        return None
+    data = encoding_info.markup
+
+    for encoding in encoding_info.encodings_to_try_first:
+        if _is_valid_prefix(data, encoding):
+            return encoding, data
+
+    # pure ASCII is also considered UTF-8, being the most likely
+    # encoding of what follows
+    if data.find(b'\x00') == -1 and _is_valid_prefix(data, 'utf-8'):
+        return 'utf-8', data
+
+    detected_encoding = normalize_encoding(
+        detect_encoding(data, None, detector))
+    if detected_encoding and _is_valid_prefix(data, detected_encoding):
+        return detected_encoding, data
+
+    for encoding in FALLBACK_ENCODINGS:
+        if _is_valid_prefix(data, encoding):
+            return encoding, data
+    # not reached: the last fallback encoding accepts any data
+    raise AssertionError('no encoding could decode the data')
+
+
+class IncrementalHtmlDecoder(object):
+    """Decodes binary HTML data given in chunks.
+
+    The interface is that of codecs.IncrementalDecoder: call decode() with
+    each chunk, passing final=True with the last one (which may be empty).
+    """
+
+    def __init__(self, http_headers=None, prescan_bytes=PRESCAN_BYTES,
+                 detector=None, errors='replace'):
+        """
+        @param http_headers: the HTTP response headers (dict; optional)
+        @param prescan_bytes: the amount of data gathered before settling the
+            encoding; if None, it is settled using the first chunk alone
+            (int; optional). Undeclared pure ASCII data is gathered further;
+            see ASCII_PREFIX_BYTES.
+        @param detector: the statistical detection backend to use; see
+            htmldammit.detectors (str or Detector; optional)
+        @param errors: the error handling scheme for data which is invalid
+            for the settled encoding (str; optional)
+        """
+        self.http_headers = http_headers
+        self.prescan_bytes = prescan_bytes
+        self.detector = detector
+        self.errors = errors
+        # the settled encoding, or None if not yet settled
+        self.encoding = None
+        self._buffer = b''
+        self._decoder = None
+
+    def decode(self, data, final=False):
+        """decode a chunk of data, returning the text decoded so far
+
+        Returns an empty string until the encoding has been settled.
+        """
+        if self._decoder is None:
+            self._buffer += data
+            if len(self._buffer) < (self.prescan_bytes or 0) and not final:
+                return u''
+            settled = _settle_encoding(
+                self._buffer, self.http_headers, self.prescan_bytes,
+                self.detector, final)
+            if settled is None:
+                return u''
+            self.encoding, data = settled
+            self._buffer = None
+            self._decoder = codecs.getincrementaldecoder(self.encoding)(
+                self.errors)
+        return self._decoder.decode(data, final)
+
+    def reset(self):
+        "reset the decoder to its initial state, unsettling the encoding"
+        self.encoding = None
+        self._buffer = b''
+        self._decoder = None
+
+
+def iter_decode_html(chunks, http_headers=None, **kwargs):
+    """decode HTML given as an iterable of binary chunks, yielding text
+
+    Empty strings are not yielded.
+
+    @param chunks: an iterable of binary (i.e. encoded) chunks of HTML data
+    @param http_headers: the HTTP response headers (dict; optional)
+    @param kwargs: further options, passed on to IncrementalHtmlDecoder
+    @return: an iterator of decoded text chunks (unicode)
+    """
+    decoder = IncrementalHtmlDecoder(http_headers, **kwargs)
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def iter_chunks(source, chunk_size=64 * 1024):
+    """iterate over the chunks of data from an iterable or file-like object
+
+    @param source: an iterable of binary chunks, e.g. a requests response's
+        iter_content(), or a file-like object with a read() method, e.g. a
+        urlopen() response
+    @param chunk_size: the size of the chunks read from file-like objects
+        (int; optional)
+    """
+    if not hasattr(source, 'read'):
+        for chunk in source:
+            yield chunk
+        return
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _settle_chunks(chunks, http_headers, prescan_bytes, detector):
+    """settle the encoding of a document given in chunks
+
+    Only the chunks needed for settling the encoding are read, as by
+    IncrementalHtmlDecoder.
+
+    @return: an (encoding, chunks) tuple, where chunks is an iterator of all
+        of the chunks, with any BOM stripped
+    """
+    chunks = iter(chunks)
+    buffered = []
+    n_buffered = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        n_buffered += len(chunk)
+        if n_buffered >= (prescan_bytes or 0):
+            settled = _settle_encoding(b''.join(buffered), http_headers,
+                                       prescan_bytes, detector, final=False)
+            if settled is not None:
+                break
+    else:
+        settled = _settle_encoding(b''.join(buffered), http_headers,
+                                   prescan_bytes, detector)
+    encoding, data = settled
+    return encoding, itertools.chain([data], chunks)
+
+
+def parse_lxml_html_chunks(chunks, http_headers=None, base_url=None,
+                           parser_options=None, prescan_bytes=PRESCAN_BYTES,
+                           detector=None):
+    """parse HTML arriving in chunks with lxml, returning the root element
+
+    The encoding is settled as by IncrementalHtmlDecoder. Each chunk is then
+    fed to an lxml parser as it arrives, so that parsing proceeds while the
+    data is being received and the entire binary data is never held in
+    memory. As with make_lxml_html(), the element returned for HTML
+    fragments is that which lxml.html.fromstring() would return, e.g. the
+    <p> element for "<p>hello</p>".
+
+    @param chunks: an iterable of binary (i.e. encoded) chunks of HTML data,
+        or a file-like object to read them from; see iter_chunks()
+    @param http_headers: the HTTP response headers (dict; optional)
+    @param base_url: the URL of the document (str; optional)
+    @param parser_options: further options for lxml.etree.HTMLParser
+        (dict; optional)
+    @param prescan_bytes: the amount of data gathered before settling the
+        encoding (int; optional)
+    @param detector: the statistical detection backend to use; see
+        htmldammit.detectors (str or Detector; optional)
+    @return: the root element of the parsed document
+    """
+    if lxml is None:
+        raise Exception(
+            "lxml is not available; install lxml to use this feature")
+
+    encoding, chunks = _settle_chunks(iter_chunks(chunks), http_headers,
+                                      prescan_bytes, detector)
+    first_chunk = next(chunks)
+    is_full_html = _FULL_HTML_RE.match(first_chunk) is not None
+    chunks = itertools.chain([first_chunk], chunks)
+    try:
+        parser = _get_lxml_parser(encoding, parser_options or {})
+    except LookupError:
+        parser = _get_lxml_parser('utf-8', parser_options or {})
+        chunks = _iter_utf8_chunks(chunks, encoding)
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+        root = parser.close()
+    except Exception:
+        _discard_lxml_parser(parser)
+        raise
+    if base_url is not None:
+        root.getroottree().docinfo.URL = base_url
+    return root if is_full_html else _get_fragment_element(root)
+
+
+def iter_lxml_html_events(chunks, http_headers=None, events=('end',),
+                          tag=None, base_url=None, parser_options=None,
+                          prescan_bytes=PRESCAN_BYTES, detector=None):
+    """parse HTML arriving in chunks, yielding events as they are parsed
+
+    This uses lxml.etree.HTMLPullParser, and yields (event, element) tuples
+    as in lxml.etree.iterparse(). To keep memory use bounded for very large
+    documents, clear elements once done with them, e.g. element.clear().
+
+    See parse_lxml_html_chunks() for the other parameters.
+
+    @param events: the events to report, out of 'start', 'end', 'start-ns',
+        'end-ns' and 'comment' (tuple; optional)
+    @param tag: only report events for elements with this tag (optional)
+    """
+    if lxml is None:
+        raise Exception(
+            "lxml is not available; install lxml to use this feature")
+
+    encoding, chunks = _settle_chunks(iter_chunks(chunks), http_headers,
+                                      prescan_bytes, detector)
+    try:
+        parser = lxml.etree.HTMLPullParser(
+            events=events, tag=tag, base_url=base_url, encoding=encoding,
+            **(parser_options or {}))
+    except LookupError:
+        parser = lxml.etree.HTMLPullParser(
+            events=events, tag=tag, base_url=base_url, encoding='utf-8',
+            **(parser_options or {}))
+        chunks = _iter_utf8_chunks(chunks, encoding)
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event in parser.read_events():
+            yield event
+    parser.close()
+    for event in parser.read_events():
+        yield event
@@ -0,0 +1,63 @@
+"""Coroutines for the asyncio and aiohttp integration tests.
+
+These use async/await syntax, so this module may only be imported with
+Python 3.5 or later.
+"""
+import asyncio
+import time
+
+from htmldammit.integrations.asyncio import decode_html_async
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+async def decode_while_ticking(raw_html, ticks, n_ticks=5):
+    """decode while appending the time to ticks every 10 ms
+
+    @return: a (html, done) tuple, where done tells whether decoding was
+        done when the ticks were over
+    """
+    decoding = asyncio.ensure_future(decode_html_async(raw_html))
+    for _ in range(n_ticks):
+        ticks.append(time.time())
+        await asyncio.sleep(0.01)
+    done = decoding.done()
+    return await decoding, done
+
+
+async def decode_concurrently(decoder, raw_htmls):
+    return await asyncio.gather(*[
+        decoder.decode_html(raw_html) for raw_html in raw_htmls
+    ])
+
+
+async def fetch_html(body, content_type, decoder=None):
+    "serve a page with aiohttp, and get it with get_response_html()"
+    import aiohttp
+    import aiohttp.web
+    from htmldammit.integrations.aiohttp import get_response_html
+
+    async def handler(request):
+        return aiohttp.web.Response(
+            body=body, headers={'Content-Type': content_type})
+
+    app = aiohttp.web.Application()
+    app.router.add_get('/', handler)
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    site = aiohttp.web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    try:
+        port = runner.addresses[0][1]
+        url = 'http://127.0.0.1:{}/'.format(port)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                return await get_response_html(response, decoder)
+    finally:
+        await runner.cleanup()
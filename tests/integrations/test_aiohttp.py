@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from tests.compat import unittest
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+if aiohttp is not None and sys.version_info >= (3, 5):
+    from tests.integrations.async_helpers import fetch_html, run
+    from htmldammit.integrations.asyncio import AsyncHtmlDecoder
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+@unittest.skipIf(sys.version_info < (3, 5),
+                 'async/await requires Python 3.5 or later')
+class TestGetResponseHtml(unittest.TestCase):
+    html = u'<html><head><title>Half</title></head><body><p>½ €</p></body></html>'
+
+    def test_header_charset(self):
+        for encoding in ['utf-8', 'windows-1252', 'utf-16']:
+            result = run(fetch_html(
+                self.html.encode(encoding),
+                'text/html; charset={}'.format(encoding)))
+            self.assertEqual(self.html, result, msg=encoding)
+
+    def test_with_decoder(self):
+        decoder = AsyncHtmlDecoder(max_concurrency=1)
+        result = run(fetch_html(self.html.encode('utf-8'), 'text/html',
+                                decoder))
+        self.assertEqual(self.html, result)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import concurrent.futures
+import sys
+import threading
+import time
+
+from tests.compat import unittest, mock
+
+from htmldammit.core import decode_html_result
+
+if sys.version_info >= (3, 5):
+    from tests.integrations.async_helpers import decode_concurrently, \
+        decode_while_ticking, run
+    from htmldammit.integrations.asyncio import AsyncHtmlDecoder, \
+        decode_html_async, decode_html_result_async
+    has_async = True
+else:
+    has_async = False
+
+requires_async = unittest.skipIf(
+    not has_async, 'async/await requires Python 3.5 or later')
+
+
+class SlowDecode(object):
+    "a decode_html_result() replacement which tracks concurrent calls"
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            return decode_html_result(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@requires_async
+class UnpicklableHeaders(dict):
+    "headers which can't be sent to worker processes, as aiohttp's"
+    def __reduce__(self):
+        raise TypeError('cannot pickle headers')
+
+
+class TestDecodeHtmlAsync(unittest.TestCase):
+    def test_decode(self):
+        html = u'<html><body>₪</body></html>'
+        http_headers = {'Content-Type': 'text/html; charset=utf-8'}
+        self.assertEqual(html, run(decode_html_async(html.encode('utf-8'),
+                                                     http_headers)))
+        result = run(decode_html_result_async(html.encode('utf-8'),
+                                              http_headers))
+        self.assertEqual('utf-8', result.encoding)
+
+    def test_event_loop_is_not_blocked(self):
+        slow_decode = SlowDecode(delay=0.2)
+        ticks = []
+        with mock.patch('htmldammit.integrations.asyncio.decode_html_result',
+                        slow_decode):
+            html, done = run(decode_while_ticking(b'<p>x</p>', ticks))
+        self.assertEqual(u'<p>x</p>', html)
+        self.assertFalse(done)
+        self.assertEqual(5, len(ticks))
+
+
+@requires_async
+class TestAsyncHtmlDecoder(unittest.TestCase):
+    raw_htmls = [u'<p>{}</p>'.format(i).encode('ascii') for i in range(6)]
+    htmls = [u'<p>{}</p>'.format(i) for i in range(6)]
+
+    def test_bounded_concurrency(self):
+        slow_decode = SlowDecode()
+        decoder = AsyncHtmlDecoder(max_concurrency=2)
+        with mock.patch('htmldammit.integrations.asyncio.decode_html_result',
+                        slow_decode):
+            results = run(decode_concurrently(decoder, self.raw_htmls))
+        self.assertEqual(self.htmls, results)
+        self.assertEqual(2, slow_decode.max_active)
+
+    def test_reuse_with_another_event_loop(self):
+        slow_decode = SlowDecode(delay=0.01)
+        decoder = AsyncHtmlDecoder(max_concurrency=1)
+        with mock.patch('htmldammit.integrations.asyncio.decode_html_result',
+                        slow_decode):
+            for _ in range(2):
+                results = run(decode_concurrently(decoder, self.raw_htmls))
+                self.assertEqual(self.htmls, results)
+        self.assertEqual(1, slow_decode.max_active)
+
+    def test_options(self):
+        decoder = AsyncHtmlDecoder(trusted_fast_path=False)
+        raw_html = b'\xef\xbb\xbf<p>x</p>'
+        result = run(decoder.decode_html_result(raw_html))
+        self.assertEqual('valid_candidate', result.path)
+        result = run(decoder.decode_html_result(raw_html,
+                                                trusted_fast_path=True))
+        self.assertEqual('trusted_encoding', result.path)
+
+    def test_process_pool(self):
+        html = u'<p>\u05e9\u05dc\u05d5\u05dd</p>'
+        http_headers = UnpicklableHeaders({
+            'Content-Type': 'text/html; charset=windows-1255',
+        })
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            decoder = AsyncHtmlDecoder(executor)
+            result = run(decoder.decode_html_result(
+                html.encode('windows-1255'), http_headers))
+        self.assertEqual(html, result.text)
+        self.assertEqual('windows-1255', result.encoding)
+        # the data isn't sent back from the worker process
+        self.assertIsNone(result.markup)
+
+    def test_invalid_max_concurrency(self):
+        with self.assertRaises(ValueError):
+            AsyncHtmlDecoder(max_concurrency=0)
@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 import unittest
 
 import httpretty
@@ -6,7 +7,9 @@ import requests.models
 from tests.compat import html_escape, mock
 from tests.utils import multiline_string
 
-from htmldammit.integrations.requests import get_response_html, request_hook
+from htmldammit.hints import EncodingHintCache
+from htmldammit.integrations.requests import get_response_html, \
+    make_request_hook, request_hook
 
 
 windows1252_chars = set()
@@ -109,6 +112,20 @@ class TestRequestHook(unittest.TestCase):
         response = session.get('http://www.example.com')
         self.assertGreater(wrapped_hook.call_count, 0)
 
+    def test_hook_with_hint_cache(self):
+        hint_cache = EncodingHintCache()
+        session = requests.Session()
+        session.hooks['response'].append(make_request_hook(hint_cache))
+        html = u'<html><body><p>\u05e9\u05dc\u05d5\u05dd</p></body></html>'
+        httpretty.register_uri(
+            httpretty.GET, 'http://www.example.com/a',
+            body=html.encode('windows-1255'),
+            adding_headers={'Content-Type': 'text/html; charset=windows-1255'})
+        response = session.get('http://www.example.com/a')
+        self.assertEqual(html, response.text)
+        self.assertEqual('windows-1255',
+                         hint_cache.get('http://www.example.com/b'))
+
     def test_inline_vs_header_charsets(self):
         html_template = multiline_string(u'''
             <html>
@@ -146,3 +163,44 @@ class TestRequestHook(unittest.TestCase):
                     msg="encoding={}, http_header_encoding={}".format(
                         encoding, http_header_encoding),
                 )
+
+
+class TestIterResponseHtml(unittest.TestCase):
+    def test_stream(self):
+        from htmldammit.integrations.requests import iter_response_html
+        html = u'<html><body>{}</body></html>'.format(u'₪' * 10000)
+        httpretty.enable()
+        try:
+            httpretty.register_uri(
+                httpretty.GET, 'http://www.example.com/',
+                body=html.encode('utf-8'),
+                adding_headers={'Content-Type': 'text/html; charset=utf-8'})
+            response = requests.get('http://www.example.com/', stream=True)
+            texts = list(iter_response_html(response, chunk_size=1000))
+        finally:
+            httpretty.disable()
+        self.assertGreater(len(texts), 1)
+        self.assertEqual(html, u''.join(texts))
+
+    def test_parse_lxml_html(self):
+        from htmldammit.integrations.requests import \
+            iter_response_lxml_events, parse_response_lxml_html
+        html = u'<html><body>{}</body></html>'.format(u'<p>\u20aa</p>' * 1000)
+        httpretty.enable()
+        try:
+            httpretty.register_uri(
+                httpretty.GET, 'http://www.example.com/lxml',
+                body=html.encode('utf-8'),
+                adding_headers={'Content-Type': 'text/html; charset=utf-8'})
+            response = requests.get('http://www.example.com/lxml', stream=True)
+            root = parse_response_lxml_html(response, chunk_size=1000)
+            response = requests.get('http://www.example.com/lxml', stream=True)
+            events = list(iter_response_lxml_events(response, chunk_size=1000,
+                                                    tag='p'))
+        finally:
+            httpretty.disable()
+        self.assertEqual(1000, len(root.xpath('//p')))
+        self.assertEqual(u'\u20aa', root.xpath('//p')[0].text)
+        self.assertEqual('http://www.example.com/lxml',
+                         root.getroottree().docinfo.URL)
+        self.assertEqual(1000, len(events))
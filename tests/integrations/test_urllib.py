@@ -1,12 +1,18 @@
+import threading
 import unittest
+from six.moves import BaseHTTPServer, http_client
 import six.moves.urllib.request as urllib_request
 
 import httpretty
 
-from tests.compat import html_escape
+from tests.compat import html_escape, mock
 from tests.utils import multiline_string
 
-from htmldammit.integrations.urllib import get_response_html, install_html_response_processor
+from htmldammit.core import DecodeResult, decode_html
+from htmldammit.hints import EncodingHintCache
+from htmldammit.integrations.urllib import HtmlResponse, get_response_html, \
+    install_html_response_processor, iter_response_html, \
+    iter_response_lxml_events, parse_response_lxml_html
 
 windows1252_chars = set()
 latin1_chars = set()
@@ -85,6 +91,37 @@ class TestGetRequestHtml(unittest.TestCase):
         result_html = get_response_html(response)
         self.assertEqual(result_html, html)
 
+    def test_iter_response_html(self):
+        html = u'<html><body>{}</body></html>'.format(u'\u20AA' * 10000)
+        headers = {'Content-Type': 'text/html; charset=utf-8'}
+        response = self._make_urlopen_response(html, 'utf-8', headers=headers)
+        texts = list(iter_response_html(response, chunk_size=1000))
+        self.assertGreater(len(texts), 1)
+        self.assertEqual(html, u''.join(texts))
+
+    def test_parse_lxml_html(self):
+        html = u'<html><body>{}</body></html>'.format(u'<p>\u20aa</p>' * 1000)
+        headers = {'Content-Type': 'text/html; charset=utf-8'}
+        response = self._make_urlopen_response(html, 'utf-8', headers=headers)
+        root = parse_response_lxml_html(response, chunk_size=1000)
+        self.assertEqual(1000, len(root.xpath('//p')))
+        self.assertEqual(u'\u20aa', root.xpath('//p')[0].text)
+
+        response = self._make_urlopen_response(html, 'utf-8', headers=headers)
+        events = list(iter_response_lxml_events(response, chunk_size=1000,
+                                                tag='p'))
+        self.assertEqual(1000, len(events))
+
+    def test_hint_cache(self):
+        hint_cache = EncodingHintCache()
+        html = u'<html><body><p>\u05e9\u05dc\u05d5\u05dd</p></body></html>'
+        headers = {'Content-Type': 'text/html; charset=windows-1255'}
+        response = self._make_urlopen_response(
+            html, 'windows-1255', url='http://www.example.com/a', headers=headers)
+        self.assertEqual(html, get_response_html(response, hint_cache))
+        self.assertEqual('windows-1255',
+                         hint_cache.get('http://www.example.com/b'))
+
     def test_inline_vs_header_charsets(self):
         html_template = multiline_string(u'''
             <html>
@@ -142,14 +179,101 @@ class TestInstallOpener(unittest.TestCase):
         response = urllib_request.urlopen('http://www.example.com/')
         self.assertEqual(response.read_html(), html)
 
-    def test_response_object_cant_read_twice(self):
-        html = 'TESTING'
+    def _urlopen_html(self, html, encoding='utf-8'):
+        content_type = 'text/html; charset={}'.format(encoding)
         httpretty.register_uri(httpretty.GET, 'http://www.example.com/',
-                               body=html.encode('utf-8'),
-                               adding_headers={'Content-Type': 'text/html; charset=utf-8'})
+                               body=html.encode(encoding),
+                               adding_headers={'Content-Type': content_type})
+        return urllib_request.urlopen('http://www.example.com/')
+
+    def test_response_object_reads_once(self):
+        html = u'TESTING \u20AC'
+        response = self._urlopen_html(html)
+        self.assertTrue(response.content_type_header.is_html)
+        self.assertEqual(html, response.read_html())
+        # the body has been read, but is kept
+        self.assertEqual(b'', response.read())
+        self.assertEqual(html, response.read_html())
+        self.assertEqual('utf-8', response.html_encoding)
+        self.assertEqual([html], list(response.iter_html()))
+        self.assertIs(response.decode_result, response.decode_result)
+
+    def test_iter_html(self):
+        html = u'<html><body>{}</body></html>'.format(u'\u20AA' * 10000)
+        response = self._urlopen_html(html)
+        texts = list(response.iter_html(chunk_size=1000))
+        self.assertGreater(len(texts), 1)
+        self.assertEqual(html, u''.join(texts))
+        self.assertEqual(html, response.read_html())
+
+    def test_iter_html_stopped_early(self):
+        html = u'<html><body>{}</body></html>'.format(u'\u20AA' * 10000)
+        response = self._urlopen_html(html)
+        next(response.iter_html(chunk_size=1000, prescan_bytes=None))
+        self.assertEqual(html, response.read_html())
+        self.assertEqual(html, u''.join(response.iter_html()))
+
+    def _urlopen_undeclared(self, body):
+        httpretty.register_uri(httpretty.GET, 'http://www.example.com/',
+                               body=body,
+                               adding_headers={'Content-Type': 'text/html'})
+        return urllib_request.urlopen('http://www.example.com/')
+
+    def test_iter_html_encoding_is_kept(self):
+        html = u'<html><body>{}</body></html>'.format(u'\u20AA' * 10000)
+        response = self._urlopen_undeclared(html.encode('utf-8'))
+        self.assertEqual(html, u''.join(response.iter_html(chunk_size=1000)))
+        with mock.patch('htmldammit.integrations.urllib.decode_html_result') \
+                as mock_decode_html_result:
+            self.assertEqual('utf-8', response.html_encoding)
+            self.assertEqual(html, response.read_html())
+        mock_decode_html_result.assert_not_called()
+        self.assertEqual(DecodeResult.INCREMENTAL,
+                         response.decode_result.path)
+
+    def test_iter_html_errors_arent_kept(self):
+        # the first part is UTF-8, so UTF-8 is settled on, while the rest
+        # is in windows-1252
+        body = (b'<html><body>\xe2\x82\xac' + b'x' * 2000 +
+                b'\xe9</body></html>')
+        response = self._urlopen_undeclared(body)
+        text = u''.join(response.iter_html(chunk_size=1000,
+                                           prescan_bytes=None))
+        self.assertEqual(u'\ufffd</body></html>', text[-15:])
+        # the entire body is decoded without errors
+        expected = decode_html(body, {'Content-Type': 'text/html'})
+        self.assertEqual(expected, response.read_html())
+        self.assertNotIn(u'\ufffd', response.read_html())
+        self.assertNotEqual(DecodeResult.INCREMENTAL,
+                            response.decode_result.path)
+        self.assertEqual(expected, u''.join(response.iter_html()))
+
+    def test_parse_lxml(self):
+        html = u'<html><body>{}</body></html>'.format(
+            u'<p>\u05e9\u05dc\u05d5\u05dd</p>' * 100)
+        response = self._urlopen_html(html, 'windows-1255')
+        with mock.patch('htmldammit.integrations.urllib.decode_html_result') \
+                as mock_decode_html_result:
+            root = response.parse_lxml()
+            self.assertEqual(100, len(root.xpath('//p')))
+            self.assertEqual(u'\u05e9\u05dc\u05d5\u05dd',
+                             root.xpath('//p')[0].text)
+            self.assertEqual('http://www.example.com/',
+                             root.getroottree().docinfo.URL)
+            self.assertEqual(html, u''.join(response.iter_html()))
+            # the encoding already resolved is reused
+            self.assertEqual(html, response.read_html())
+            self.assertEqual(100, len(response.parse_lxml().xpath('//p')))
+        mock_decode_html_result.assert_not_called()
+        self.assertEqual('windows-1255', response.html_encoding)
+        self.assertEqual(2, response.decode_result.full_decodes)
+
+    def test_non_html_response_isnt_wrapped(self):
+        httpretty.register_uri(httpretty.GET, 'http://www.example.com/',
+                               body=b'{}',
+                               adding_headers={'Content-Type': 'application/json'})
         response = urllib_request.urlopen('http://www.example.com/')
-        self.assertEqual(response.read_html(), html)
-        self.assertFalse(response.read_html())
+        self.assertNotIsInstance(response, HtmlResponse)
 
     def test_inline_vs_header_charsets(self):
         html_template = multiline_string(u'''
@@ -187,3 +311,43 @@ class TestInstallOpener(unittest.TestCase):
                     msg="encoding={}, http_header_encoding={}".format(
                         encoding, http_header_encoding),
                 )
+
+
+class _HtmlRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = u'<html><body><p>\u20AC</p></body></html>'.encode('utf-8')
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpClientResponse(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                             _HtmlRequestHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_keep_alive_connection(self):
+        connection = http_client.HTTPConnection(*self.server.server_address)
+        self.addCleanup(connection.close)
+        html = _HtmlRequestHandler.body.decode('utf-8')
+        for _i in range(2):
+            connection.request('GET', '/')
+            response = HtmlResponse(connection.getresponse())
+            self.assertTrue(response.content_type_header.is_html)
+            self.assertEqual(html, response.read_html())
+            self.assertEqual(html, response.read_html())
+            self.assertTrue(response.isclosed())
+            self.assertEqual('p', response.parse_lxml().xpath('//p')[0].tag)
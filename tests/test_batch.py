@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import concurrent.futures
+import mmap
+import threading
+
+from tests.compat import unittest
+
+from htmldammit.batch import decode_html_batch
+
+
+def make_items(n):
+    htmls = [u'<p>שלום {}</p>'.format(i) for i in range(n)]
+    items = [
+        (html.encode('utf-8'), {'Content-Type': 'text/html; charset=utf-8'})
+        for html in htmls
+    ]
+    return htmls, items
+
+
+class _ImmediateExecutor(concurrent.futures.Executor):
+    "runs calls when they are submitted, keeping their futures"
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args, **kwargs))
+        self.submitted.append(future)
+        return future
+
+
+class TestDecodeHtmlBatch(unittest.TestCase):
+    def test_thread_pool_ordered(self):
+        htmls, items = make_items(50)
+        results = list(decode_html_batch(items, executor='thread',
+                                         max_workers=3, chunksize=4))
+        self.assertEqual(list(range(50)), [r.index for r in results])
+        self.assertEqual(htmls, [r.result.text for r in results])
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertTrue(all(r.result.markup is None for r in results))
+
+    def test_process_pool_unordered(self):
+        htmls, items = make_items(20)
+        results = list(decode_html_batch(iter(items), executor='process',
+                                         max_workers=2, chunksize=3,
+                                         ordered=False))
+        self.assertEqual(list(range(20)), sorted(r.index for r in results))
+        for r in results:
+            self.assertEqual(htmls[r.index], r.result.text)
+
+    def test_given_executor(self):
+        htmls, items = make_items(10)
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            results = list(decode_html_batch(items, executor=executor))
+            # the executor is not shut down
+            self.assertEqual(1, executor.submit(int, '1').result())
+        self.assertEqual(htmls, [r.result.text for r in results])
+
+    def test_chunks_in_flight_are_bounded(self):
+        htmls, items = make_items(10)
+        executor = _ImmediateExecutor()
+        results = decode_html_batch(items, executor=executor, max_workers=1,
+                                    chunksize=1)
+        self.assertEqual(htmls[0], next(results).result.text)
+        self.assertEqual(2, len(executor.submitted))
+        self.assertEqual(htmls[1:], [r.result.text for r in results])
+
+    def test_options_are_passed_on(self):
+        _htmls, items = make_items(5)
+        results = decode_html_batch(items, executor='thread',
+                                    trusted_fast_path=False)
+        self.assertEqual(['utf-8'] * 5, [r.result.encoding for r in results])
+
+    def test_error_capture(self):
+        _htmls, items = make_items(5)
+        items[2] = (None, None)
+        results = list(decode_html_batch(items, executor='thread',
+                                         chunksize=2))
+        self.assertEqual([0, 1, 2, 3, 4], [r.index for r in results])
+        self.assertIsNone(results[2].result)
+        self.assertIsInstance(results[2].error, Exception)
+        self.assertIsNotNone(results[3].result)
+
+        with self.assertRaises(Exception):
+            list(decode_html_batch(items, executor='thread',
+                                   capture_errors=False))
+
+    def test_process_pool_buffers(self):
+        htmls, items = make_items(3)
+        items[1] = (memoryview(items[1][0]), items[1][1])
+        buf = mmap.mmap(-1, len(items[2][0]))
+        self.addCleanup(buf.close)
+        buf.write(items[2][0])
+        items[2] = (buf, items[2][1])
+        results = list(decode_html_batch(items, executor='process',
+                                         max_workers=1, chunksize=1))
+        self.assertEqual(htmls, [r.result.text for r in results])
+
+    def test_chunk_error_capture(self):
+        htmls, items = make_items(3)
+        # can't be pickled to send to a worker process
+        items[1] = (threading.Lock(), None)
+        results = list(decode_html_batch(items, executor='process',
+                                         max_workers=1, chunksize=1))
+        self.assertEqual([0, 1, 2], [r.index for r in results])
+        self.assertEqual(htmls[0], results[0].result.text)
+        self.assertIsNone(results[1].result)
+        self.assertIsInstance(results[1].error, Exception)
+        self.assertEqual(htmls[2], results[2].result.text)
+
+        with self.assertRaises(Exception):
+            list(decode_html_batch(items, executor='process', max_workers=1,
+                                   chunksize=1, capture_errors=False))
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            list(decode_html_batch([], executor='fork'))
+        with self.assertRaises(ValueError):
+            list(decode_html_batch([], executor='thread', chunksize=0))
+        for option in ['hint_cache', 'url']:
+            with self.assertRaises(TypeError):
+                list(decode_html_batch([], executor='thread',
+                                       **{option: None}))
@@ -0,0 +1,90 @@
+import codecs
+
+from tests.compat import unittest
+
+from htmldammit.charsets import ENCODING_LABELS, deduplicate_encodings, \
+    label_encodings, normalize_encoding, normalize_encodings
+
+
+class TestNormalizeEncoding(unittest.TestCase):
+    def test_labels(self):
+        for (label, encoding) in [
+            ('utf-8', 'utf-8'),
+            ('UTF8', 'utf-8'),
+            (' utf-8\t', 'utf-8'),
+            ('x-sjis', 'cp932'),
+            ('iso_8859-1:1987', 'windows-1252'),
+            ('latin1', 'windows-1252'),
+            ('us-ascii', 'windows-1252'),
+            ('unicode', 'utf-16le'),
+            ('gb2312', 'gb18030'),
+            ('ks_c_5601-1987', 'cp949'),
+            ('ISO-8859-8-I', 'iso-8859-8'),
+        ]:
+            self.assertEqual(encoding, normalize_encoding(label), msg=label)
+
+    def test_other_labels_known_to_python(self):
+        self.assertEqual('utf-32le', normalize_encoding('UTF-32LE'))
+        self.assertEqual('cp437', normalize_encoding('cp437'))
+
+    def test_unusable_labels(self):
+        for label in [None, '', 'no-such-encoding', 'replacement',
+                      'iso-2022-kr', 'x-user-defined']:
+            self.assertIsNone(normalize_encoding(label), msg=label)
+
+    def test_non_text_codecs(self):
+        for label in ['base64', 'hex', 'zlib', 'bz2', 'uu', 'rot13',
+                      'quopri', 'undefined']:
+            self.assertIsNone(normalize_encoding(label), msg=label)
+
+    def test_index_encodings_are_known_to_python(self):
+        for (label, encoding) in ENCODING_LABELS.items():
+            if encoding is not None:
+                codecs.lookup(encoding)
+
+
+class TestNormalizeEncodings(unittest.TestCase):
+    def test_normalize_encodings(self):
+        self.assertEqual(
+            ['windows-1252', 'utf-8'],
+            normalize_encodings(['latin1', None, 'bogus', 'utf8',
+                                 'ISO-8859-1', 'utf-8']),
+        )
+
+    def test_deduplicates_by_codec(self):
+        self.assertEqual(['utf-32le'],
+                         normalize_encodings(['utf-32le', 'utf_32_le']))
+
+
+class TestLabelEncodings(unittest.TestCase):
+    def test_label_encodings(self):
+        for (label, encodings) in [
+            ('utf8', ['utf-8']),
+            ('latin1', ['windows-1252', 'iso-8859-1']),
+            ('Windows-1252', ['windows-1252', 'iso-8859-1']),
+            ('US-ASCII ', ['utf-8', 'windows-1252', 'iso-8859-1']),
+            ('bogus', []),
+            (None, []),
+        ]:
+            self.assertEqual(encodings, label_encodings(label), msg=label)
+
+    def test_declared_labels(self):
+        for (label, header_encodings, declared_encodings) in [
+            ('utf-16', ['utf-16le'], ['utf-8']),
+            ('UTF-16BE', ['utf-16be'], ['utf-8']),
+            ('utf-32le', ['utf-32le'], ['utf-8']),
+            ('x-user-defined', [], ['windows-1252', 'iso-8859-1']),
+            ('koi8-r', ['koi8-r'], ['koi8-r']),
+            (None, [], []),
+        ]:
+            self.assertEqual(header_encodings, label_encodings(label),
+                             msg=label)
+            self.assertEqual(declared_encodings,
+                             label_encodings(label, declared=True), msg=label)
+
+    def test_deduplicate_encodings(self):
+        self.assertEqual(
+            ['windows-1252', 'iso-8859-1', 'utf-8'],
+            deduplicate_encodings(['windows-1252', None, 'iso-8859-1',
+                                   'utf-8', 'cp1252', 'utf8']),
+        )
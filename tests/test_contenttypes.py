@@ -1,6 +1,18 @@
-from tests.compat import unittest
+from tests.compat import mock, unittest
 
-from htmldammit.contenttypes import get_content_type, ContentTypeHeader
+try:
+    import multidict
+except ImportError:
+    multidict = None
+
+try:
+    from urllib3 import HTTPHeaderDict
+except ImportError:
+    HTTPHeaderDict = None
+
+from htmldammit import contenttypes
+from htmldammit.contenttypes import get_content_type, parse_content_type, \
+    ContentTypeHeader
 
 
 class TestContentTypeHeader(unittest.TestCase):
@@ -25,6 +37,76 @@ class TestContentTypeHeader(unittest.TestCase):
             self.assertEqual(is_xml, content_type_header.is_xml)
             self.assertEqual(charset, content_type_header.charset)
 
+    def test_parameters(self):
+        sample_headers = [
+            # (header, mime_type, params)
+            ('text/html', 'text/html', {}),
+            ('Text/HTML ;CharSet = UTF-8 ; level=1', 'text/html',
+             {'charset': 'UTF-8', 'level': '1'}),
+            ('text/html; charset="utf-8"', 'text/html', {'charset': 'utf-8'}),
+            ('text/html; a="x;\\"y\\""; charset=koi8-r', 'text/html',
+             {'a': 'x;"y"', 'charset': 'koi8-r'}),
+            ('text/html; charset=utf-8; charset=latin1', 'text/html',
+             {'charset': 'utf-8'}),
+            ('text/html; flag; charset=utf-8', 'text/html',
+             {'flag': None, 'charset': 'utf-8'}),
+            ('text/html charset=utf-8', None, {}),
+            ('W#&%)@(#*&%M', None, {}),
+        ]
+        for (header, mime_type, params) in sample_headers:
+            content_type_header = ContentTypeHeader(header)
+            self.assertEqual(mime_type, content_type_header.mime_type,
+                             msg=header)
+            self.assertEqual(params, content_type_header.params, msg=header)
+
+    def test_empty_charset(self):
+        self.assertIsNone(ContentTypeHeader('text/html; charset=').charset)
+        self.assertIsNone(ContentTypeHeader('text/html; charset=""').charset)
+
+    def test_immutable(self):
+        content_type_header = ContentTypeHeader('text/html')
+        with self.assertRaises(AttributeError):
+            content_type_header.charset = 'utf-8'
+        with self.assertRaises(AttributeError):
+            del content_type_header.is_html
+        with self.assertRaises(AttributeError):
+            content_type_header.other = 1
+
+    def test_params_are_read_only(self):
+        content_type_header = ContentTypeHeader('text/html; charset=utf-8')
+        self.assertEqual('utf-8', content_type_header.params['charset'])
+        with self.assertRaises(TypeError):
+            content_type_header.params['charset'] = 'ascii'
+        with self.assertRaises(TypeError):
+            del content_type_header.params['charset']
+        self.assertEqual('utf-8', content_type_header.charset)
+
+
+class TestParseContentType(unittest.TestCase):
+    def setUp(self):
+        contenttypes._parsed_content_types.clear()
+
+    def test_none(self):
+        self.assertIsNone(parse_content_type(None))
+
+    def test_reuse(self):
+        content_type_header = parse_content_type('text/html; charset=utf-8')
+        self.assertEqual('utf-8', content_type_header.charset)
+        self.assertIs(content_type_header,
+                      parse_content_type('text/html; charset=utf-8'))
+        self.assertIsNot(content_type_header,
+                         parse_content_type('text/html; charset=UTF-8'))
+
+    def test_cache_size(self):
+        with mock.patch.object(contenttypes, 'CONTENT_TYPE_CACHE_SIZE', 2):
+            first = parse_content_type('text/html')
+            parse_content_type('text/xml')
+            parse_content_type('text/html')
+            parse_content_type('text/plain')
+            self.assertEqual(2, len(contenttypes._parsed_content_types))
+            self.assertIs(first, parse_content_type('text/html'))
+            self.assertNotIn('text/xml', contenttypes._parsed_content_types)
+
 
 class TestGetContentType(unittest.TestCase):
     def test_without_headers(self):
@@ -90,3 +172,89 @@ class TestGetContentType(unittest.TestCase):
             # test with no headers
             http_headers = message_class()
             self.assertEqual(None, get_content_type(http_headers))
+
+    def test_header_lists(self):
+        self.assertEqual(None, get_content_type([]))
+        self.assertEqual(None, get_content_type([('Content-Length', '42')]))
+        self.assertEqual('VALUE', get_content_type([
+            ('Content-Length', '42'),
+            ('content-TYPE', 'VALUE'),
+        ]))
+        self.assertEqual('VALUE', get_content_type((('Content-Type', 'VALUE'),)))
+
+    def test_bytes(self):
+        self.assertEqual('text/html; charset=utf-8', get_content_type([
+            (b'Content-Type', b'text/html; charset=utf-8'),
+        ]))
+        self.assertEqual('VALUE', get_content_type({b'content-type': 'VALUE'}))
+
+    def test_wsgi_environ(self):
+        environ = {
+            'wsgi.version': (1, 0),
+            'CONTENT_TYPE': 'text/html',
+            'CONTENT_LENGTH': '42',
+        }
+        self.assertEqual('text/html', get_content_type(environ))
+        environ['CONTENT_TYPE'] = ''
+        self.assertEqual(None, get_content_type(environ))
+
+    def test_repeated_headers(self):
+        tests = [
+            (['text/plain', 'text/html'], 'text/html'),
+            (['text/html', '*/*'], 'text/html'),
+            (['text/html', ')(Q*&POIP)'], 'text/html'),
+            (['text/html; charset=gbk', 'text/html'], 'text/html; charset=gbk'),
+            (['text/html; charset=gbk', 'text/html; charset=utf-8'],
+             'text/html; charset=utf-8'),
+            (['text/plain; charset=gbk', 'text/html'], 'text/html'),
+            (['BAD', ')(Q*&POIP)'], ')(Q*&POIP)'),
+            # values combined into one, as done by e.g. urllib3
+            (['text/plain, text/html'], 'text/html'),
+            (['text/html; charset="a,b"'], 'text/html; charset="a,b"'),
+        ]
+        for values, expected in tests:
+            with self.subTest(values=values):
+                http_headers = [('Content-Type', value) for value in values]
+                self.assertEqual(expected, get_content_type(http_headers))
+
+    def test_repeated_headers_in_message(self):
+        import email.message
+        http_headers = email.message.Message()
+        http_headers['Content-Type'] = 'text/plain'
+        http_headers['Content-Type'] = 'text/html'
+        self.assertEqual('text/html', get_content_type(http_headers))
+
+    @unittest.skipIf(multidict is None, 'multidict is not installed')
+    def test_multidicts(self):
+        pairs = [('Content-Type', 'text/plain'), ('content-type', 'text/html')]
+        for http_headers in [
+            multidict.CIMultiDict(pairs),
+            multidict.CIMultiDictProxy(multidict.CIMultiDict(pairs)),
+            multidict.MultiDict(pairs),
+            multidict.MultiDictProxy(multidict.MultiDict(pairs)),
+        ]:
+            with self.subTest(headers_class=type(http_headers)):
+                self.assertEqual('text/html', get_content_type(http_headers))
+
+    @unittest.skipIf(HTTPHeaderDict is None, 'urllib3 is not installed')
+    def test_urllib3_header_dict(self):
+        http_headers = HTTPHeaderDict()
+        http_headers.add('Content-Type', 'text/plain')
+        http_headers.add('content-type', 'text/html')
+        self.assertEqual('text/html', get_content_type(http_headers))
+
+    def test_register_headers_class(self):
+        class Headers(object):
+            def __init__(self, content_types):
+                self.content_types = content_types
+
+        class SubHeaders(Headers):
+            pass
+
+        with mock.patch.dict(contenttypes._header_getters), \
+                mock.patch.dict(contenttypes._header_getters_by_type):
+            contenttypes.register_headers_class(
+                Headers, lambda http_headers: http_headers.content_types)
+            self.assertEqual('VALUE', get_content_type(Headers(['VALUE'])))
+            self.assertEqual('VALUE', get_content_type(SubHeaders(['VALUE'])))
+            self.assertEqual(None, get_content_type(Headers([])))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from tests.compat import unittest, mock
+
+from htmldammit.core import DecodeResult, decode_html_result
+from htmldammit import detectors
+from htmldammit.detectors import Detector, available_detectors, \
+    get_default_detector, get_detector, register_detector, \
+    set_default_detector
+
+
+class DetectorsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(set_default_detector, 'auto')
+        patcher = mock.patch.dict(detectors._detectors)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestGetDetector(DetectorsTestCase):
+    def test_none(self):
+        self.assertIs(detectors.NO_DETECTOR, get_detector('none'))
+        self.assertIsNone(get_detector('none').detect(b'\xe1\xe2\xe3'))
+
+    def test_auto(self):
+        auto = get_detector('auto')
+        self.assertEqual(available_detectors()[0], auto.name)
+        self.assertIs(auto, get_default_detector())
+
+    def test_auto_without_libraries(self):
+        with mock.patch.object(detectors, '_LIBRARY_BACKENDS', []), \
+                mock.patch.dict(detectors._detectors,
+                                {'none': detectors.NO_DETECTOR}, clear=True):
+            self.assertIs(detectors.NO_DETECTOR, get_detector('auto'))
+            self.assertEqual(['none'], available_detectors())
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            get_detector('no-such-detector')
+        with self.assertRaises(ValueError):
+            set_default_detector('no-such-detector')
+
+    def test_missing_library(self):
+        with mock.patch.object(detectors, '_LIBRARY_BACKENDS',
+                               ['htmldammit_no_such_module']):
+            with self.assertRaises(ImportError):
+                get_detector('htmldammit_no_such_module')
+
+    def test_detector_instance(self):
+        detector = Detector('custom', lambda data: 'koi8-r')
+        self.assertIs(detector, get_detector(detector))
+
+
+class TestSelectingDetectors(DetectorsTestCase):
+    raw_html = u'<html><body>ЖЖЖ</body></html>'.encode('koi8-r')
+
+    def test_register_and_select_per_call(self):
+        detect = mock.Mock(return_value='koi8-r')
+        register_detector('custom', detect)
+        self.assertIn('custom', available_detectors())
+
+        result = decode_html_result(self.raw_html, detector='custom')
+        self.assertEqual('koi8-r', result.encoding)
+        self.assertEqual(DecodeResult.VALID_CANDIDATE, result.path)
+        detect.assert_called_once_with(self.raw_html)
+
+    def test_select_globally(self):
+        register_detector('custom', lambda data: 'koi8-r')
+        set_default_detector('custom')
+        self.assertEqual('custom', get_default_detector().name)
+        self.assertEqual('koi8-r', decode_html_result(self.raw_html).encoding)
+
+    def test_no_detection(self):
+        set_default_detector('none')
+        result = decode_html_result(self.raw_html)
+        self.assertEqual('windows-1252', result.encoding)
+
+    def test_auto_is_reserved(self):
+        with self.assertRaises(ValueError):
+            register_detector('auto', lambda data: None)
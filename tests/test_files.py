@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import io
+import zlib
+
+from tests.utils import TempDirTestCase
+
+from htmldammit.files import decode_html_file, iter_archive_html
+
+
+HTML = u'<html><head><meta charset="{charset}"></head><body><p>½ € שלום</p></body></html>'
+
+
+def make_http_response(body, content_type='text/html', extra_headers=b''):
+    return (
+        b'HTTP/1.1 200 OK\r\n'
+        b'Content-Type: ' + content_type.encode('ascii') + b'\r\n' +
+        extra_headers +
+        b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n'
+        b'\r\n' + body
+    )
+
+
+def make_warc_record(record_type, url, block,
+                     content_type='application/http; msgtype=response'):
+    return (
+        b'WARC/1.0\r\n'
+        b'WARC-Type: ' + record_type.encode('ascii') + b'\r\n'
+        b'WARC-Target-URI: ' + url.encode('ascii') + b'\r\n'
+        b'Content-Type: ' + content_type.encode('ascii') + b'\r\n'
+        b'Content-Length: ' + str(len(block)).encode('ascii') + b'\r\n'
+        b'\r\n' + block + b'\r\n\r\n'
+    )
+
+
+def make_arc_record(url, block, content_type='text/html'):
+    return (
+        url.encode('ascii') + b' 127.0.0.1 20170101000000 ' +
+        content_type.encode('ascii') + b' ' +
+        str(len(block)).encode('ascii') + b'\n' + block + b'\n'
+    )
+
+
+def gzip_member(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class TestDecodeHtmlFile(TempDirTestCase):
+    def test_path_and_file_objects(self):
+        for encoding, html in [
+            ('utf-8', HTML.format(charset='utf-8')),
+            ('utf-16', HTML.format(charset='utf-16')),
+            ('windows-1255', HTML.replace(u'½ ', u'').format(
+                charset='windows-1255')),
+        ]:
+            raw_html = html.encode(encoding)
+            http_headers = {'Content-Type': 'text/html'}
+            path = self.write_file('page.html', raw_html)
+
+            self.assertEqual(html, decode_html_file(path, http_headers))
+            with open(path, 'rb') as f:
+                self.assertEqual(html, decode_html_file(f, http_headers))
+            self.assertEqual(
+                html, decode_html_file(io.BytesIO(raw_html), http_headers))
+
+    def test_empty_file(self):
+        path = self.write_file('empty.html', b'')
+        self.assertEqual(u'', decode_html_file(path))
+
+
+class TestIterArchiveHtml(TempDirTestCase):
+    def make_warc_records(self):
+        utf8_html = HTML.format(charset='utf-8')
+        hebrew_html = u'<html><body><p>שלום</p></body></html>'
+        chunked_body = b'10\r\n' + utf8_html.encode('utf-8')[:16] + b'\r\n' + \
+            '{:x}'.format(len(utf8_html.encode('utf-8')) - 16).encode('ascii') + \
+            b'\r\n' + utf8_html.encode('utf-8')[16:] + b'\r\n0\r\n\r\n'
+        records = [
+            make_warc_record('warcinfo', '', b'software: test\r\n',
+                             content_type='application/warc-fields'),
+            make_warc_record('request', 'http://example.com/',
+                             b'GET / HTTP/1.1\r\n\r\n',
+                             content_type='application/http; msgtype=request'),
+            make_warc_record('response', 'http://example.com/',
+                             make_http_response(utf8_html.encode('utf-8'))),
+            make_warc_record('response', 'http://example.com/he',
+                             make_http_response(
+                                 hebrew_html.encode('windows-1255'),
+                                 'text/html; charset=windows-1255')),
+            make_warc_record('response', 'http://example.com/img.png',
+                             make_http_response(b'\x89PNG', 'image/png')),
+            make_warc_record('response', 'http://example.com/gz',
+                             make_http_response(
+                                 gzip_member(utf8_html.encode('utf-8')),
+                                 extra_headers=b'Content-Encoding: gzip\r\n')),
+            make_warc_record('response', 'http://example.com/chunked',
+                             make_http_response(
+                                 chunked_body,
+                                 extra_headers=b'Transfer-Encoding: chunked\r\n')),
+        ]
+        expected = [
+            ('http://example.com/', utf8_html),
+            ('http://example.com/he', hebrew_html),
+            ('http://example.com/gz', utf8_html),
+            ('http://example.com/chunked', utf8_html),
+        ]
+        return records, expected
+
+    def assert_records(self, expected, records):
+        self.assertEqual(expected,
+                         [(record.url, record.result.text) for record in records])
+        for record in records:
+            self.assertEqual(200, record.http_status)
+
+    def test_warc(self):
+        records, expected = self.make_warc_records()
+        path = self.write_file('test.warc', b''.join(records))
+        self.assert_records(expected, list(iter_archive_html(path)))
+        with open(path, 'rb') as f:
+            self.assert_records(expected, list(iter_archive_html(f)))
+        self.assert_records(
+            expected, list(iter_archive_html(io.BytesIO(b''.join(records)))))
+
+    def test_warc_gz_member_per_record(self):
+        records, expected = self.make_warc_records()
+        path = self.write_file(
+            'test.warc.gz', b''.join(gzip_member(record) for record in records))
+        self.assert_records(expected, list(iter_archive_html(path)))
+
+    def test_warc_gz_single_member(self):
+        records, expected = self.make_warc_records()
+        path = self.write_file('test.warc.gz', gzip_member(b''.join(records)))
+        self.assert_records(expected, list(iter_archive_html(path)))
+
+    def test_html_only(self):
+        records, expected = self.make_warc_records()
+        path = self.write_file('test.warc', b''.join(records))
+        urls = [record.url for record in iter_archive_html(path, html_only=False)]
+        self.assertIn('http://example.com/img.png', urls)
+
+    def test_lazy(self):
+        records, expected = self.make_warc_records()
+        path = self.write_file('test.warc', b''.join(records))
+        iterator = iter_archive_html(path)
+        self.assertEqual(expected[0][0], next(iterator).url)
+        iterator.close()
+
+    def test_arc(self):
+        html = HTML.format(charset='utf-8')
+        arc = (
+            make_arc_record('filedesc://test.arc', b'1 0 test\nURL IP-address\n',
+                            content_type='text/plain') + b'\n' +
+            make_arc_record('http://example.com/',
+                            make_http_response(html.encode('utf-8')))
+        )
+        for data in [arc, gzip_member(arc)]:
+            path = self.write_file('test.arc', data)
+            self.assert_records([('http://example.com/', html)],
+                                list(iter_archive_html(path)))
+
+    def test_not_an_archive(self):
+        path = self.write_file('page.html', b'<html></html>')
+        with self.assertRaises(ValueError):
+            list(iter_archive_html(path))
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+from tests.compat import mock, unittest
+from tests.utils import TempDirTestCase
+
+from htmldammit.core import DecodeResult, decode_html_result
+from htmldammit.hints import EncodingHintCache, HintCacheStats, \
+    MemoryHintStore, SQLiteHintStore, host_key, url_prefix_key
+
+
+class TestKeyFunctions(unittest.TestCase):
+    def test_host_key(self):
+        self.assertEqual('example.com', host_key('http://Example.com:8080/a/b'))
+        self.assertIsNone(host_key('page.html'))
+
+    def test_url_prefix_key(self):
+        key_func = url_prefix_key(1)
+        self.assertEqual('example.com/site1',
+                         key_func('http://example.com/site1/page.html'))
+        self.assertEqual('example.com/site1',
+                         key_func('http://example.com/site1/'))
+        self.assertEqual('example.com/site1',
+                         key_func('http://example.com/site1/sub/page.html'))
+        self.assertEqual('example.com', key_func('http://example.com/page.html'))
+        self.assertIsNone(key_func('page.html'))
+
+
+class TestEncodingHintCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = EncodingHintCache()
+        self.assertIsNone(cache.get('http://example.com/'))
+        cache.set('http://example.com/a', 'windows-1255')
+        self.assertEqual('windows-1255', cache.get('http://example.com/b'))
+        self.assertIsNone(cache.get('http://example.org/'))
+        cache.invalidate('http://example.com/')
+        self.assertIsNone(cache.get('http://example.com/a'))
+        self.assertEqual(HintCacheStats(0, 0, 0), cache.stats())
+
+    def test_lru_eviction(self):
+        cache = EncodingHintCache(max_size=2)
+        cache.set('http://a.com/', 'utf-8')
+        cache.set('http://b.com/', 'utf-8')
+        cache.get('http://a.com/')
+        cache.set('http://c.com/', 'utf-8')
+        self.assertEqual(2, len(cache))
+        self.assertEqual('utf-8', cache.get('http://a.com/'))
+        self.assertIsNone(cache.get('http://b.com/'))
+        self.assertEqual('utf-8', cache.get('http://c.com/'))
+
+    def test_ttl(self):
+        clock = mock.Mock(return_value=0)
+        cache = EncodingHintCache(ttl=10, clock=clock)
+        cache.set('http://a.com/', 'big5')
+        clock.return_value = 10
+        self.assertEqual('big5', cache.lookup('http://a.com/'))
+        cache.confirm('http://a.com/', 'big5')
+        clock.return_value = 20
+        self.assertEqual('big5', cache.get('http://a.com/'))
+        clock.return_value = 21
+        self.assertIsNone(cache.get('http://a.com/'))
+
+    def test_stats(self):
+        cache = EncodingHintCache()
+        self.assertIsNone(cache.lookup('http://a.com/'))
+        cache.set('http://a.com/', 'big5')
+        self.assertEqual('big5', cache.lookup('http://a.com/'))
+        cache.confirm('http://a.com/', 'big5')
+        self.assertEqual('big5', cache.lookup('http://a.com/'))
+        cache.reject('http://a.com/')
+        self.assertIsNone(cache.get('http://a.com/'))
+
+        stats = cache.stats()
+        self.assertEqual(HintCacheStats(hits=1, misses=1, overrides=1), stats)
+        self.assertAlmostEqual(1.0 / 3, stats.hit_rate)
+        cache.clear()
+        self.assertEqual(0, cache.stats().hit_rate)
+
+    def test_threads(self):
+        cache = EncodingHintCache(max_size=50)
+
+        def worker(n):
+            for i in range(1000):
+                url = 'http://host{}.com/'.format(i % 100)
+                if cache.lookup(url) is None:
+                    cache.set(url, 'utf-8')
+                else:
+                    cache.confirm(url, 'utf-8')
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4000, cache.stats().lookups)
+        self.assertEqual(50, len(cache))
+
+
+class TestDecodeWithHintCache(unittest.TestCase):
+    url = 'http://example.com/page.html'
+    html = u'<html><body><p>שלום עולם</p></body></html>'
+    http_headers = {'Content-Type': 'text/html'}
+
+    def test_fills_and_uses_cache(self):
+        cache = EncodingHintCache()
+        declared = u'<html><head><meta charset="windows-1255"></head>' \
+            u'<body><p>שלום</p></body></html>'
+        result = decode_html_result(declared.encode('windows-1255'),
+                                    self.http_headers,
+                                    hint_cache=cache, url=self.url)
+        self.assertEqual(declared, result.text)
+        self.assertEqual('windows-1255', cache.get(self.url))
+
+        # a page from the same site without any declaration
+        with mock.patch('htmldammit.core.detect_encoding') as detect_encoding:
+            result = decode_html_result(self.html.encode('windows-1255'),
+                                        hint_cache=cache,
+                                        url='http://example.com/other.html')
+            self.assertEqual(0, detect_encoding.call_count)
+        self.assertEqual(self.html, result.text)
+        self.assertEqual('windows-1255', result.encoding)
+        self.assertEqual(DecodeResult.ENCODING_HINT, result.path)
+        self.assertEqual(HintCacheStats(hits=1, misses=1, overrides=0),
+                         cache.stats())
+
+    def test_without_url(self):
+        cache = EncodingHintCache()
+        cache.set(self.url, 'windows-1255')
+        result = decode_html_result(self.html.encode('windows-1255'),
+                                    hint_cache=cache)
+        self.assertNotEqual(DecodeResult.ENCODING_HINT, result.path)
+        self.assertEqual(HintCacheStats(0, 0, 0), cache.stats())
+
+    def test_utf8_and_ascii_before_hint(self):
+        cache = EncodingHintCache()
+        cache.set(self.url, 'windows-1255')
+        result = decode_html_result(self.html.encode('utf-8'),
+                                    hint_cache=cache, url=self.url)
+        self.assertEqual(self.html, result.text)
+        self.assertEqual(DecodeResult.ASCII_OR_UTF8, result.path)
+        self.assertEqual('utf-8', cache.get(self.url))
+
+        decode_html_result(b'<html></html>', hint_cache=cache, url=self.url)
+        self.assertEqual('utf-8', cache.get(self.url))
+
+    def test_declared_encoding_overrides_hint(self):
+        cache = EncodingHintCache()
+        cache.set(self.url, 'windows-1255')
+        html = u'<html><head><meta charset="iso-8859-8"></head>' \
+            u'<body><p>שלום</p></body></html>'
+        result = decode_html_result(html.encode('iso-8859-8'),
+                                    self.http_headers,
+                                    hint_cache=cache, url=self.url)
+        self.assertEqual(html, result.text)
+        self.assertEqual(DecodeResult.VALID_CANDIDATE, result.path)
+        self.assertEqual(HintCacheStats(hits=0, misses=0, overrides=1),
+                         cache.stats())
+        self.assertEqual('iso-8859-8', cache.get(self.url))
+
+    def test_invalid_hint(self):
+        cache = EncodingHintCache()
+        cache.set(self.url, 'ascii')
+        result = decode_html_result(self.html.encode('windows-1255'),
+                                    hint_cache=cache, url=self.url,
+                                    detector='none')
+        self.assertEqual(DecodeResult.VALID_CANDIDATE, result.path)
+        self.assertEqual(HintCacheStats(hits=0, misses=0, overrides=1),
+                         cache.stats())
+        # the fallback encoding used isn't remembered
+        self.assertEqual(DecodeResult.SOURCE_FALLBACK, result.source)
+        self.assertIsNone(cache.get(self.url))
+
+
+class HintStoreTests(object):
+    def make_store(self):
+        raise NotImplementedError
+
+    def test_store(self):
+        store = self.make_store()
+        self.assertEqual(0, len(store))
+        self.assertIsNone(store.get('example.com'))
+        store.set('example.com', 'utf-8', 1.0)
+        store.set('example.com', 'big5', 2.0)
+        store.set('example.org', 'utf-8', 3.0)
+        self.assertEqual(('big5', 2.0), store.get('example.com'))
+        self.assertEqual(2, len(store))
+        self.assertEqual([('example.com', 'big5', 2.0),
+                          ('example.org', 'utf-8', 3.0)],
+                         sorted(store.items()))
+        store.delete('example.com')
+        self.assertIsNone(store.get('example.com'))
+        store.clear()
+        self.assertEqual(0, len(store))
+
+    def test_cache_with_store(self):
+        cache = EncodingHintCache(store=self.make_store())
+        cache.set('http://example.com/', 'big5')
+        self.assertEqual('big5', cache.lookup('http://example.com/a'))
+        cache.confirm('http://example.com/a', 'big5')
+        self.assertEqual(1, len(cache))
+
+
+class TestMemoryHintStore(HintStoreTests, unittest.TestCase):
+    def make_store(self):
+        return MemoryHintStore()
+
+
+class TestSQLiteHintStore(HintStoreTests, TempDirTestCase):
+    def make_store(self, **kwargs):
+        store = SQLiteHintStore(os.path.join(self.tempdir, 'hints.sqlite'),
+                                **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_shared_between_stores(self):
+        cache1 = EncodingHintCache(store=self.make_store())
+        cache2 = EncodingHintCache(store=self.make_store())
+        cache1.set('http://example.com/', 'shift_jis')
+        self.assertEqual('shift_jis', cache2.get('http://example.com/'))
+
+    def test_persistent(self):
+        store = self.make_store()
+        store.set('example.com', 'big5', 1.0)
+        store.close()
+        self.assertEqual(('big5', 1.0), self.make_store().get('example.com'))
+
+    def test_reconnects_after_fork(self):
+        store = self.make_store()
+        store.set('example.com', 'big5', 1.0)
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            self.assertEqual(('big5', 1.0), store.get('example.com'))
+            store.close()
+
+    def test_max_size(self):
+        store = self.make_store(max_size=2)
+        for i in range(3):
+            store.set('host{}.com'.format(i), 'utf-8', float(i))
+        store._local.writes = 0
+        store.set('host3.com', 'utf-8', 3.0)
+        self.assertEqual(['host2.com', 'host3.com'],
+                         sorted(key for key, _, _ in store.items()))
+
+
+class TestSnapshots(TempDirTestCase):
+    def test_round_trip(self):
+        clock = mock.Mock(return_value=100)
+        cache = EncodingHintCache(ttl=50, clock=clock)
+        cache.set('http://old.com/', 'big5')
+        clock.return_value = 200
+        cache.set('http://a.com/', 'windows-1255')
+        cache.set('http://b.com/', 'utf-8')
+
+        path = os.path.join(self.tempdir, 'hints.json')
+        cache.save_snapshot(path)
+
+        new_cache = EncodingHintCache(ttl=50, clock=clock)
+        clock.return_value = 220
+        new_cache.set('http://b.com/', 'shift_jis')
+        self.assertEqual(1, new_cache.load_snapshot(path))
+        self.assertEqual('windows-1255', new_cache.get('http://a.com/'))
+        self.assertEqual('shift_jis', new_cache.get('http://b.com/'))
+        self.assertIsNone(new_cache.get('http://old.com/'))
+
+    def test_unsupported_version(self):
+        path = os.path.join(self.tempdir, 'hints.json')
+        with open(path, 'w') as f:
+            f.write('{"version": 999, "hints": []}')
+        with self.assertRaises(ValueError):
+            EncodingHintCache().load_snapshot(path)
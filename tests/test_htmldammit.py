@@ -1,10 +1,21 @@
+import mmap
+import pickle
+import tempfile
+import threading
+
+import bs4
+import lxml.etree
 import six
 
 from tests.compat import unittest, mock
 from tests.utils import multiline_string
 
-from htmldammit import decode_html, make_lxml_html
-from htmldammit.core import make_UnicodeDammit
+from htmldammit import core, decode_html, make_lxml_html, make_soup
+from htmldammit.core import PRESCAN_BYTES, DecodeResult, \
+    decode_html_result, find_declared_encoding, make_detection_sample, \
+    make_UnicodeDammit, resolve_html_encoding
+from htmldammit.detectors import Detector
+from htmldammit.hints import EncodingHintCache
 
 
 class TestDecodeHtml(unittest.TestCase):
@@ -73,6 +84,596 @@ class TestDecodeHtml(unittest.TestCase):
             self.assertEqual(html, decode_html(html.encode(encoding)))
 
 
+class TestDecodeHtmlResult(unittest.TestCase):
+    html = u'<html><head><meta charset="{charset}"></head><body>\u00E1</body></html>'
+
+    def test_bom_is_trusted(self):
+        for encoding, bom in [('utf-8', b'\xef\xbb\xbf'), ('utf-16le', b'\xff\xfe')]:
+            html = self.html.format(charset='windows-1252')
+            result = decode_html_result(bom + html.encode(encoding))
+            self.assertEqual(html, result.text)
+            self.assertEqual(encoding, result.encoding)
+            self.assertEqual(DecodeResult.TRUSTED_ENCODING, result.path)
+
+    def test_matching_header_and_declaration_are_trusted(self):
+        html = self.html.format(charset='utf8')
+        http_headers = {'Content-Type': 'text/html; charset=UTF-8'}
+        result = decode_html_result(html.encode('utf-8'), http_headers)
+        self.assertEqual(html, result.text)
+        self.assertEqual(DecodeResult.TRUSTED_ENCODING, result.path)
+
+        result = decode_html_result(html.encode('utf-8'), http_headers,
+                                    trusted_fast_path=False)
+        self.assertEqual(html, result.text)
+        self.assertEqual(DecodeResult.VALID_CANDIDATE, result.path)
+
+    def test_conflicting_header_and_declaration(self):
+        html = self.html.format(charset='utf-8')
+        http_headers = {'Content-Type': 'text/html; charset=windows-1252'}
+        result = decode_html_result(html.encode('utf-8'), http_headers)
+        self.assertEqual(html, result.text)
+        self.assertEqual(DecodeResult.VALID_CANDIDATE, result.path)
+
+    def test_trusted_encoding_decode_failure(self):
+        html = self.html.format(charset='utf-8')
+        http_headers = {'Content-Type': 'text/html; charset=utf-8'}
+        result = decode_html_result(html.encode('windows-1252'), http_headers)
+        self.assertNotEqual('utf-8', result.encoding)
+        self.assertEqual(DecodeResult.VALID_CANDIDATE, result.path)
+
+    def test_latin1_with_bytes_undefined_in_windows_1252(self):
+        raw_html = b'<p>caf\xe9 \x81 na\xefve</p>'
+        for charset in ['iso-8859-1', 'latin1', 'windows-1252']:
+            for count in [1, 50]:
+                http_headers = {
+                    'Content-Type': 'text/html; charset={}'.format(charset),
+                }
+                result = decode_html_result(raw_html * count, http_headers)
+                self.assertEqual(u'<p>caf\xe9 \x81 na\xefve</p>' * count,
+                                 result.text, msg=(charset, count))
+                self.assertEqual('iso-8859-1', result.encoding)
+                self.assertEqual(DecodeResult.SOURCE_HTTP_HEADER,
+                                 result.source)
+
+    def test_non_text_codec_declared(self):
+        raw_html = b'<p>caf\xe9</p>'
+        for charset in ['base64', 'hex', 'zlib', 'bz2', 'uu', 'rot13',
+                        'quopri', 'undefined']:
+            http_headers = {
+                'Content-Type': 'text/html; charset={}'.format(charset),
+            }
+            self.assertEqual(
+                u'<p>caf\xe9</p>',
+                decode_html(raw_html, http_headers, detector='none'),
+                msg=charset)
+            hint_cache = EncodingHintCache()
+            hint_cache.set('http://example.com/', charset)
+            result = decode_html_result(raw_html, detector='none',
+                                        hint_cache=hint_cache,
+                                        url='http://example.com/')
+            self.assertEqual(u'<p>caf\xe9</p>', result.text, msg=charset)
+
+    def test_utf16_declared_inline(self):
+        html = (u'<html><head><meta charset="utf-16"></head>'
+                u'<body>\u05e9\u05dc\u05d5\u05dd</body></html>')
+        result = decode_html_result(html.encode('utf-8'),
+                                    {'Content-Type': 'text/html'})
+        self.assertEqual(html, result.text)
+        self.assertEqual('utf-8', result.encoding)
+        self.assertEqual(DecodeResult.SOURCE_DECLARATION, result.source)
+
+    def test_ascii_declared_utf8(self):
+        html = u'<p>Caf\u00E9</p>'
+        for declaration in ['', '<meta charset="us-ascii">']:
+            http_headers = {'Content-Type': 'text/html; charset=us-ascii'}
+            result = decode_html_result(
+                (declaration + html).encode('utf-8'), http_headers)
+            self.assertEqual(declaration + html, result.text)
+            self.assertEqual('utf-8', result.encoding)
+
+        # non-UTF-8 data is decoded as windows-1252, as browsers do
+        result = decode_html_result(html.encode('windows-1252'),
+                                    {'Content-Type': 'text/html; charset=ascii'})
+        self.assertEqual(html, result.text)
+        self.assertEqual('windows-1252', result.encoding)
+
+    def test_undeclared_ascii_or_utf8(self):
+        for html, encoding in [
+            (u'<html><body>Hello ASCII!</body></html>', 'ascii'),
+            (u'<html><body>\u05e9\u05dc\u05d5\u05dd</body></html>', 'utf-8'),
+        ]:
+            result = decode_html_result(html.encode(encoding))
+            self.assertEqual(html, result.text)
+            self.assertEqual(encoding, result.encoding)
+            self.assertEqual(DecodeResult.ASCII_OR_UTF8, result.path)
+
+    def test_undeclared_utf8_with_nul(self):
+        # not taken as UTF-8 by the fast path, but still valid UTF-8
+        word = u'\u041f\u0440\u0438\u0432\u0435\u0442 '
+        html = u'<p>{}</p>\x00'.format(word * 20)
+        for detector in [None, 'none']:
+            result = decode_html_result(html.encode('utf-8'),
+                                        detector=detector)
+            self.assertEqual(html, result.text)
+            self.assertEqual('utf-8', result.encoding)
+            self.assertEqual(DecodeResult.VALID_CANDIDATE, result.path)
+            self.assertEqual('utf-8', resolve_html_encoding(
+                html.encode('utf-8'), detector=detector).encoding)
+
+    def test_undeclared_legacy_encoding(self):
+        html = u'<html><body>\u00E1</body></html>'
+        result = decode_html_result(html.encode('windows-1252'))
+        self.assertEqual(DecodeResult.VALID_CANDIDATE, result.path)
+
+    def test_undeclared_utf16_without_bom(self):
+        html = u'<html><body>Hello ASCII!</body></html>'
+        result = decode_html_result(html.encode('utf-16le'))
+        self.assertEqual(DecodeResult.VALID_CANDIDATE, result.path)
+
+    def test_text_is_returned_as_is(self):
+        html = u'<html><body><p>\u05e9\u05dc\u05d5\u05dd</p></body></html>'
+        http_headers = {'Content-Type': 'text/html; charset=windows-1255'}
+        self.assertEqual(html, decode_html(html, http_headers))
+        result = decode_html_result(html, http_headers)
+        self.assertEqual(html, result.text)
+        self.assertIsNone(result.encoding)
+        self.assertEqual(DecodeResult.ALREADY_DECODED, result.path)
+
+        result = resolve_html_encoding(html, http_headers)
+        self.assertIsNone(result.encoding)
+        self.assertEqual(DecodeResult.ALREADY_DECODED, result.path)
+
+        root = make_lxml_html(html, http_headers)
+        self.assertEqual(u'\u05e9\u05dc\u05d5\u05dd', root.xpath('//p')[0].text)
+        soup = make_soup(html, http_headers)
+        self.assertEqual(u'\u05e9\u05dc\u05d5\u05dd', soup.p.string)
+
+
+class TestDecodeResultProvenance(unittest.TestCase):
+    html = u'<html><head>{meta}</head><body>\u05e9\u05dc\u05d5\u05dd</body></html>'
+    meta = u'<meta charset="{}">'
+
+    def decode(self, raw_html, http_headers=None, **kwargs):
+        results = [
+            decode_html_result(raw_html, http_headers, **kwargs),
+            resolve_html_encoding(raw_html, http_headers, **kwargs),
+        ]
+        for result in results:
+            self.assertIn('total', result.timings)
+            self.assertTrue(all(isinstance(ns, six.integer_types) and ns >= 0
+                                for ns in result.timings.values()))
+        return results
+
+    def assert_provenance(self, results, source, candidates, stages):
+        for result in results:
+            self.assertEqual(source, result.source)
+            self.assertEqual(candidates, result.candidates)
+            self.assertEqual(set(stages) |
+                             {'http_headers', 'bom', 'prescan', 'total'},
+                             set(result.timings))
+
+    def test_replacement_characters(self):
+        raw_html = b'<p>caf\xe9</p>'
+        for result in self.decode(raw_html):
+            self.assertFalse(result.contains_replacement_characters)
+
+        resolved = DecodeResult(None, 'utf-8', raw_html, True,
+                                DecodeResult.INCREMENTAL)
+        result = core._decode_resolved(resolved, errors='replace')
+        self.assertEqual(u'<p>caf\ufffd</p>', result.text)
+        self.assertTrue(result.contains_replacement_characters)
+        # such results aren't remembered as hints
+        hint_cache = EncodingHintCache()
+        core._remember_encoding(hint_cache, 'http://example.com/', result)
+        self.assertIsNone(hint_cache.lookup('http://example.com/'))
+
+    def test_slots(self):
+        result = decode_html_result(b'<p>x</p>')
+        self.assertFalse(hasattr(result, '__dict__'))
+        with self.assertRaises(AttributeError):
+            result.foo = 1
+
+    def test_pickle(self):
+        result = pickle.loads(pickle.dumps(decode_html_result(b'<p>x</p>')))
+        self.assertEqual(u'<p>x</p>', result.text)
+        self.assertEqual(DecodeResult.SOURCE_ASCII_OR_UTF8, result.source)
+
+    def test_bom(self):
+        raw_html = b'\xff\xfe' + self.html.format(meta=u'').encode('utf-16le')
+        self.assert_provenance(self.decode(raw_html), DecodeResult.SOURCE_BOM,
+                               ('utf-16le',), ['trusted'])
+
+    def test_declaration(self):
+        html = self.html.format(meta=self.meta.format('windows-1255'))
+        raw_html = html.encode('windows-1255')
+        http_headers = {'Content-Type': 'text/html; charset=windows-1255'}
+        self.assert_provenance(self.decode(raw_html, http_headers),
+                               DecodeResult.SOURCE_DECLARATION,
+                               ('windows-1255',), ['trusted'])
+
+        http_headers = {'Content-Type': 'text/html; charset=utf-8'}
+        self.assert_provenance(self.decode(raw_html, http_headers),
+                               DecodeResult.SOURCE_DECLARATION,
+                               ('windows-1255',), ['validation'])
+
+    def test_http_header(self):
+        html = self.html.format(meta=self.meta.format('utf-8'))
+        raw_html = html.encode('windows-1255')
+        http_headers = {'Content-Type': 'text/html; charset=windows-1255'}
+        self.assert_provenance(self.decode(raw_html, http_headers),
+                               DecodeResult.SOURCE_HTTP_HEADER,
+                               ('utf-8', 'windows-1255'), ['validation'])
+
+    def test_ascii_or_utf8(self):
+        raw_html = self.html.format(meta=u'').encode('utf-8')
+        self.assert_provenance(self.decode(raw_html),
+                               DecodeResult.SOURCE_ASCII_OR_UTF8,
+                               ('utf-8',), ['ascii_or_utf8'])
+
+    def test_detection_and_fallback(self):
+        raw_html = self.html.format(meta=u'').encode('windows-1255')
+        detector = Detector('test', lambda data: 'windows-1255')
+        self.assert_provenance(self.decode(raw_html, detector=detector),
+                               DecodeResult.SOURCE_DETECTION,
+                               ('utf-8', 'windows-1255'),
+                               ['ascii_or_utf8', 'detection', 'validation'])
+
+        self.assert_provenance(self.decode(raw_html, detector='none'),
+                               DecodeResult.SOURCE_FALLBACK,
+                               ('utf-8', 'windows-1252'),
+                               ['ascii_or_utf8', 'detection', 'validation'])
+
+    def test_hint(self):
+        raw_html = self.html.format(meta=u'').encode('windows-1255')
+        hint_cache = EncodingHintCache()
+        hint_cache.set('http://example.com/', 'windows-1255')
+        self.assert_provenance(
+            self.decode(raw_html, hint_cache=hint_cache,
+                        url='http://example.com/'),
+            DecodeResult.SOURCE_HINT, ('utf-8', 'windows-1255'),
+            ['ascii_or_utf8', 'hint'])
+
+
+class TestInstrumentation(unittest.TestCase):
+    raw_html = u'<html><head><meta charset="windows-1255"></head>' \
+        u'<body>\u05e9\u05dc\u05d5\u05dd</body></html>'.encode('windows-1255')
+    http_headers = {'Content-Type': 'text/html'}
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(core.get_instrumentation())
+
+    def test_set_instrumentation(self):
+        callback = mock.Mock()
+        self.assertIsNone(core.set_instrumentation(callback))
+        try:
+            self.assertIs(callback, core.get_instrumentation())
+            decode_html(self.raw_html, self.http_headers)
+        finally:
+            self.assertIs(callback, core.set_instrumentation(None))
+        self.assertGreater(callback.call_count, 0)
+
+    def test_decode_events(self):
+        events = []
+        with core.instrumentation(events.append):
+            result = decode_html_result(self.raw_html, self.http_headers)
+        self.assertIsNone(core.get_instrumentation())
+
+        self.assertEqual(
+            set(result.timings),
+            set(event.stage for event in events))
+        self.assertTrue(all(event.operation == 'decode' for event in events))
+        for event in events:
+            self.assertEqual(result.timings[event.stage], event.duration_ns)
+        by_stage = dict((event.stage, event) for event in events)
+        self.assertIsNone(by_stage['http_headers'].n_bytes)
+        self.assertEqual(4, by_stage['bom'].n_bytes)
+        self.assertEqual(len(self.raw_html), by_stage['prescan'].n_bytes)
+        self.assertEqual(len(self.raw_html), by_stage['total'].n_bytes)
+        self.assertIs(result, by_stage['total'].result)
+        self.assertIsNone(by_stage['prescan'].result)
+
+    def test_lxml_events(self):
+        events = []
+        with core.instrumentation(events.append):
+            make_lxml_html(self.raw_html, self.http_headers)
+        operations_and_stages = [(event.operation, event.stage)
+                                 for event in events]
+        self.assertIn(('resolve', 'total'), operations_and_stages)
+        self.assertEqual(('parse', 'lxml_parse'), operations_and_stages[-1])
+        self.assertEqual(len(self.raw_html), events[-1].n_bytes)
+
+    def test_restored_after_error(self):
+        with self.assertRaises(ValueError):
+            with core.instrumentation(mock.Mock()):
+                raise ValueError
+        self.assertIsNone(core.get_instrumentation())
+
+
+class TestCandidateEncodings(unittest.TestCase):
+    """Tests for trying candidate encodings with few full decodes."""
+    html_headers = {'Content-Type': 'text/html; charset=utf-8'}
+
+    def decode(self, raw_html, http_headers):
+        results = [
+            decode_html_result(raw_html, http_headers),
+            resolve_html_encoding(raw_html, http_headers),
+        ]
+        self.assertEqual(results[0].encoding, results[1].encoding)
+        self.assertEqual(results[0].candidates, results[1].candidates)
+        self.assertEqual(results[0].full_decodes, results[1].full_decodes)
+        return results[0]
+
+    def test_invalid_prefix_is_not_fully_decoded(self):
+        raw_html = u'<p>\xe1</p>'.encode('windows-1252') * \
+            (core._CANDIDATE_PREFIX_BYTES // 4)
+        with mock.patch.object(core, 'detect_encoding', return_value=None):
+            result = self.decode(raw_html, self.html_headers)
+        self.assertEqual('windows-1252', result.encoding)
+        self.assertEqual(('utf-8', 'windows-1252'), result.candidates)
+        self.assertEqual(1, result.full_decodes)
+
+    def test_invalid_data_after_prefix(self):
+        raw_html = b'<p>x</p>' * (core._CANDIDATE_PREFIX_BYTES // 4) + \
+            u'<p>\xe1</p>'.encode('windows-1252')
+        with mock.patch.object(core, 'detect_encoding', return_value=None):
+            result = self.decode(raw_html, self.html_headers)
+        self.assertEqual('windows-1252', result.encoding)
+        self.assertEqual(2, result.full_decodes)
+
+    def test_codecs_are_tried_once(self):
+        # the trusted encoding fails, so it isn't tried again as a declared
+        # encoding, nor as a fallback encoding
+        html = u'<meta charset="utf8"><p>\xe1</p>'
+        with mock.patch.object(core, 'detect_encoding',
+                               return_value='UTF-8'):
+            result = self.decode(html.encode('windows-1252'),
+                                 self.html_headers)
+        self.assertEqual('windows-1252', result.encoding)
+        self.assertEqual(('utf-8', 'windows-1252'), result.candidates)
+        self.assertEqual(2, result.full_decodes)
+
+    def test_single_full_decode(self):
+        html = u'<p>\u05e9\u05dc\u05d5\u05dd</p>' * 1000
+        for http_headers in [self.html_headers, None]:
+            result = self.decode(html.encode('utf-8'), http_headers)
+            self.assertEqual(1, result.full_decodes)
+
+
+class TestResolveHtmlEncoding(unittest.TestCase):
+    html = u'<html><head><meta charset="{charset}"></head><body>\u00E1</body></html>'
+    html_headers = {'Content-Type': 'text/html'}
+
+    def assert_resolved(self, expected_encoding, expected_path, raw_html,
+                        http_headers=None, **kwargs):
+        with mock.patch('htmldammit.core.UnicodeDammit') as unicode_dammit:
+            result = resolve_html_encoding(raw_html, http_headers, **kwargs)
+            self.assertEqual(0, unicode_dammit.call_count)
+        self.assertIsNone(result.text)
+        self.assertEqual(expected_encoding, result.encoding)
+        self.assertEqual(expected_path, result.path)
+        return result
+
+    def test_bom(self):
+        html = self.html.format(charset='windows-1252')
+        result = self.assert_resolved(
+            'utf-16le', DecodeResult.TRUSTED_ENCODING,
+            b'\xff\xfe' + html.encode('utf-16le'))
+        self.assertEqual(html.encode('utf-16le'), result.markup)
+
+    def test_matching_header_and_declaration(self):
+        html = self.html.format(charset='utf8')
+        http_headers = {'Content-Type': 'text/html; charset=UTF-8'}
+        self.assert_resolved('utf-8', DecodeResult.TRUSTED_ENCODING,
+                             html.encode('utf-8'), http_headers)
+
+    def test_invalid_trusted_encoding(self):
+        html = self.html.format(charset='utf-8')
+        http_headers = {'Content-Type': 'text/html; charset=utf-8'}
+        self.assert_resolved('windows-1252', DecodeResult.VALID_CANDIDATE,
+                             html.encode('windows-1252'), http_headers,
+                             detector='none')
+
+    def test_conflicting_header_and_declaration(self):
+        html = self.html.format(charset='windows-1252')
+        http_headers = {'Content-Type': 'text/html; charset=utf-8'}
+        self.assert_resolved('windows-1252', DecodeResult.VALID_CANDIDATE,
+                             html.encode('windows-1252'), http_headers)
+
+    def test_undeclared(self):
+        self.assert_resolved('ascii', DecodeResult.ASCII_OR_UTF8,
+                             b'<html><body>ASCII</body></html>')
+        self.assert_resolved('utf-8', DecodeResult.ASCII_OR_UTF8,
+                             u'<p>\u20AA</p>'.encode('utf-8') * 50000)
+        self.assert_resolved('iso-8859-1', DecodeResult.VALID_CANDIDATE,
+                             u'<p>\u00E1\x81</p>'.encode('iso-8859-1'),
+                             detector='none')
+
+    def test_detected(self):
+        detector = Detector('test', lambda data: 'windows-1255')
+        html = u'<html><body>\u05e9\u05dc\u05d5\u05dd</body></html>'
+        self.assert_resolved('windows-1255', DecodeResult.VALID_CANDIDATE,
+                             html.encode('windows-1255'), detector=detector)
+
+    def test_same_encoding_as_decode_html_result(self):
+        for encoding in ['utf-8', 'utf-16', 'windows-1252', 'iso-8859-8']:
+            for charset in [encoding, 'utf-8', None]:
+                html = self.html.format(charset=charset or '')
+                if encoding == 'iso-8859-8':
+                    html = html.replace(u'\u00E1', u'\u05d0')
+                http_headers = {'Content-Type': 'text/html; charset=' + charset} \
+                    if charset else self.html_headers
+                raw_html = html.encode(encoding)
+                self.assertEqual(
+                    decode_html_result(raw_html, http_headers).encoding,
+                    resolve_html_encoding(raw_html, http_headers).encoding,
+                    msg='encoding={}, charset={}'.format(encoding, charset),
+                )
+
+    def test_fast_path_options(self):
+        html = self.html.format(charset='utf-8')
+        http_headers = {'Content-Type': 'text/html; charset=utf-8'}
+        self.assert_resolved('utf-8', DecodeResult.VALID_CANDIDATE,
+                             html.encode('utf-8'), http_headers,
+                             trusted_fast_path=False)
+        self.assert_resolved('utf-8', DecodeResult.VALID_CANDIDATE,
+                             u'<p>\u20AA</p>'.encode('utf-8'),
+                             utf8_fast_path=False, detector='none')
+
+        root = make_lxml_html(html.encode('utf-8'), http_headers,
+                              trusted_fast_path=False, utf8_fast_path=False)
+        self.assertEqual(u'\u00E1', root.xpath('//body')[0].text)
+        soup = make_soup(html.encode('utf-8'), http_headers,
+                         trusted_fast_path=False)
+        self.assertEqual(u'\u00E1', soup.body.string)
+
+    def test_same_result_as_decode_html_result_with_hints(self):
+        html = u'<html><body>\u05e9\u05dc\u05d5\u05dd</body></html>'
+        raw_html = html.encode('windows-1255')
+        url = 'http://www.example.com/'
+        results = []
+        for func in [decode_html_result, resolve_html_encoding]:
+            hint_cache = EncodingHintCache()
+            hint_cache.set(url, 'windows-1255')
+            results.append(func(raw_html, self.html_headers,
+                                hint_cache=hint_cache, url=url))
+        for attr in ['encoding', 'path', 'source', 'candidates',
+                     'full_decodes']:
+            self.assertEqual(getattr(results[0], attr),
+                             getattr(results[1], attr), msg=attr)
+        self.assertEqual(set(results[0].timings), set(results[1].timings))
+
+
+class TestBufferInputs(unittest.TestCase):
+    html = u'<html><head><meta charset="{charset}"></head><body><p>\u00E1</p></body></html>'
+
+    def make_buffers(self, raw_html):
+        yield bytearray(raw_html)
+        yield memoryview(raw_html)
+        with tempfile.TemporaryFile() as f:
+            f.write(raw_html)
+            f.flush()
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+    def test_decode_html(self):
+        http_headers = {'Content-Type': 'text/html'}
+        for (encoding, bom) in [('utf-8', b''), ('utf-8', b'\xef\xbb\xbf'),
+                                ('windows-1252', b''), ('utf-16le', b'\xff\xfe')]:
+            html = self.html.format(charset=encoding)
+            for buf in self.make_buffers(bom + html.encode(encoding)):
+                result = decode_html_result(buf, http_headers)
+                self.assertEqual(html, result.text)
+                self.assertIsInstance(result.markup, memoryview)
+                result.markup.release()
+
+    def test_undeclared(self):
+        for (html, encoding) in [(u'<p>\u05e9\u05dc\u05d5\u05dd</p>', 'utf-8'),
+                                 (u'<p>\u00E1 \u00E9</p>' * 10000, 'windows-1252')]:
+            detector = Detector('test', lambda data: 'windows-1252')
+            for buf in self.make_buffers(html.encode(encoding)):
+                self.assertEqual(html, decode_html(buf, detector=detector))
+
+    def test_bom_is_stripped_without_copying(self):
+        raw_html = bytearray(b'\xef\xbb\xbf<p>x</p>')
+        result = decode_html_result(raw_html)
+        raw_html[3:6] = b'<b>'
+        self.assertEqual(b'<b>x</p>', result.markup.tobytes())
+
+    def test_make_lxml_html(self):
+        html = self.html.format(charset='utf-8')
+        for buf in self.make_buffers(html.encode('utf-8')):
+            parsed = make_lxml_html(buf, base_url='http://example.com/')
+            self.assertEqual(u'\u00E1', parsed.xpath('//p/text()')[0])
+            self.assertEqual('http://example.com/',
+                             parsed.getroottree().docinfo.URL)
+
+    def test_make_lxml_html_fragments(self):
+        for raw_html in [
+            b'<p>hello</p>',
+            b'  <p>hello</p>  ',
+            b'<p>a</p><p>b</p>',
+            b'<b>a</b> and <i>b</i>',
+            b'text',
+            b'<title>t</title><p>x</p>',
+            b'<!DOCTYPE html><p>hello</p>',
+            b'\n<HTML><body><p>hello</p></body></HTML>',
+        ]:
+            expected = make_lxml_html(raw_html)
+            for buf in self.make_buffers(raw_html):
+                parsed = make_lxml_html(buf)
+                self.assertEqual(expected.tag, parsed.tag, msg=raw_html)
+                self.assertEqual(lxml.etree.tostring(expected),
+                                 lxml.etree.tostring(parsed), msg=raw_html)
+
+
+class TestDetectionSample(unittest.TestCase):
+    def test_small_data_is_not_sampled(self):
+        data = b'<p>' + b'x' * 100 + b'</p>'
+        self.assertIs(data, make_detection_sample(data, sample_bytes=1024))
+
+    def test_sample_size_is_bounded(self):
+        data = b'<p>' + b'x' * 1000 + b'</p>\n'
+        data *= 1000
+        sample = make_detection_sample(data, sample_bytes=16 * 1024)
+        self.assertLess(len(sample), 2 * 16 * 1024)
+        self.assertTrue(data.startswith(sample[:1024]))
+
+    def test_sample_prefers_non_ascii(self):
+        ascii_part = (b'<p>' + b'x' * 1000 + b'</p>\n') * 1000
+        word = u'\u05e9\u05dc\u05d5\u05dd'.encode('utf-8')
+        data = ascii_part + (b'<p>' + word + b'</p>\n') * 100 + ascii_part
+        sample = make_detection_sample(data, sample_bytes=16 * 1024)
+        self.assertIn(word, sample)
+
+    def test_decode_with_sampled_detection(self):
+        html = u'<html><body>{}</body></html>'.format(
+            u'<p>\u0412\u0441\u0435 \u0441\u0447\u0430\u0441\u0442\u043b\u0438\u0432\u044b\u0435 '
+            u'\u0441\u0435\u043c\u044c\u0438 \u043f\u043e\u0445\u043e\u0436\u0438</p>\n' * 1000)
+        with mock.patch('htmldammit.core.detect_encoding',
+                        return_value='windows-1251') as mock_detect:
+            result = decode_html_result(html.encode('windows-1251'),
+                                        detection_sample_bytes=1024)
+        mock_detect.assert_called_once_with(mock.ANY, 1024, mock.ANY)
+        self.assertEqual(html, result.text)
+        self.assertEqual('windows-1251', result.encoding)
+
+
+class TestFindDeclaredEncoding(unittest.TestCase):
+    def test_meta_charset(self):
+        raw_html = b'<html><head><meta charset="windows-1255"></head></html>'
+        self.assertEqual('windows-1255', find_declared_encoding(raw_html, is_html=True))
+        self.assertIsNone(find_declared_encoding(raw_html, is_html=False))
+
+    def test_xml_declaration(self):
+        raw_html = b'<?xml version="1.0" encoding="ISO-8859-1"?><html></html>'
+        self.assertEqual('iso-8859-1', find_declared_encoding(raw_html))
+
+    def test_not_declared(self):
+        self.assertIsNone(find_declared_encoding(b'<html></html>', is_html=True))
+        self.assertIsNone(find_declared_encoding(b'', is_html=True))
+
+    def test_prescan_window(self):
+        meta = b'<meta charset="koi8-r">'
+        padding = b'<!--' + b'-' * PRESCAN_BYTES + b'-->'
+        raw_html = b'<html><head>' + padding + meta + b'</head></html>'
+
+        self.assertIsNone(find_declared_encoding(raw_html, is_html=True))
+        self.assertEqual('koi8-r', find_declared_encoding(
+            raw_html, is_html=True, prescan_bytes=None))
+        self.assertEqual('koi8-r', find_declared_encoding(
+            raw_html, is_html=True, prescan_bytes=len(raw_html)))
+
+    def test_decode_html_prescan_bytes(self):
+        html = u'<html><head><!--{}--><meta charset="koi8-r"></head>' \
+               u'<body>\u0416</body></html>'.format(u'-' * PRESCAN_BYTES)
+        self.assertEqual(html, decode_html(
+            html.encode('koi8-r'), {'Content-Type': 'text/html'},
+            prescan_bytes=None))
+
+
 class MockUnicodeDammit(object):
     NOT_GIVEN = object()
 
@@ -112,16 +713,35 @@ class TestMakeUnicodeDammit(unittest.TestCase):
         self.assertEqual([], ud.override_encodings)
 
     def test_html_header_with_charset(self):
-        for encoding in ['utf-8', 'utf-16', 'iso-8859-1', 'windows-1252']:
+        for (charset, encodings) in [
+            ('utf-8', ['utf-8']),
+            ('UTF8', ['utf-8']),
+            ('utf-16', ['utf-16le']),
+            ('iso-8859-1', ['windows-1252', 'iso-8859-1']),
+            ('windows-1252', ['windows-1252', 'iso-8859-1']),
+            ('us-ascii', ['utf-8', 'windows-1252', 'iso-8859-1']),
+            ('utf-32le', ['utf-32le']),
+            ('no-such-encoding', []),
+            ('replacement', []),
+        ]:
             raw_html = b'BLA'
-            http_headers = {'Content-Type': 'text/html; charset={charset}'.format(charset=encoding)}
+            http_headers = {'Content-Type': 'text/html; charset={charset}'.format(charset=charset)}
 
             with mock.patch('htmldammit.core.UnicodeDammit', MockUnicodeDammit):
                 ud = make_UnicodeDammit(raw_html, http_headers)
 
             self.assertEqual(raw_html, ud.raw_html)
             self.assertEqual(True, ud.is_html)
-            self.assertEqual([encoding], ud.override_encodings)
+            self.assertEqual(encodings, ud.override_encodings)
+
+    def test_encodings_are_deduplicated(self):
+        raw_html = b'<meta charset="latin1">BLA'
+        http_headers = {'Content-Type': 'text/html; charset=ISO-8859-1'}
+
+        with mock.patch('htmldammit.core.UnicodeDammit', MockUnicodeDammit):
+            ud = make_UnicodeDammit(raw_html, http_headers)
+
+        self.assertEqual(['windows-1252', 'iso-8859-1'], ud.override_encodings)
 
     def test_xhtml_header(self):
         raw_html = b'BLA'
@@ -198,3 +818,104 @@ class TestLxmlHtml(unittest.TestCase):
 
         parsed = make_lxml_html(encoded_html)
         self.assertEqual(u'\u20AA', parsed.xpath('//p/text()')[0])
+
+    def test_encoding_unsupported_by_lxml(self):
+        # libxml2 doesn't know Python's mac_latin2 codec
+        raw_html = u'<meta charset="mac_latin2"><p>\u0141\xf3d\u017a</p>'\
+            .encode('mac_latin2')
+        parsed = make_lxml_html(raw_html, {'Content-Type': 'text/html'})
+        self.assertEqual(u'\u0141\xf3d\u017a', parsed.xpath('//p/text()')[0])
+
+
+class TestLxmlParserPool(unittest.TestCase):
+    raw_html = b'<html><body><p>Text</p><!-- comment --></body></html>'
+
+    def setUp(self):
+        core._lxml_parser_pools.__dict__.clear()
+
+    def get_parser(self, encoding='utf-8', **parser_options):
+        return core._get_lxml_parser(encoding, parser_options)
+
+    def test_reuse(self):
+        parser = self.get_parser()
+        self.assertIs(parser, self.get_parser())
+        self.assertIsNot(parser, self.get_parser('windows-1252'))
+        self.assertIsNot(parser, self.get_parser(huge_tree=True))
+        self.assertIs(parser, self.get_parser())
+
+        with mock.patch('lxml.etree.HTMLParser', wraps=lxml.etree.HTMLParser) \
+                as html_parser:
+            for _i in range(3):
+                parsed = make_lxml_html(self.raw_html)
+                self.assertEqual(u'Text', parsed.xpath('//p/text()')[0])
+        self.assertEqual(1, html_parser.call_count)
+
+    def test_pool_size(self):
+        with mock.patch.object(core, 'LXML_PARSER_POOL_SIZE', 2):
+            parser = self.get_parser('utf-8')
+            self.get_parser('windows-1252')
+            self.get_parser('iso-8859-1')
+            self.assertEqual(2, len(core._lxml_parser_pools.pool))
+            self.assertIsNot(parser, self.get_parser('utf-8'))
+
+        with mock.patch.object(core, 'LXML_PARSER_POOL_SIZE', 0):
+            self.assertIsNot(self.get_parser(), self.get_parser())
+
+    def test_per_thread(self):
+        parsers = []
+        thread = threading.Thread(target=lambda: parsers.append(self.get_parser()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(parsers[0], self.get_parser())
+
+    def test_unhashable_options(self):
+        with mock.patch('lxml.etree.HTMLParser') as html_parser:
+            self.get_parser(target=[])
+            self.get_parser(target=[])
+        self.assertEqual(2, html_parser.call_count)
+
+    def test_parser_options(self):
+        parsed = make_lxml_html(self.raw_html,
+                                parser_options={'remove_comments': True})
+        self.assertEqual(b'<html><body><p>Text</p></body></html>',
+                         lxml.etree.tostring(parsed))
+        parsed = make_lxml_html(self.raw_html)
+        self.assertEqual(self.raw_html, lxml.etree.tostring(parsed))
+
+    def test_discarded_after_error(self):
+        parser = self.get_parser('ascii')
+        with mock.patch('lxml.html.fromstring', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                make_lxml_html(self.raw_html)
+        self.assertIsNot(parser, self.get_parser('ascii'))
+
+
+class TestMakeSoup(unittest.TestCase):
+    html = u'<html><head><meta charset="windows-1255"></head>' \
+        u'<body><p>\u05e9\u05dc\u05d5\u05dd</p></body></html>'
+    http_headers = {'Content-Type': 'text/html'}
+
+    def test_parsers(self):
+        raw_html = self.html.encode('windows-1255')
+        for features in [None, 'html.parser', 'lxml', 'html5lib']:
+            with self.subTest(features=features):
+                try:
+                    soup = make_soup(raw_html, self.http_headers,
+                                     features=features)
+                except bs4.FeatureNotFound:
+                    continue
+                self.assertEqual(u'\u05e9\u05dc\u05d5\u05dd', soup.p.string)
+                self.assertEqual('windows-1255', soup.original_encoding)
+
+    def test_passes_bytes_and_encoding(self):
+        raw_html = self.html.encode('windows-1255')
+        with mock.patch('bs4.BeautifulSoup') as beautiful_soup:
+            make_soup(raw_html, self.http_headers, features='html.parser')
+        beautiful_soup.assert_called_once_with(
+            raw_html, features='html.parser', from_encoding='windows-1255')
+
+    def test_bom_and_buffer(self):
+        raw_html = bytearray(b'\xef\xbb\xbf' + self.html.encode('utf-8'))
+        soup = make_soup(raw_html, features='html.parser')
+        self.assertEqual(u'\u05e9\u05dc\u05d5\u05dd', soup.p.string)
+        self.assertEqual('utf-8', soup.original_encoding)
@@ -0,0 +1,91 @@
+import threading
+
+from tests.compat import unittest
+
+from htmldammit.core import DecodeResult, InstrumentationEvent, \
+    decode_html_result, instrumentation
+from htmldammit.metrics import MetricsAggregator
+
+
+def make_event(stage, duration_ns, n_bytes=100, result=None,
+               operation=InstrumentationEvent.DECODE):
+    return InstrumentationEvent(operation, stage, duration_ns, n_bytes, result)
+
+
+class TestMetricsAggregator(unittest.TestCase):
+    def test_aggregation(self):
+        metrics = MetricsAggregator(buckets=(1e-6, 1e-3))
+        metrics(make_event('prescan', 500))
+        metrics(make_event('prescan', 5000, n_bytes=None))
+        metrics(make_event('prescan', 5 * 10 ** 6))
+
+        stage_metrics = metrics.stage_metrics()
+        self.assertEqual([('decode', 'prescan')], list(stage_metrics))
+        prescan = stage_metrics[('decode', 'prescan')]
+        self.assertEqual(3, prescan.count)
+        self.assertEqual(200, prescan.n_bytes)
+        self.assertAlmostEqual(0.0050055, prescan.total_seconds)
+        self.assertEqual([1, 1, 1], prescan.bucket_counts)
+
+        metrics.reset()
+        self.assertEqual({}, metrics.stage_metrics())
+
+    def test_result_counts(self):
+        metrics = MetricsAggregator()
+        with instrumentation(metrics):
+            decode_html_result(b'<p>Hello</p>')
+            decode_html_result(b'<p>World</p>')
+        self.assertEqual(
+            {('decode', DecodeResult.ASCII_OR_UTF8,
+              DecodeResult.SOURCE_ASCII_OR_UTF8): 2},
+            metrics.result_counts())
+        self.assertEqual(2, metrics.stage_metrics()[('decode', 'total')].count)
+        self.assertEqual({('decode', 1): 2}, metrics.full_decode_counts())
+
+    def test_threads(self):
+        metrics = MetricsAggregator()
+
+        def worker():
+            for _i in range(1000):
+                metrics(make_event('total', 1000))
+
+        threads = [threading.Thread(target=worker) for _i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4000, metrics.stage_metrics()[('decode', 'total')].count)
+
+    def test_to_prometheus(self):
+        metrics = MetricsAggregator(buckets=(1e-6, 1e-3), prefix='test')
+        metrics(make_event('prescan', 500))
+        metrics(make_event('prescan', 5000))
+        result = DecodeResult(u'', 'utf-8', b'', True,
+                              DecodeResult.TRUSTED_ENCODING,
+                              source=DecodeResult.SOURCE_BOM, full_decodes=1)
+        metrics(make_event('total', 2 * 10 ** 9, result=result))
+
+        self.assertEqual('''\
+# HELP test_stage_duration_seconds Time taken by each stage of decoding HTML.
+# TYPE test_stage_duration_seconds histogram
+test_stage_duration_seconds_bucket{operation="decode",stage="prescan",le="1e-06"} 1
+test_stage_duration_seconds_bucket{operation="decode",stage="prescan",le="0.001"} 2
+test_stage_duration_seconds_bucket{operation="decode",stage="prescan",le="+Inf"} 2
+test_stage_duration_seconds_sum{operation="decode",stage="prescan"} 5.5e-06
+test_stage_duration_seconds_count{operation="decode",stage="prescan"} 2
+test_stage_duration_seconds_bucket{operation="decode",stage="total",le="1e-06"} 0
+test_stage_duration_seconds_bucket{operation="decode",stage="total",le="0.001"} 0
+test_stage_duration_seconds_bucket{operation="decode",stage="total",le="+Inf"} 1
+test_stage_duration_seconds_sum{operation="decode",stage="total"} 2.0
+test_stage_duration_seconds_count{operation="decode",stage="total"} 1
+# HELP test_stage_bytes_total Bytes processed by each stage of decoding HTML.
+# TYPE test_stage_bytes_total counter
+test_stage_bytes_total{operation="decode",stage="prescan"} 200
+test_stage_bytes_total{operation="decode",stage="total"} 100
+# HELP test_results_total HTML documents decoded, by path and encoding source.
+# TYPE test_results_total counter
+test_results_total{operation="decode",path="trusted_encoding",source="bom"} 1
+# HELP test_full_decodes_total HTML documents decoded, by the number of times all of the data was decoded.
+# TYPE test_full_decodes_total counter
+test_full_decodes_total{operation="decode",full_decodes="1"} 1
+''', metrics.to_prometheus())
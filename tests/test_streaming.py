@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import io
+
+import lxml.html
+
+from tests.compat import unittest, mock
+
+from htmldammit import make_lxml_html, streaming
+from htmldammit.core import PRESCAN_BYTES
+from htmldammit.detectors import Detector
+from htmldammit.streaming import IncrementalHtmlDecoder, iter_decode_html, \
+    iter_lxml_html_events, parse_lxml_html_chunks
+
+
+def detect_non_ascii(encoding):
+    "a detector giving an encoding only for data which isn't pure ASCII"
+    return Detector('test', lambda data: encoding if any(
+        byte >= 0x80 for byte in bytearray(data)) else None)
+
+
+def chunked(data, chunk_size):
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+class TestIterDecodeHtml(unittest.TestCase):
+    html = u'<html><head>{meta}</head><body>{body}</body></html>'
+
+    def make_html(self, charset=None, body=u'שלום ₪ ½ ' * 500):
+        meta = u'<meta charset="{}">'.format(charset) if charset else u''
+        return self.html.format(meta=meta, body=body)
+
+    def test_split_multibyte_characters(self):
+        html = self.make_html('utf-8')
+        raw_html = html.encode('utf-8')
+        http_headers = {'Content-Type': 'text/html'}
+        for chunk_size in [1, 2, 3, 7, 1000]:
+            texts = list(iter_decode_html(chunked(raw_html, chunk_size),
+                                          http_headers))
+            self.assertEqual(html, u''.join(texts), msg=chunk_size)
+            self.assertTrue(all(texts))
+
+    def test_encoding_sources(self):
+        html = self.make_html()
+        declared_html = self.make_html('windows-1255')
+        cases = [
+            # (html, raw_html, http_headers, expected encoding)
+            (html, b'\xff\xfe' + html.encode('utf-16le'), None, 'utf-16le'),
+            (html, html.encode('windows-1255'),
+             {'Content-Type': 'text/html; charset=windows-1255'},
+             'windows-1255'),
+            (declared_html, declared_html.encode('windows-1255'),
+             {'Content-Type': 'text/html'}, 'windows-1255'),
+            (html, html.encode('utf-8'), None, 'utf-8'),
+        ]
+        for (html, raw_html, http_headers, encoding) in cases:
+            decoder = IncrementalHtmlDecoder(http_headers)
+            text = u''.join(decoder.decode(chunk)
+                            for chunk in chunked(raw_html, 100))
+            text += decoder.decode(b'', final=True)
+            self.assertEqual(encoding, decoder.encoding)
+            self.assertEqual(html, text)
+
+    def test_invalid_declared_encoding_is_skipped(self):
+        html = self.make_html('utf-8')
+        raw_html = html.encode('windows-1255')
+        http_headers = {'Content-Type': 'text/html; charset=windows-1255'}
+        decoder = IncrementalHtmlDecoder(http_headers)
+        text = decoder.decode(raw_html, final=True)
+        self.assertEqual('windows-1255', decoder.encoding)
+        self.assertEqual(html, text)
+
+    def test_detection_uses_only_the_first_data(self):
+        raw_html = self.make_html().encode('windows-1255')
+        with mock.patch('htmldammit.streaming.detect_encoding',
+                        return_value='windows-1255') as mock_detect:
+            text = u''.join(iter_decode_html(chunked(raw_html, 10)))
+        self.assertEqual(self.make_html(), text)
+        detected_data = mock_detect.call_args[0][0]
+        self.assertGreaterEqual(len(detected_data), PRESCAN_BYTES)
+        self.assertLess(len(detected_data), PRESCAN_BYTES + 10)
+
+    def test_detected_encoding_is_normalized(self):
+        body = u'中文 ' * 500
+        raw_html = self.make_html(body=body).encode('gb18030')
+        decoder = IncrementalHtmlDecoder()
+        with mock.patch('htmldammit.streaming.detect_encoding',
+                        return_value='GB2312'):
+            text = decoder.decode(raw_html, final=True)
+        self.assertEqual('gb18030', decoder.encoding)
+        self.assertEqual(self.make_html(body=body), text)
+
+    def test_waits_for_prescan(self):
+        decoder = IncrementalHtmlDecoder()
+        self.assertEqual(u'', decoder.decode(b'<p>'))
+        self.assertIsNone(decoder.encoding)
+        self.assertEqual(u'<p>x</p>', decoder.decode(b'x</p>', final=True))
+        self.assertEqual('utf-8', decoder.encoding)
+
+        decoder.reset()
+        self.assertIsNone(decoder.encoding)
+
+    def test_undeclared_ascii_prefix(self):
+        # the first non-ASCII byte is well after the prescanned data
+        html = self.html.format(meta=u'<title>{}</title>'.format(u'x' * 3000),
+                                body=u'Привет мир ' * 500)
+        raw_html = html.encode('windows-1251')
+        detector = detect_non_ascii('windows-1251')
+        for chunk_size in [100, 1000, 100000]:
+            decoder = IncrementalHtmlDecoder(detector=detector)
+            texts = [decoder.decode(chunk)
+                     for chunk in chunked(raw_html, chunk_size)]
+            texts.append(decoder.decode(b'', final=True))
+            self.assertEqual(html, u''.join(texts), msg=chunk_size)
+            self.assertEqual('windows-1251', decoder.encoding)
+
+    def test_undeclared_ascii_prefix_is_bounded(self):
+        decoder = IncrementalHtmlDecoder()
+        with mock.patch.object(streaming, 'ASCII_PREFIX_BYTES', 2000):
+            self.assertEqual(u'', decoder.decode(b'x' * 1500))
+            self.assertEqual(u'x' * 3000, decoder.decode(b'x' * 1500))
+        self.assertEqual('utf-8', decoder.encoding)
+
+    def test_empty(self):
+        self.assertEqual([], list(iter_decode_html([])))
+        self.assertEqual([], list(iter_decode_html([b''])))
+
+
+class TestLxmlStreaming(unittest.TestCase):
+    html = u'<html><head><meta charset="windows-1255"></head><body>' + \
+        u''.join(u'<p id="p{}">שלום {}</p>'.format(i, i) for i in range(1000)) + \
+        u'</body></html>'
+    raw_html = html.encode('windows-1255')
+    http_headers = {'Content-Type': 'text/html'}
+
+    def test_parse_chunks(self):
+        for chunk_size in [1, 100, 10000, 100000]:
+            root = parse_lxml_html_chunks(chunked(self.raw_html, chunk_size),
+                                          self.http_headers)
+            paragraphs = root.xpath('//p')
+            self.assertEqual(1000, len(paragraphs), msg=chunk_size)
+            self.assertEqual(u'שלום 999', paragraphs[-1].text)
+
+    def test_parse_file_like(self):
+        root = parse_lxml_html_chunks(io.BytesIO(self.raw_html),
+                                      self.http_headers,
+                                      base_url='http://example.com/')
+        self.assertEqual(u'שלום 0', root.xpath('//p')[0].text)
+        self.assertEqual('http://example.com/', root.getroottree().docinfo.URL)
+
+    def test_parse_fragments(self):
+        for html in [b'<p>hello</p>', b'<p>hello</p><p>world</p>',
+                     b'<html><body><p>hello</p></body></html>']:
+            expected = make_lxml_html(html, self.http_headers)
+            root = parse_lxml_html_chunks(chunked(html, 5), self.http_headers)
+            self.assertEqual(expected.tag, root.tag, msg=html)
+            self.assertEqual(lxml.html.tostring(expected),
+                             lxml.html.tostring(root), msg=html)
+
+    def test_parse_bom(self):
+        raw_html = b'\xef\xbb\xbf' + u'<p>₪</p>'.encode('utf-8')
+        root = parse_lxml_html_chunks([raw_html[:2], raw_html[2:]])
+        self.assertEqual(u'₪', root.xpath('//p')[0].text)
+
+    def test_encoding_unsupported_by_lxml(self):
+        # libxml2 doesn't know Python's mac_latin2 codec
+        raw_html = u'<meta charset="mac_latin2"><p>\u0141\xf3d\u017a</p>'\
+            .encode('mac_latin2')
+        root = parse_lxml_html_chunks(chunked(raw_html, 10), self.http_headers)
+        self.assertEqual(u'\u0141\xf3d\u017a', root.xpath('//p')[0].text)
+        events = iter_lxml_html_events(chunked(raw_html, 10),
+                                       self.http_headers, tag='p')
+        self.assertEqual([u'\u0141\xf3d\u017a'],
+                         [element.text for _event, element in events])
+
+    def test_undeclared_ascii_prefix(self):
+        html = u'<html><head><title>{}</title></head><body>{}</body></html>'\
+            .format(u'x' * 3000, u'<p>Привет мир</p>' * 100)
+        raw_html = html.encode('windows-1251')
+        detector = detect_non_ascii('windows-1251')
+        root = parse_lxml_html_chunks(chunked(raw_html, 1000),
+                                      self.http_headers, detector=detector)
+        self.assertEqual(u'Привет мир', root.xpath('//p')[-1].text)
+
+    def test_parses_while_reading(self):
+        chunks = iter(chunked(self.raw_html, 1000))
+        events = iter_lxml_html_events(chunks, self.http_headers, tag='p')
+        event, element = next(events)
+        self.assertEqual(('end', u'שלום 0'), (event, element.text))
+        # most of the data hasn't been read yet
+        self.assertGreater(len(list(chunks)), 10)
+
+    def test_events(self):
+        texts = []
+        for event, element in iter_lxml_html_events(
+                chunked(self.raw_html, 100), self.http_headers, tag='p'):
+            texts.append(element.text)
+            element.clear()
+        self.assertEqual([u'שלום {}'.format(i) for i in range(1000)], texts)
@@ -1,8 +1,13 @@
+import os
 import re
+import shutil
+import tempfile
 import textwrap
 
+from tests.compat import unittest
 
-__all__ = ['multiline_string']
+
+__all__ = ['TempDirTestCase', 'multiline_string']
 
 
 def multiline_string(s):
@@ -10,3 +15,16 @@ def multiline_string(s):
     if m is not None:
         s = s[m.end():]
     return textwrap.dedent(s)
+
+
+class TempDirTestCase(unittest.TestCase):
+    "a test case with a temporary directory, removed after each test"
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def write_file(self, name, data):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path